@@ -1,6 +1,6 @@
 import json
 import re
-from utils.search_utils import perform_search
+from utils.search_utils import perform_search, perform_search_async
 from utils.search_utils import PerplexitySearch
 
 # especial for daily_med need to upgrade
@@ -61,6 +61,36 @@ Error examples:
 """
 
 
+# 版本指纹：查询模板或搜索请求参数变化时，已保存的步骤结果失效
+VERSION = PerplexitySearch.fingerprint(prompt)
+
+def _new_result():
+    return {
+        "ingredient": "",
+        "route": "",
+        "new_generate_content": "",
+        "dosage_detail": "",
+        "new_citation": "",
+        "status": "success",
+        "message": ""
+    }
+
+def _fill_result(result, result_json):
+    # 确保result_json是有效的JSON字符串
+    result_json = json.loads(result_json) if isinstance(result_json, str) else result_json
+    # 解析搜索结果 (后处理方法)
+    api_result = PerplexitySearch.extract_json_data(result_json)
+    # 提取内容 (后处理方法)
+    content_json = PerplexitySearch.extract_json_from_content(api_result.get("contents", ""))
+    
+    # 填充结果字段  (后处理方法)
+    result["new_generate_content"] = PerplexitySearch.write_to_database(content_json.get("result", ""))
+    result["ingredient"] = content_json.get("ingredients", "")
+    result["route"] = content_json.get("route", "")
+    result["dosage_detail"] = content_json.get("dosage_detail", "")
+    result["new_citation"] = api_result.get("citations", "")
+    result["original_GAI"] = result_json
+
 def clinical(ingredient, route):
     """
     处理单行数据的函数
@@ -72,15 +102,7 @@ def clinical(ingredient, route):
     返回:
         str: 包含处理结果的JSON字符串
     """
-    result = {
-        "ingredient": "",
-        "route": "",
-        "new_generate_content": "",
-        "dosage_detail": "",
-        "new_citation": "",
-        "status": "success",
-        "message": ""
-    }
+    result = _new_result()
     
     try:
         # 检查是否有有效值
@@ -88,20 +110,7 @@ def clinical(ingredient, route):
 
         # 调用API获取搜索结果
         result_json = perform_search(searchword)
-        # 确保result_json是有效的JSON字符串
-        result_json = json.loads(result_json) if isinstance(result_json, str) else result_json
-        # 解析搜索结果 (后处理方法)
-        api_result = PerplexitySearch.extract_json_data(result_json)
-        # 提取内容 (后处理方法)
-        content_json = PerplexitySearch.extract_json_from_content(api_result.get("contents", ""))
-        
-        # 填充结果字段  (后处理方法)
-        result["new_generate_content"] = PerplexitySearch.write_to_database(content_json.get("result", ""))
-        result["ingredient"] = content_json.get("ingredients", "")
-        result["route"] = content_json.get("route", "")
-        result["dosage_detail"] = content_json.get("dosage_detail", "")
-        result["new_citation"] = api_result.get("citations", "")
-        result["original_GAI"] = result_json
+        _fill_result(result, result_json)
         
     except Exception as e:
         # 发生异常时记录错误信息
@@ -111,6 +120,20 @@ def clinical(ingredient, route):
     # 将结果转换为JSON字符串并返回
     return json.dumps(result, ensure_ascii=False)
 
+async def clinical_async(ingredient, route):
+    """clinical的异步版本，参数和返回值相同"""
+    result = _new_result()
+    
+    try:
+        searchword = prompt % (ingredient, route)
+        result_json = await perform_search_async(searchword)
+        _fill_result(result, result_json)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+    
+    return json.dumps(result, ensure_ascii=False)
+
 if __name__ == "__main__":
     result=clinical("Abacavir", "Oral")
     print(type(result))
@@ -4,6 +4,8 @@ import json
 import pandas as pd
 import re
 from utils.llm_utils import AITEP
+from utils import context_packer
+from utils.json_schema import validate
 
 prompt ="""
 # **Task: Classify Study and Assign Coefficient with Rationale**
@@ -84,6 +86,52 @@ If neither explicit duration nor duration description is available, classify by
 """
 import json
 
+# 输出格式，run_llm据此请求JSON模式并校验结果
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "value": {"type": "integer", "enum": [1, 5, 10]},
+        "rationale": {"type": "string"}
+    },
+    "required": ["value", "rationale"]
+}
+LLM_MODEL = "qwen-plus"
+# 版本指纹：提示词模板、输出格式、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = AITEP.fingerprint([prompt, context_packer.fingerprint_params("F3")], LLM_MODEL, SCHEMA)
+
+def _new_result():
+    return {
+        "factors": "F3",
+        "value": None,
+        "rationale": "",
+        "GAI_original": "",
+        "status": "success",
+        "message": ""
+    }
+
+def _build_prompt(content):
+    # 只保留临床报告中与疗程和治疗类型相关的章节
+    return prompt.replace('{{CONTENT}}', context_packer.pack(content, "F3"))
+
+def _fill_result(result, llm_result):
+    """解析LLM响应，填充F3值和理由"""
+    # 存储原始响应
+    result["GAI_original"] = llm_result
+    llm_data = json.loads(llm_result) if isinstance(llm_result, str) else llm_result
+    data = llm_data.get("data")
+    if not isinstance(data, dict) or not data:
+        # LLM调用失败（重试后仍失败）或输出中没有JSON对象
+        error = llm_data.get("error") or {}
+        raise ValueError("No F3 data from LLM ({}): {}".format(
+            error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+    # F3只取1/5/10，下游(F345、α因子、报告)按数值使用；修正后仍不符合schema的值视为失败，不保存检查点
+    errors = validate(data.get("value"), SCHEMA["properties"]["value"], "$.value")
+    if errors:
+        raise ValueError("Invalid F3 value from LLM: {}".format("; ".join(errors)))
+    # 提取值和理由
+    result["value"] = data.get("value", None)
+    result["rationale"] = data.get("rationale", "")
+
 def F3_value(content):
     """
     计算F3因子值
@@ -94,43 +142,16 @@ def F3_value(content):
     返回:
         str: 包含F3因子计算结果的JSON字符串
     """
-    result = {
-        "factors": "F3",
-        "value": None,
-        "rationale": "",
-        "GAI_original": "",
-        "status": "success",
-        "message": ""
-    }
+    result = _new_result()
     
     try:
         # 构建提示词
-        formatted_prompt = prompt.replace('{{CONTENT}}', content)
+        formatted_prompt = _build_prompt(content)
         
         # 调用AI模型
         ai = AITEP()
-        llm_result = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=formatted_prompt)
-        
-        # 存储原始响应
-        result["GAI_original"] = llm_result
-        
-        # 这里可以添加对llm_result的解析逻辑，提取F3值和理由
-        # 例如：可以从llm_result中解析出具体的F3值和理由
-        # 如果llm_result已经是结构化数据，可以直接提取
-        
-        # 假设llm_result包含需要的信息，或需要进一步解析
-        try:
-            # 尝试解析结果，这里需要根据实际的llm_result格式调整
-            parsed_result = json.loads(llm_result) if isinstance(llm_result, str) else llm_result
-            
-            # 提取值和理由
-            if isinstance(parsed_result, dict):
-                result["value"] = parsed_result.get("data").get("value", None)
-                result["rationale"] = parsed_result.get("data").get("rationale", "")
-        except:
-            # 如果解析失败，保留原始响应
-            result["message"] = "Failed to parse AI response, but original response is preserved."
-            
+        llm_result = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt, batch=True, schema=SCHEMA)
+        _fill_result(result, llm_result)
     except Exception as e:
         # 发生异常时记录错误信息
         result["status"] = "error"
@@ -138,6 +159,21 @@ def F3_value(content):
     
     # 将结果转换为JSON字符串并返回
     return json.dumps(result, ensure_ascii=False)
+
+async def F3_value_async(content):
+    """F3_value的异步版本，参数和返回值相同"""
+    result = _new_result()
+    
+    try:
+        formatted_prompt = _build_prompt(content)
+        ai = AITEP()
+        llm_result = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt, batch=True, schema=SCHEMA)
+        _fill_result(result, llm_result)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+    
+    return json.dumps(result, ensure_ascii=False)
 if __name__ == "__main__":
     print(F3_value("The study is a clinical study with a duration of 2 weeks, categorized as sub-chronic."))
 
@@ -0,0 +1,136 @@
+import json
+import asyncio
+from utils.llm_utils import AITEP
+from utils.json_schema import validate
+from utils import context_packer
+import F3
+import F4
+import F5
+
+# F3/F4/F5合并为一次LLM调用：共用的临床数据只发送一次，各因子的规则沿用各自模块的提示词
+FACTORS = (("F3", F3), ("F4", F4), ("F5", F5))
+
+# 各因子提示词中{{CONTENT}}替换为指向共享内容的说明
+CONTENT_REFERENCES = {
+    "F3": "See `clinical_data` in the Shared Content above.",
+    "F4": "See `reproductive_data`, `animal_tox_data` and `clinical_data` in the Shared Content above.",
+    "F5": "See `clinical_data` and `PoD_detail` in the Shared Content above.",
+}
+
+header = """
+# **Task: Evaluate the F3, F4 and F5 Coefficients in One Pass**
+
+As a toxicology assessment expert, evaluate the three coefficients below from the same content. Each factor has its own rules and output fields; evaluate each one independently, following only its own section.
+
+### **Shared Content**
+**Start:**
+{{CONTENT}}
+**End**
+"""
+
+footer = """
+## **Output for All Three Factors**
+Return ONE JSON object with the keys `F3`, `F4` and `F5`. Each value is the output object described in that factor's section (F3: `value`, `rationale`; F4: `reproductive_value`, `animal_tox_value`, `clinical_value`, `F4_value`, `Rationale`; F5: `Effect_Level`, `F5_value`, `Rationale`). No explanation outside the JSON.
+
+#### **Example Output**
+```json
+{
+    "F3": {"value": 5, "rationale": "The study is a clinical study with a duration of 2 weeks, categorized as sub-chronic."},
+    "F4": {"reproductive_value": 1, "animal_tox_value": 10, "clinical_value": 1, "F4_value": 10, "Rationale": "Animal toxicology studies indicated neurotoxicity (10), the highest of the three categories."},
+    "F5": {"Effect_Level": "LOAEL", "F5_value": 4, "Rationale": "LOAEL was identified without NOAEL establishment; 4 was assigned based on the severity of observed effects."}
+}
+```
+"""
+
+prompt = header + "".join(
+    f"\n---\n\n## **{name}**\n" + module.prompt.replace("{{CONTENT}}", CONTENT_REFERENCES[name])
+    for name, module in FACTORS) + footer
+
+# 输出格式，run_llm据此请求JSON模式并校验结果
+SCHEMA = {
+    "type": "object",
+    "properties": {name: module.SCHEMA for name, module in FACTORS},
+    "required": [name for name, _ in FACTORS]
+}
+LLM_MODEL = "qwen-plus"
+# 版本指纹：各因子的提示词模板、输出格式、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = AITEP.fingerprint([prompt, context_packer.fingerprint_params("F345")], LLM_MODEL, SCHEMA)
+
+def _build_prompt(clinical, hazards, PoD_detail):
+    reproductive_data, hazard_list = F4._hazard_content(hazards)
+    json_content = {
+        "clinical_data": context_packer.pack(clinical, "F345"),
+        "reproductive_data": reproductive_data,
+        "animal_tox_data": hazard_list,
+        "PoD_detail": PoD_detail
+    }
+    return prompt.replace("{{CONTENT}}", json.dumps(json_content, ensure_ascii=False))
+
+def _split_result(response):
+    """
+    把合并调用的结果拆成各因子模块的格式（与F3_value/F4_value/F5_value的返回值相同）
+    某个因子缺失或不符合该因子的schema时为None，由调用方单独重新计算
+    """
+    data = response.get("data")
+    results = {}
+    for name, module in FACTORS:
+        part = data.get(name) if isinstance(data, dict) else None
+        if not isinstance(part, dict) or validate(part, module.SCHEMA):
+            results[name] = None
+            continue
+        result = module._new_result()
+        module._fill_result(result, {**response, "data": part, "fused": True})
+        results[name] = json.dumps(result, ensure_ascii=False)
+    return results
+
+def F345_values(clinical, hazards, PoD_detail):
+    """
+    一次LLM调用计算F3、F4、F5因子值
+
+    参数:
+        clinical (str): 临床数据
+        hazards (str或list): 危害识别数据的JSON字符串或列表
+        PoD_detail: PoD计算结果
+
+    返回:
+        list: [F3结果, F4结果, F5结果]，每项为与F3_value/F4_value/F5_value相同的JSON字符串
+              合并调用失败、缺失或不合格的因子改为单独调用对应模块计算
+    """
+    try:
+        ai = AITEP()
+        response = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=_build_prompt(clinical, hazards, PoD_detail),
+                              batch=True, schema=SCHEMA)
+        results = _split_result(response)
+    except Exception as e:
+        print(f"F345 fused call failed, falling back to separate calls: {str(e)}")
+        results = {}
+    return [
+        results.get("F3") or F3.F3_value(clinical),
+        results.get("F4") or F4.F4_value(clinical, hazards),
+        results.get("F5") or F5.F5_value(PoD_detail, clinical),
+    ]
+
+async def F345_values_async(clinical, hazards, PoD_detail):
+    """F345_values的异步版本，参数和返回值相同"""
+    try:
+        ai = AITEP()
+        response = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=_build_prompt(clinical, hazards, PoD_detail),
+                                     batch=True, schema=SCHEMA)
+        results = _split_result(response)
+    except Exception as e:
+        print(f"F345 fused call failed, falling back to separate calls: {str(e)}")
+        results = {}
+    # 需要单独计算的因子并发执行
+    fallbacks = {
+        "F3": lambda: F3.F3_value_async(clinical),
+        "F4": lambda: F4.F4_value_async(clinical, hazards),
+        "F5": lambda: F5.F5_value_async(PoD_detail, clinical),
+    }
+    missing = [name for name, _ in FACTORS if not results.get(name)]
+    for name, result in zip(missing, await asyncio.gather(*(fallbacks[name]() for name in missing))):
+        results[name] = result
+    return [results[name] for name, _ in FACTORS]
+
+if __name__ == "__main__":
+    for result in F345_values("The study is a clinical study with a duration of 2 weeks.", [], "10 mg/day"):
+        print(result)
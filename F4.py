@@ -5,6 +5,7 @@ import pandas as pd
 import re
 from concurrent.futures import ThreadPoolExecutor
 from utils.llm_utils import AITEP
+from utils import context_packer
 
 prompt = """
 # **Task: Evaluate Toxicity Nature and Assign Coefficient with Rationale**
@@ -81,6 +82,94 @@ Provide the results in JSON format, including:
 
 # 定义处理单行数据的函数
 
+# 输出格式，run_llm据此请求JSON模式并校验结果
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reproductive_value": {"enum": [1, 5, 10, "No Data"]},
+        "animal_tox_value": {"enum": [1, 10, "No Data"]},
+        "clinical_value": {"enum": [1, 5, "No Data"]},
+        "F4_value": {"type": "integer", "enum": [1, 5, 10]},
+        "Rationale": {"type": "string"}
+    },
+    "required": ["reproductive_value", "animal_tox_value", "clinical_value", "F4_value", "Rationale"]
+}
+LLM_MODEL = "qwen-plus"
+# 版本指纹：提示词模板、输出格式、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = AITEP.fingerprint([prompt, context_packer.fingerprint_params("F4")], LLM_MODEL, SCHEMA)
+
+def _new_result():
+    return {
+        "factors": "F4",
+        "value": None,
+        "rationale": "",
+        "status": "success",
+        "GAI_original": "",
+        "message": ""
+    }
+
+def _hazard_content(hazards):
+    """把危害识别数据分为生殖毒性数据和其他毒性数据列表，F345合并调用中也使用"""
+    # 解析危害识别数据
+    hazards_data = hazards
+    if isinstance(hazards, str):
+        hazards_data = json.loads(hazards)
+    
+    # 创建生殖毒性数据结构和其他毒性数据列表
+    reproductive_data = None
+    hazard_list = []
+
+    # 遍历所有危害数据，根据param1进行分类处理
+    for hazard in hazards_data:
+        hazard_type = hazard['param1']
+        toxicity_value = hazard['param2']
+        detail_info = hazard['param3']
+        
+        hazard_info = {
+            "toxicity_value": f"{hazard_type} has toxicity? {toxicity_value}",
+            "detail_info": context_packer.pack_detail(detail_info)
+        }
+        
+        # 如果是生殖毒性，单独处理
+        if hazard_type == "Reproductive/Developmental Toxicant":
+            reproductive_data = hazard_info
+        else:
+            # 其他类型的毒性添加到列表中
+            hazard_list.append(hazard_info)
+
+    # 如果没有找到生殖毒性数据，创建一个空的默认值
+    if reproductive_data is None:
+        reproductive_data = {
+            "toxicity_value": "Reproductive/Developmental Toxicant has toxicity? Unknown",
+            "detail_info": "No data available"
+        }
+    
+    return reproductive_data, hazard_list
+
+def _build_prompt(clinical, hazards):
+    """根据临床数据和危害识别数据构建F4提示词"""
+    reproductive_data, hazard_list = _hazard_content(hazards)
+    # 创建最终的JSON内容
+    json_content = {
+        "reproductive_data": reproductive_data,
+        "animal_tox_data": hazard_list,
+        "clinical_data": context_packer.pack(clinical, "F4")
+    }
+    return prompt.replace("{{CONTENT}}", json.dumps(json_content, ensure_ascii=False))
+
+def _fill_result(result, response):
+    """解析AI响应获取F4值和理由"""
+    result["GAI_original"] = response
+    llm_data = json.loads(response) if isinstance(response, str) else response
+    data = llm_data.get("data")
+    if not isinstance(data, dict) or not data:
+        # LLM调用失败（重试后仍失败）或输出中没有JSON对象
+        error = llm_data.get("error") or {}
+        raise ValueError("No F4 data from LLM ({}): {}".format(
+            error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+    result["value"] = data.get("F4_value", None)
+    result["rationale"] = data.get("Rationale", "")
+
 def F4_value(clinical, hazards):
     """
     计算F4因子值
@@ -92,71 +181,15 @@ def F4_value(clinical, hazards):
     返回:
         str: 包含F4因子计算结果的JSON字符串
     """
-    result = {
-        "factors": "F4",
-        "value": None,
-        "rationale": "",
-        "status": "success",
-        "GAI_original": "",
-        "message": ""
-    }
+    result = _new_result()
     
     try:
-        # 解析危害识别数据
-        hazards_data = hazards
-        if isinstance(hazards, str):
-            hazards_data = json.loads(hazards)
-        
-        # 创建生殖毒性数据结构和其他毒性数据列表
-        reproductive_data = None
-        hazard_list = []
-
-        # 遍历所有危害数据，根据param1进行分类处理
-        for hazard in hazards_data:
-            hazard_type = hazard['param1']
-            toxicity_value = hazard['param2']
-            detail_info = hazard['param3']
-            
-            hazard_info = {
-                "toxicity_value": f"{hazard_type} has toxicity? {toxicity_value}",
-                "detail_info": detail_info
-            }
-            
-            # 如果是生殖毒性，单独处理
-            if hazard_type == "Reproductive/Developmental Toxicant":
-                reproductive_data = hazard_info
-            else:
-                # 其他类型的毒性添加到列表中
-                hazard_list.append(hazard_info)
-
-        # 如果没有找到生殖毒性数据，创建一个空的默认值
-        if reproductive_data is None:
-            reproductive_data = {
-                "toxicity_value": "Reproductive/Developmental Toxicant has toxicity? Unknown",
-                "detail_info": "No data available"
-            }
-        
-        # 创建最终的JSON内容
-        json_content = {
-            "reproductive_data": reproductive_data,
-            "animal_tox_data": hazard_list,
-            "clinical_data": clinical
-        }
-        
+        formatted_prompt = _build_prompt(clinical, hazards)
+
         # 调用AI模型计算F4值
         ai = AITEP()
-
-        formatted_prompt = prompt.replace("{{CONTENT}}", json.dumps(json_content, ensure_ascii=False))      
-        response = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=formatted_prompt)
-        result["GAI_original"] = response
-        # 解析AI响应获取F4值和理由
-        try:
-            parsed_response = json.loads(response) if isinstance(response, str) else response
-            result["value"] = parsed_response.get("data").get("F4_value", None)
-            result["rationale"] = parsed_response.get("data").get("Rationale", "")
-        except:
-            result["message"] = "Failed to parse AI response"
-
+        response = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt, batch=True, schema=SCHEMA)
+        _fill_result(result, response)
         
     except Exception as e:
         result["status"] = "error"
@@ -165,6 +198,21 @@ def F4_value(clinical, hazards):
     # 将结果转换为JSON字符串并返回
     return json.dumps(result, ensure_ascii=False)
 
+async def F4_value_async(clinical, hazards):
+    """F4_value的异步版本，参数和返回值相同"""
+    result = _new_result()
+    
+    try:
+        formatted_prompt = _build_prompt(clinical, hazards)
+        ai = AITEP()
+        response = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt, batch=True, schema=SCHEMA)
+        _fill_result(result, response)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+    
+    return json.dumps(result, ensure_ascii=False)
+
 if __name__ == "__main__":
     clinical="### Clinical Therapeutic Doses\n\n| Species | Treatment | Route | Dosage |\n|---------|-----------|--------|---------|\n| Adults | HIV-1 infection | Oral | 600 mg once daily or 300 mg twice daily |\n| Pediatric patients (≥14 kg) | HIV-1 infection | Oral | Dose calculated based on body weight, not exceeding 600 mg daily |\n\n<br>\n\n### Adverse Effects\n\nAbacavir can cause serious hypersensitivity reactions, lactic acidosis, severe hepatomegaly with steatosis, and immune reconstitution syndrome. Common side effects include nausea, vomiting, fever, and fatigue.\n\n<br>\n\n### Warning\n\nAbacavir should be used with caution in patients with a history of cardiovascular disease due to an increased risk of myocardial infarction. It is also important to monitor for signs of lactic acidosis and severe hepatomegaly with steatosis.\n\n<br>\n\n### Box warning\n\n**Black Box Warning:**\n\nSerious and sometimes fatal hypersensitivity reactions have occurred with abacavir. Patients who carry the HLA-B*5701 allele are at a higher risk of these reactions. Abacavir is contraindicated in patients with a prior hypersensitivity reaction to abacavir or in those with the HLA-B*5701 allele.\n\n<br>\n\n### Clinical Critical Effects\n\nThe critical or lead effects of abacavir in clinical data were the treatment of HIV-1 infection[1][3]."
     hazard=[{'param1': 'Genotoxicant', 'param2': 'Yes', 'param3': 'The genotoxic potential of abacavir is supported by multiple studies, including those from peer-reviewed scientific literature. While regulatory authorities have not explicitly classified it as a genotoxicant, the evidence from animal and in vitro studies suggests that abacavir can induce genetic damage, particularly in combination with other drugs.'}, {'param1': 'Carcinogen', 'param2': 'Unknown', 'param3': "While abacavir has shown carcinogenic effects in animal studies, it is not classified as a carcinogen by major regulatory bodies. The evidence from animal studies suggests potential carcinogenic activity, but this is not sufficient for a definitive classification as a human carcinogen. Therefore, the result is 'Unknown' due to conflicting evidence and lack of human epidemiological data."}, {'param1': 'Reproductive/Developmental Toxicant', 'param2': 'No', 'param3': 'While animal studies suggest potential developmental toxicity, extensive human data from pregnancy registries do not indicate an increased risk of major birth defects. Therefore, the risk in humans is considered low based on available evidence.'}, {'param1': 'Highly Sensitizing Potential', 'param2': 'Yes', 'param3': 'The FDA and other regulatory bodies have issued warnings about the hypersensitivity potential of abacavir, particularly in individuals with the HLA-B*5701 allele. Peer-reviewed literature consistently supports the high sensitizing potential of abacavir, making it a well-documented risk.'}]
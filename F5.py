@@ -5,6 +5,7 @@ import pandas as pd
 import re
 from concurrent.futures import ThreadPoolExecutor
 from utils.llm_utils import AITEP
+from utils import context_packer
 prompt = """
 # **Task: Evaluate LOAEL/NOAEL Status and Assign Coefficient with Rationale**
 
@@ -50,8 +51,22 @@ Provide the results in JSON format, including:
 ```
 
 """
-def F5_value(PoD_detail, clinical_data):
-    result = {
+# 输出格式，run_llm据此请求JSON模式并校验结果
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Effect_Level": {"type": "string"},
+        "F5_value": {"enum": [1, 2, 3, 4, 5, "No Data"]},
+        "Rationale": {"type": "string"}
+    },
+    "required": ["Effect_Level", "F5_value", "Rationale"]
+}
+LLM_MODEL = "qwen-plus"
+# 版本指纹：提示词模板、输出格式、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = AITEP.fingerprint([prompt, context_packer.fingerprint_params("F5")], LLM_MODEL, SCHEMA)
+
+def _new_result():
+    return {
         "factors": "F5",  # 假设这是处理PoD相关的数据
         "value": None,
         "rationale": "",
@@ -59,28 +74,37 @@ def F5_value(PoD_detail, clinical_data):
         "GAI_original": "",
         "message": ""
     }
+
+def _build_prompt(PoD_detail, clinical_data):
+    # 创建JSON内容
+    json_content = {
+        "clinical_data": context_packer.pack(clinical_data, "F5"),
+        "PoD_detail": PoD_detail
+    }
+    return prompt.replace("{{CONTENT}}", json.dumps(json_content, ensure_ascii=False))
+
+def _fill_result(result, response):
+    # 解析AI响应
+    result["GAI_original"] = response
+    llm_data = json.loads(response) if isinstance(response, str) else response
+    data = llm_data.get("data")
+    if not isinstance(data, dict) or not data:
+        # LLM调用失败（重试后仍失败）或输出中没有JSON对象
+        error = llm_data.get("error") or {}
+        raise ValueError("No F5 data from LLM ({}): {}".format(
+            error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+    result["value"] = data.get("F5_value", None)
+    result["rationale"] = data.get("Rationale", "")
+
+def F5_value(PoD_detail, clinical_data):
+    result = _new_result()
     
     try:
-        
-        # 创建JSON内容
-        json_content = {
-            "clinical_data": clinical_data,
-            "PoD_detail": PoD_detail
-        }
-        
         # 调用AI模型获取响应
         ai = AITEP()
-        formatted_prompt = prompt.replace("{{CONTENT}}", json.dumps(json_content, ensure_ascii=False))
-        response = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=formatted_prompt)
-        result["GAI_original"] = response
-        
-        # 解析AI响应
-        try:
-            parsed_response = json.loads(response) if isinstance(response, str) else response
-            result["value"] = parsed_response.get("data", {}).get("F5_value", None)
-            result["rationale"] = parsed_response.get("data", {}).get("Rationale", "")
-        except:
-            result["message"] = "Failed to parse AI response"
+        formatted_prompt = _build_prompt(PoD_detail, clinical_data)
+        response = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt, batch=True, schema=SCHEMA)
+        _fill_result(result, response)
             
     except Exception as e:
         result["status"] = "error"
@@ -89,6 +113,21 @@ def F5_value(PoD_detail, clinical_data):
     # 返回索引和结果的JSON字符串
     return json.dumps(result, ensure_ascii=False)
 
+async def F5_value_async(PoD_detail, clinical_data):
+    """F5_value的异步版本，参数和返回值相同"""
+    result = _new_result()
+    
+    try:
+        ai = AITEP()
+        formatted_prompt = _build_prompt(PoD_detail, clinical_data)
+        response = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt, batch=True, schema=SCHEMA)
+        _fill_result(result, response)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+    
+    return json.dumps(result, ensure_ascii=False)
+
 
 if __name__ == '__main__':
     PoD_detail="{'PoD_value': 0.5, 'PoD_unit': 'mg/kg/day', 'point_of_departure': '0.5 mg/kg/day', 'point_of_departure_detail': 'The PoD was determined based on the NOAEL of 50 mg/kg/day from a 90-day oral toxicity study in rats, applying an uncertainty factor of 100.'}"
@@ -1,4 +1,5 @@
 from utils.llm_utils import AITEP
+from utils import context_packer
 import json
 import pandas as pd
 import numpy as np
@@ -58,6 +59,65 @@ Set "PoD" and "PoD_unit" to null ONLY if:
     - The drug is explicitly contraindicated for the specified route
     - The calculation would require non-standard assumptions beyond those listed above
 """
+# 输出格式，run_llm据此请求JSON模式并校验结果
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "PoD": {"type": ["number", "null"], "minimum": 0},
+        "PoD_unit": {"type": ["string", "null"]},
+        "PoD_calculate_detail": {"type": "string"},
+        "assumptions_made": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["PoD", "PoD_unit", "PoD_calculate_detail"]
+}
+LLM_MODEL = "qwen-plus"
+# 版本指纹：提示词模板、输出格式、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = AITEP.fingerprint([loose_prompt, context_packer.fingerprint_params("PoD")], LLM_MODEL, SCHEMA)
+
+def _new_result(kwargs):
+    return {
+        "params": kwargs,  # 记录传入的关键字参数
+        "status": "success",
+        "message": "",
+        "GAI_origin": "",
+        "PoD_value": None,
+        "PoD_unit": "",
+        "point_of_departure": "",
+        "point_of_departure_detail": "",
+    }
+
+def _build_prompt(ingredient, kwargs):
+    # 临床报告只保留给药剂量表
+    if "clinical" in kwargs:
+        kwargs = {**kwargs, "clinical": context_packer.pack(kwargs["clinical"], "PoD")}
+    # 构建内容字符串，将所有关键字参数格式化为"参数名=参数值"的形式
+    param_strings = [f"{key}={value}" for key, value in kwargs.items()]
+    
+    # 将参数字符串连接成一个内容字符串
+    content = ", ".join(param_strings)
+    
+    # 构建提示词
+    prompt = loose_prompt % (ingredient)
+    return prompt.replace("{{CONTENT}}", content)
+
+def _fill_result(result, llm_result):
+    # 保存处理结果
+    result["GAI_origin"] = llm_result
+    pods=llm_result.get("data")
+    if not isinstance(pods, dict) or not pods:
+        # LLM调用失败（重试后仍失败）或输出中没有JSON对象
+        error = llm_result.get("error") or {}
+        raise ValueError("No PoD data from LLM ({}): {}".format(
+            error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+    pod = pods.get("PoD", None)
+    pod_unit = pods.get('PoD_unit') or ""
+    point_of_departure = str(pod) + " " + pod_unit
+    point_of_detail = pods.get("PoD_calculate_detail", "")
+    result["PoD_value"] = pod
+    result["PoD_unit"] = pod_unit
+    result["point_of_departure"] = point_of_departure
+    result["point_of_departure_detail"] = point_of_detail
+
 # 是否有必要在这里data_out
 def PoD_value(ingredient, **kwargs):
     """
@@ -70,42 +130,15 @@ def PoD_value(ingredient, **kwargs):
     返回:
         str: 包含处理结果的JSON字符串
     """
-    result = {
-        "params": kwargs,  # 记录传入的关键字参数
-        "status": "success",
-        "message": "",
-        "GAI_origin": "",
-        "PoD_value": None,
-        "PoD_unit": "",
-        "point_of_departure": "",
-        "point_of_departure_detail": "",
-    }
+    result = _new_result(kwargs)
     
     try:
-        # 构建内容字符串，将所有关键字参数格式化为"参数名=参数值"的形式
-        param_strings = [f"{key}={value}" for key, value in kwargs.items()]
-        
-        # 将参数字符串连接成一个内容字符串
-        content = ", ".join(param_strings)
-        
-        # 构建提示词
-        prompt = loose_prompt % (ingredient)
-        newPrompt = prompt.replace("{{CONTENT}}", content)
+        newPrompt = _build_prompt(ingredient, kwargs)
         
         # 调用AI模型
         ai = AITEP()
-        llm_result = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=newPrompt)
-        # 保存处理结果
-        result["GAI_origin"] = llm_result
-        pods=llm_result.get("data")
-        pod = pods.get("PoD", None)
-        pod_unit = pods['PoD_unit']
-        point_of_departure = str(pod) + " " + pod_unit
-        point_of_detail = pods["PoD_calculate_detail"]
-        result["PoD_value"] = pod
-        result["PoD_unit"] = pod_unit
-        result["point_of_departure"] = point_of_departure
-        result["point_of_departure_detail"] = point_of_detail
+        llm_result = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=newPrompt, batch=True, schema=SCHEMA)
+        _fill_result(result, llm_result)
         
     except Exception as e:
         # 异常处理
@@ -116,6 +149,22 @@ def PoD_value(ingredient, **kwargs):
     # 将结果转换为JSON字符串并返回
     return json.dumps(result, indent=4, ensure_ascii=False)
 
+async def PoD_value_async(ingredient, **kwargs):
+    """PoD_value的异步版本，参数和返回值相同"""
+    result = _new_result(kwargs)
+    
+    try:
+        newPrompt = _build_prompt(ingredient, kwargs)
+        ai = AITEP()
+        llm_result = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=newPrompt, batch=True, schema=SCHEMA)
+        _fill_result(result, llm_result)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+        print(f"Error processing ingredient '{ingredient}' with params {kwargs}: {str(e)}")
+    
+    return json.dumps(result, indent=4, ensure_ascii=False)
+
 
 
 if __name__ == "__main__":
@@ -139,8 +139,25 @@ a_factor_value value from 0.01 to 100.
 consider specific drug characteristics and clinical context.
 The response will contain ONLY the JSON output with no additional text.
 """
-def a_factor(name,target_route,source_route):
-    default_result = {
+# 输出格式，run_llm据此请求JSON模式并校验结果
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "source_route_bioavailability": {"type": "string"},
+        "source_route_adjustment_factor": {"type": "integer", "enum": [100, 10, 2, 1]},
+        "target_route_bioavailability": {"type": "string"},
+        "target_route_adjustment_factor": {"type": "integer", "enum": [100, 10, 2, 1]},
+        "a_factor_value": {"type": "number", "minimum": 0.01, "maximum": 100},
+        "a_factor_detail": {"type": "string"}
+    },
+    "required": ["source_route_adjustment_factor", "target_route_adjustment_factor", "a_factor_value", "a_factor_detail"]
+}
+LLM_MODEL = "qwen-plus"
+# 版本指纹：提示词模板、输出格式、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = AITEP.fingerprint(prompt, LLM_MODEL, SCHEMA)
+
+def _new_result():
+    return {
         "factor": "α",
         "source_route_bioavailability": "",
         "source_route_adjustment_factor": None,
@@ -152,20 +169,47 @@ def a_factor(name,target_route,source_route):
         "message": "",
         "GAI_original": ""
     }
+
+def _build_prompt(name,target_route,source_route):
+    main_content_json={
+                "Drug_name":name,
+                "Target administration route":target_route,
+                "Source administration route":source_route
+    }
+    return prompt.replace("{{CONTENT}}", json.dumps(main_content_json, indent=4))
+
+def _fill_result(default_result, llm_data):
+    default_result["GAI_original"] = llm_data
+    result_json = llm_data.get("data")
+    if not isinstance(result_json, dict) or not result_json:
+        # LLM调用失败（重试后仍失败）或输出中没有JSON对象
+        error = llm_data.get("error") or {}
+        raise ValueError("No alpha factor data from LLM ({}): {}".format(
+            error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+    for key in result_json:
+        if key in default_result and key not in ["status", "message"]:
+            default_result[key] = result_json[key]
+
+def a_factor(name,target_route,source_route):
+    default_result = _new_result()
+    try:
+        format_prompt = _build_prompt(name,target_route,source_route)
+        ai= AITEP()
+        result_json = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=format_prompt, batch=True, schema=SCHEMA)
+        _fill_result(default_result, result_json)
+    except Exception as e:
+        default_result["status"] = "error"
+        default_result["message"] = f"Error processing row: {str(e)}"
+    return json.dumps(default_result, ensure_ascii=False)
+
+async def a_factor_async(name,target_route,source_route):
+    """a_factor的异步版本，参数和返回值相同"""
+    default_result = _new_result()
     try:
-        main_content_json={
-                    "Drug_name":name,
-                    "Target administration route":target_route,
-                    "Source administration route":source_route
-        }
-        format_prompt = prompt.replace("{{CONTENT}}", json.dumps(main_content_json, indent=4))
+        format_prompt = _build_prompt(name,target_route,source_route)
         ai= AITEP()
-        result_json = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=format_prompt)
-        default_result["GAI_original"] = result_json
-        result_json = result_json.get("data")
-        for key in result_json:
-            if key in default_result and key not in ["status", "message"]:
-                default_result[key] = result_json[key]
+        result_json = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=format_prompt, batch=True, schema=SCHEMA)
+        _fill_result(default_result, result_json)
     except Exception as e:
         default_result["status"] = "error"
         default_result["message"] = f"Error processing row: {str(e)}"
@@ -2,7 +2,72 @@ import utils.PubChem as PubChem
 import json
 from utils.llm_utils import AITEP
 from utils.search_utils import perform_search
-ai = AITEP()
+from utils.search_utils import PerplexitySearch
+LLM_MODEL = "qwen-plus"
+
+# 网络搜索的查询模板
+search_prompt_template = """
+        search comprehensive drug profile for {{DRUG_NAME}} including official identifiers (CAS, SMILES, InChI Key), chemical properties (formula, molecular weight, IUPAC name), pharmaceutical characteristics (appearance, solubility), and clinical information (ATC code, therapeutic group, indications, pharmacokinetics).
+        """
+
+# 从搜索结果中提取基本信息的提示词模板
+prompt_template = """
+# Drug Information Extraction Prompt
+
+## Input Content
+Content Start
+```json
+{{RESULTS}}
+```
+Content End
+
+## Task Description
+
+Based on the search results in JSON format above, extract the basic information for drug name (`drug_name`). Only include fields with actual values; use empty strings or empty arrays for missing information. If Description, Pharmacotherapeutic Group, Appearance, Solubility, or ATC Code information is missing from the source data, use the AI model's knowledge to automatically generate this information based on the (`drug_name`).
+
+## Input Parameter
+- `drug_name`: {{DRUG_NAME}}
+
+## Expected output format:
+```json
+{
+    "drug_name": "Paracetamol",
+    "Synonyms": ["Acetaminophen", "APAP", "Tylenol"],
+    "CAS Number": "103-90-2",
+    "Molecular Formula": "C8H9NO2",
+    "Molecular Weight": "151.16 g/mol",
+    "Smiles": "CC(=O)NC1=CC=C(O)C=C1",
+    "InchI Key": "RZVAJINKPMORJF-UHFFFAOYSA-N",
+    "reference_links": ["https://pubchem.ncbi.nlm.nih.gov/compound/1983"],
+    "IUPAC Name": "N-(4-hydroxyphenyl)acetamide",
+    "Description": "Analgesic and antipyretic drug used for pain relief and fever reduction",
+    "ATC Code": "N02BE01",
+    "Pharmacotherapeutic Group": "Analgesics and antipyretics",
+    "Appearance": "White crystalline powder",
+    "Solubility": "Slightly soluble in water (14 mg/mL at 25°C)"
+}
+```
+
+## Field Descriptions
+
+| Field                       | Description                                                  |
+| --------------------------- | ------------------------------------------------------------ |
+| `drug_name`                 | The primary or generic name of the drug                      |
+| `Synonyms`                  | List of alternative names or brand names for the drug        |
+| `CAS Number`                | Chemical Abstracts Service registry number, used to uniquely identify chemical substances |
+| `Molecular Formula`         | The molecular formula of the drug, representing its chemical composition |
+| `Molecular Weight`          | The molecular weight of the drug, typically in g/mol         |
+| `Smiles`                    | Simplified Molecular Input Line Entry System (SMILES), a string representation for describing chemical structure |
+| `InchI Key`                 | The hashed version of the International Chemical Identifier (InChI), used for unique identification of chemical structures |
+| `reference_links`           | List of reference links containing information about the drug |
+| `IUPAC Name`                | Systematic chemical name according to International Union of Pure and Applied Chemistry (IUPAC) nomenclature |
+| `Description`               | Brief description of the drug, including its main uses and effects (if missing from source data, generate using AI knowledge based on drug name) |
+| `ATC Code`                  | Anatomical Therapeutic Chemical classification system code for drug classification (if missing from source data, generate using AI knowledge based on drug name) |
+| `Pharmacotherapeutic Group` | The pharmacological therapeutic category to which the drug belongs (if missing from source data, generate using AI knowledge based on drug name) |
+| `Appearance`                | Description of the physical appearance of the drug (if missing from source data, generate using AI knowledge based on drug name) |
+| `Solubility`                | Information about the drug's solubility in different solvents (if missing from source data, generate using AI knowledge based on drug name) |
+"""
+
 def get_chemical_info(name,search_method="perplexity"):
     """
     获取化学物质的基本信息，优先使用PubMed，如果失败则使用网络搜索
@@ -91,89 +156,39 @@ def _search_chemical_info(name,search_method, default_result):
     """
     try:
         # 构建搜索提示
-        search_prompt = f"""
-        search comprehensive drug profile for {name} including official identifiers (CAS, SMILES, InChI Key), chemical properties (formula, molecular weight, IUPAC name), pharmaceutical characteristics (appearance, solubility), and clinical information (ATC code, therapeutic group, indications, pharmacokinetics).
-        """
+        search_prompt = search_prompt_template.replace("{{DRUG_NAME}}", name)
         
         # 执行搜索
 
         json_data = perform_search(search_prompt, search_method)
         data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
         default_result["AI_search_results"] = data_dict
+        # 搜索失败时返回 {"status": "error", "message": ...}，不作为搜索结果交给LLM
+        if isinstance(data_dict, dict) and data_dict.get("status") == "error":
+            raise ValueError(data_dict.get("message") or "search failed")
         # 如果搜索有结果，使用AI处理
         if data_dict and len(data_dict) > 0:
-            # 构建AI提示
-            prompt_template = """
-# Drug Information Extraction Prompt
-
-## Input Content
-Content Start
-```json
-{{RESULTS}}
-```
-Content End
-
-## Task Description
-
-Based on the search results in JSON format above, extract the basic information for drug name (`drug_name`). Only include fields with actual values; use empty strings or empty arrays for missing information. If Description, Pharmacotherapeutic Group, Appearance, Solubility, or ATC Code information is missing from the source data, use the AI model's knowledge to automatically generate this information based on the (`drug_name`).
-
-## Input Parameter
-- `drug_name`: {{DRUG_NAME}}
-
-## Expected output format:
-```json
-{
-    "drug_name": "Paracetamol",
-    "Synonyms": ["Acetaminophen", "APAP", "Tylenol"],
-    "CAS Number": "103-90-2",
-    "Molecular Formula": "C8H9NO2",
-    "Molecular Weight": "151.16 g/mol",
-    "Smiles": "CC(=O)NC1=CC=C(O)C=C1",
-    "InchI Key": "RZVAJINKPMORJF-UHFFFAOYSA-N",
-    "reference_links": ["https://pubchem.ncbi.nlm.nih.gov/compound/1983"],
-    "IUPAC Name": "N-(4-hydroxyphenyl)acetamide",
-    "Description": "Analgesic and antipyretic drug used for pain relief and fever reduction",
-    "ATC Code": "N02BE01",
-    "Pharmacotherapeutic Group": "Analgesics and antipyretics",
-    "Appearance": "White crystalline powder",
-    "Solubility": "Slightly soluble in water (14 mg/mL at 25°C)"
-}
-```
-
-## Field Descriptions
-
-| Field                       | Description                                                  |
-| --------------------------- | ------------------------------------------------------------ |
-| `drug_name`                 | The primary or generic name of the drug                      |
-| `Synonyms`                  | List of alternative names or brand names for the drug        |
-| `CAS Number`                | Chemical Abstracts Service registry number, used to uniquely identify chemical substances |
-| `Molecular Formula`         | The molecular formula of the drug, representing its chemical composition |
-| `Molecular Weight`          | The molecular weight of the drug, typically in g/mol         |
-| `Smiles`                    | Simplified Molecular Input Line Entry System (SMILES), a string representation for describing chemical structure |
-| `InchI Key`                 | The hashed version of the International Chemical Identifier (InChI), used for unique identification of chemical structures |
-| `reference_links`           | List of reference links containing information about the drug |
-| `IUPAC Name`                | Systematic chemical name according to International Union of Pure and Applied Chemistry (IUPAC) nomenclature |
-| `Description`               | Brief description of the drug, including its main uses and effects (if missing from source data, generate using AI knowledge based on drug name) |
-| `ATC Code`                  | Anatomical Therapeutic Chemical classification system code for drug classification (if missing from source data, generate using AI knowledge based on drug name) |
-| `Pharmacotherapeutic Group` | The pharmacological therapeutic category to which the drug belongs (if missing from source data, generate using AI knowledge based on drug name) |
-| `Appearance`                | Description of the physical appearance of the drug (if missing from source data, generate using AI knowledge based on drug name) |
-| `Solubility`                | Information about the drug's solubility in different solvents (if missing from source data, generate using AI knowledge based on drug name) |
-"""
-            
             # 替换提示中的占位符
             formatted_prompt = prompt_template.replace("{{DRUG_NAME}}", name)
             formatted_prompt = formatted_prompt.replace("{{RESULTS}}", json.dumps(data_dict, ensure_ascii=False))
             
-            # 调用AI处理
-            ai_response = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=formatted_prompt)
+            # 调用AI处理，每次调用使用自己的AITEP实例（并发处理多个药物时互不影响）
+            ai = AITEP()
+            ai_response = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=formatted_prompt)
             print(ai_response)
             default_result["GAI_original"] = ai_response
 
+            ai_data = ai_response.get("data")
+            if ai_response.get("error") or not isinstance(ai_data, dict) or not ai_data:
+                # LLM调用失败（重试后仍失败）或输出中没有JSON对象，不填充，由下面的except标记为错误
+                error = ai_response.get("error") or {}
+                raise ValueError("No basic info data from LLM ({}): {}".format(
+                    error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+
             # 更新空缺的值
-            ai_response=ai_response.get("data")
-            for key in ai_response.keys(): 
-                if key not in ["status", "message"] and key in default_result and default_result[key] == "" or default_result[key] == None:
-                    default_result[key] = ai_response[key]
+            for key in ai_data.keys():
+                if key not in ["status", "message"] and key in default_result and default_result[key] in ("", None):
+                    default_result[key] = ai_data[key]
         else:
             default_result["message"] = f"{name}: No search results"
             default_result["status"] = "error"
@@ -185,5 +200,11 @@ Based on the search results in JSON format above, extract the basic information
     # 返回JSON字符串
     return default_result
 
+# 版本指纹：搜索模板、提示词模板、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = "|".join((
+    PerplexitySearch.fingerprint(search_prompt_template),
+    AITEP.fingerprint(prompt_template, LLM_MODEL),
+))
+
 if __name__ == "__main__":
     print(get_chemical_info("Methylephedrine"))
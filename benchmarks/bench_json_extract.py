@@ -0,0 +1,120 @@
+"""
+JSON提取器基准：在LLM输出语料上比较原来的正则提取链和utils/json_extract.extract_json的成功率和耗时
+
+语料为JSONL，每行 {"name": ..., "output": LLM原始输出, "expected": 期望提取的数据(没有JSON时为null)}，
+默认使用benchmarks/json_corpus.jsonl，可以追加记录下来的真实输出
+
+用法:
+    python benchmarks/bench_json_extract.py
+    python benchmarks/bench_json_extract.py --corpus recorded.jsonl --repeat 2000 --show-failures
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.json_extract import extract_json
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_corpus.jsonl")
+
+
+def _is_json(text):
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _format_json(s):
+    # 原AITEP.format_json
+    new_s = ''
+    for row in s.splitlines():
+        new_s += row.strip()
+    return new_s
+
+
+def legacy_llm(text):
+    """原AITEP.extract_json_from_llm_output：最后一个```json代码块，失败时用非贪婪的({.+?})提取数组中的对象"""
+    matches = re.findall(r'```json(.+?)```', text, re.DOTALL)
+    if not matches:
+        return None
+    json_data = matches[-1].strip()
+    if _is_json(json_data):
+        return json.loads(json_data)
+    output = []
+    for row in re.findall(r'({.+?})', json_data, re.DOTALL):
+        try:
+            row = _format_json(row)
+            if not _is_json(row) and r'\*' in row:
+                row = row.replace(r'\*', '*')
+            output.append(json.loads(row))
+        except json.JSONDecodeError:
+            pass
+    return output
+
+
+def legacy_search(text):
+    """原PerplexitySearch.extract_json_from_content：第一个```json代码块"""
+    match = re.search(r'```json\s*([\s\S]*?)\s*```', text)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return None
+
+
+EXTRACTORS = {
+    "legacy_llm": legacy_llm,
+    "legacy_search": legacy_search,
+    "extract_json": extract_json,
+}
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(corpus, repeat, show_failures):
+    print(f"{'extractor':<15}{'correct':>10}{'us/output':>12}")
+    for name, extractor in EXTRACTORS.items():
+        failures = []
+        for case in corpus:
+            try:
+                data = extractor(case["output"])
+            except Exception as e:
+                data = f"<{type(e).__name__}>"
+            if data != case.get("expected"):
+                failures.append((case.get("name"), data))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for case in corpus:
+                try:
+                    extractor(case["output"])
+                except Exception:
+                    pass
+        elapsed = (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+        print(f"{name:<15}{len(corpus) - len(failures):>6}/{len(corpus):<3}{elapsed:>12.1f}")
+        if show_failures:
+            for case_name, data in failures:
+                print(f"    {case_name}: {json.dumps(data, ensure_ascii=False)[:100]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON extractor benchmark")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="LLM输出语料(JSONL)")
+    parser.add_argument("--repeat", type=int, default=1000, help="计时时重复的轮数")
+    parser.add_argument("--show-failures", action="store_true", help="列出提取结果与期望不一致的输出")
+    args = parser.parse_args()
+    run(load_corpus(args.corpus), args.repeat, args.show_failures)
+
+
+if __name__ == "__main__":
+    main()
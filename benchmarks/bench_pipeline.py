@@ -0,0 +1,138 @@
+"""
+离线吞吐量压测：用本地模拟后端代替LLM和搜索接口，按串行、线程池、asyncio三种方式
+运行DrugProcessor处理N个合成药物，输出每分钟处理的药物数
+
+用法:
+    python benchmarks/bench_pipeline.py --drugs 20 --concurrency 4
+    python benchmarks/bench_pipeline.py --modes async --llm-latency 1.0 --search-latency 2.0 --error-rate 0.05
+    python benchmarks/bench_pipeline.py --modes async --concurrency 20 --batch --batch-window 2 --batch-latency 10
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_backends import FakeBackend, BackendConfig, LatencyModel
+
+MODES = ("serial", "threaded", "async")
+ROUTES = ("Oral", "Topical", "Intravenous")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AITEP pipeline offline throughput benchmark")
+    parser.add_argument("--drugs", type=int, default=20, help="每种模式处理的合成药物数")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔: serial,threaded,async")
+    parser.add_argument("--concurrency", type=int, default=4, help="threaded/async 模式同时处理的药物数")
+    parser.add_argument("--step-workers", type=int, default=4, help="单个药物内同时执行的步骤数")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="LLM平均延迟(秒)")
+    parser.add_argument("--search-latency", type=float, default=3.0, help="Perplexity平均延迟(秒)")
+    parser.add_argument("--pubchem-latency", type=float, default=0.3, help="PubChem平均延迟(秒)")
+    parser.add_argument("--sigma", type=float, default=0.5, help="对数正态延迟分布的sigma，0为固定延迟")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="各后端返回429/500的概率")
+    parser.add_argument("--batch", action="store_true", help="F3/F4/F5/PoD/α提示词通过批处理接口提交")
+    parser.add_argument("--batch-window", type=float, default=2.0, help="批处理收集请求的时间窗口(秒)")
+    parser.add_argument("--batch-latency", type=float, default=5.0, help="模拟批处理任务的平均完成时间(秒)")
+    parser.add_argument("--no-stream", action="store_true", help="LLM使用非流式请求")
+    parser.add_argument("--fused-factors", action="store_true", help="F3/F4/F5合并为一次LLM调用")
+    parser.add_argument("--verbose", action="store_true", help="逐块输出LLM响应（默认使用安静模式）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", action="store_true", help="输出每个步骤的耗时统计")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    return parser.parse_args()
+
+
+def synthetic_rows(mode, count):
+    # 每种模式使用不同的药物名，避免命中其他模式留下的缓存
+    return [(f"BenchDrug-{mode}-{i:04d}", ROUTES[i % len(ROUTES)], f"BENCH{i:05d}", i) for i in range(count)]
+
+
+def run_mode(mode, rows, args):
+    import main_pipe
+    from utils.llm_utils import AITEP, LLMBatchCollector
+
+    AITEP.batch_collector = LLMBatchCollector(window=args.batch_window, poll_interval=0.5) if args.batch else None
+    AITEP.quiet = not args.verbose
+    AITEP.stream = not args.no_stream
+
+    processor = main_pipe.DrugProcessor(log_errors=False, max_workers=1 if mode == "serial" else args.step_workers,
+                                        fused_factors=args.fused_factors)
+    profiler = main_pipe.PipelineProfiler().attach(processor.event_bus) if args.profile else None
+
+    start = time.perf_counter()
+    if mode == "serial":
+        results = [processor.process_drug(*row) for row in rows]
+    elif mode == "threaded":
+        results = list(processor.process_batch(rows, concurrency=args.concurrency))
+    else:
+        async def consume():
+            return [result async for result in processor.aprocess_batch(rows, concurrency=args.concurrency)]
+        results = asyncio.run(consume())
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(1 for r in results if r.get("status") == "success" and not r.get("errors"))
+    return {
+        "mode": mode,
+        "drugs": len(results),
+        "succeeded": succeeded,
+        "elapsed": elapsed,
+        "drugs_per_minute": len(results) / elapsed * 60 if elapsed else None,
+        "profile": profiler.report() if profiler else None,
+        "profile_text": profiler.format_report() if profiler else None,
+    }
+
+
+def main():
+    args = parse_args()
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            raise SystemExit(f"未知的模式: {mode}")
+
+    config = BackendConfig(seed=args.seed)
+    config.services["llm"].latency = LatencyModel(args.llm_latency, args.sigma)
+    config.services["perplexity"].latency = LatencyModel(args.search_latency, args.sigma)
+    config.services["bocha"].latency = LatencyModel(args.search_latency, args.sigma)
+    config.services["google"].latency = LatencyModel(args.search_latency, args.sigma)
+    config.services["pubchem"].latency = LatencyModel(args.pubchem_latency, args.sigma)
+    config.services["batch"].latency = LatencyModel(args.batch_latency, args.sigma)
+    for service in config.services.values():
+        service.error_rate = args.error_rate
+
+    reports = []
+    with FakeBackend(config) as backend:
+        os.environ.update(backend.environ())
+        workdir = os.getcwd()
+        for mode in modes:
+            # 每种模式在新的临时目录下运行，搜索缓存从空开始
+            with tempfile.TemporaryDirectory(prefix=f"aitep_bench_{mode}_") as tmp:
+                os.chdir(tmp)
+                try:
+                    report = run_mode(mode, synthetic_rows(mode, args.drugs), args)
+                finally:
+                    os.chdir(workdir)
+            reports.append(report)
+            print(f"{mode:<10} {report['drugs']:>4} drugs  {report['succeeded']:>4} ok  "
+                  f"{report['elapsed']:>8.1f}s  {report['drugs_per_minute']:>8.2f} drugs/min")
+            if report["profile_text"]:
+                print(report["profile_text"])
+        requests_summary = {"requests": dict(backend.requests), "errors": dict(backend.errors)}
+
+    print("\nbackend requests:", json.dumps(requests_summary, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "config": vars(args),
+                "results": [{k: v for k, v in r.items() if k != "profile_text"} for r in reports],
+                "backend": requests_summary,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
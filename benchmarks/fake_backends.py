@@ -0,0 +1,560 @@
+"""
+本地模拟后端：OpenAI兼容的LLM接口(AITEP)、Perplexity、Bocha、Google Custom Search 和 PubChem
+只用于离线压测，延迟分布、错误率可配置，响应格式与各模块解析的格式一致
+
+路径前缀:
+    /llm/v1/chat/completions      AITEP (流式/非流式)
+    /llm/v1/files, /llm/v1/batches  AITEP文件上传和批处理 (upload_to_openai / LLMBatchJob / LLMBatchCollector)
+    /docs/<name>                  AITEP.get_file 下载的文档，支持ETag条件请求
+    /perplexity/chat/completions  PerplexitySearch
+    /bocha/v1/web-search          BochaSearch
+    /google/...                   GoogleSearch
+    /pubchem/rest/...             utils.PubChem
+"""
+import re
+import json
+import hashlib
+import math
+import time
+import random
+import threading
+from email import policy
+from email.parser import BytesParser
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+@dataclass
+class LatencyModel:
+    """对数正态分布的延迟(秒)，mean为均值，sigma为0时固定延迟"""
+    mean: float = 0.5
+    sigma: float = 0.5
+
+    def sample(self, rng):
+        if self.mean <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.mean
+        mu = math.log(self.mean) - self.sigma ** 2 / 2
+        return rng.lognormvariate(mu, self.sigma)
+
+
+@dataclass
+class ServiceConfig:
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    # 返回错误的概率，错误时随机返回429或500
+    error_rate: float = 0.0
+
+
+@dataclass
+class BackendConfig:
+    services: Dict[str, ServiceConfig] = field(default_factory=lambda: {
+        "llm": ServiceConfig(LatencyModel(2.0, 0.5)),
+        "perplexity": ServiceConfig(LatencyModel(3.0, 0.5)),
+        "bocha": ServiceConfig(LatencyModel(1.0, 0.5)),
+        "google": ServiceConfig(LatencyModel(0.5, 0.3)),
+        "pubchem": ServiceConfig(LatencyModel(0.3, 0.3)),
+        # 批处理：latency为一个批处理任务从提交到完成的时间，error_rate为单个请求失败的概率
+        "batch": ServiceConfig(LatencyModel(5.0, 0.3)),
+    })
+    # LLM流式输出的分块数
+    stream_chunks: int = 8
+    # 为False时模拟不支持response_format的模型：带该参数的请求返回400
+    response_format: bool = True
+    seed: int = 0
+
+
+# 提示词中没有可用的JSON示例时使用的固定响应，按提示词中的特征文本匹配
+CANNED_LLM_OUTPUTS = [
+    ("Point of Departure", {
+        "PoD": 10,
+        "PoD_unit": "mg/day",
+        "PoD_calculate_detail": "10 mg once daily = 10 mg/day",
+        "assumptions_made": [],
+    }),
+]
+
+CANNED_SEARCH_OUTPUTS = [
+    ('"drug info"', {
+        "ingredients": ["{name}"],
+        "route": "Oral",
+        "result": "### Clinical Therapeutic Doses\\n\\n| Species | Treatment | Route | Dosage |\\n|---------|-----------|--------|---------|\\n| Human | Hypertension | Oral | 10 mg once daily |\\n\\n<br>\\n\\n### Adverse Effects\\n\\nHeadache.\\n\\n<br>\\n\\n### Warning\\n\\nNone.\\n\\n<br>\\n\\n### Box warning\\n\\n**Black Box Warning:**\\n\\nNone.\\n\\n<br>\\n\\n### Clinical Critical Effects\\n\\nThe critical or lead effects of {name} in clinical data were treatment of hypertension.",
+        "dosage_detail": {
+            "frequency": "once daily",
+            "amount_per_use": "10 mg",
+            "percentages": [],
+            "formulations": ["tablet"],
+            "strength": "10 mg",
+            "min_daily_dose": "10 mg",
+        },
+    }),
+    ("toxicity information", {
+        "ingredient_name": "{name}",
+        "section_name": "{section}",
+        "content": "No evidence found in the simulated sources.",
+        "link": ["https://example.org/simulated"],
+        "result": "No",
+        "result_detail": "Simulated response.",
+    }),
+]
+
+JSON_BLOCK = re.compile(r'```json\s*([\s\S]*?)\s*```')
+
+
+def _example_json(prompt):
+    """取提示词中最后一个能解析的JSON示例，作为模拟输出"""
+    for block in reversed(JSON_BLOCK.findall(prompt)):
+        try:
+            data = json.loads(block)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _fill(template, **values):
+    text = json.dumps(template, ensure_ascii=False)
+    for key, value in values.items():
+        text = text.replace("{" + key + "}", value)
+    return json.loads(text)
+
+
+def llm_output(prompt, json_mode=False):
+    """根据提示词生成模拟的LLM输出文本（包含```json代码块，JSON模式时只输出JSON）"""
+    data = None
+    for marker, canned in CANNED_LLM_OUTPUTS:
+        if marker in prompt:
+            data = canned
+            break
+    if data is None:
+        data = _example_json(prompt) or {}
+    if json_mode:
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    return "```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+
+
+def chat_completion(payload):
+    """根据请求体生成非流式的chat.completion响应"""
+    prompt = "\n".join(str(m.get("content", "")) for m in payload.get("messages", []))
+    content = llm_output(prompt, json_mode="response_format" in payload)
+    return {
+        "id": f"chatcmpl-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", ""),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+def search_output(query):
+    """根据查询生成模拟的Perplexity回答文本"""
+    name = re.search(r'active ingredient: (.+)|Extract the "drug info" for (.+?) in', query)
+    name = next((g for g in name.groups() if g), "Unknown").strip() if name else "Unknown"
+    section = re.search(r'Extract the "(.+?)" toxicity', query)
+    section = section.group(1) if section else ""
+    for marker, canned in CANNED_SEARCH_OUTPUTS:
+        if marker in query:
+            data = _fill(canned, name=name, section=section)
+            return "```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+    return f"Simulated search result for: {query.strip()[:200]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeBackend/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    # 通用工具
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        return json.loads(body or b"{}")
+
+    def _simulate(self, service):
+        """按配置的延迟等待，按错误率返回错误；返回True表示已发送错误响应"""
+        backend = self.server.backend
+        config = backend.config.services[service]
+        delay, failed = backend.sample(config)
+        backend.record(service, failed)
+        time.sleep(delay)
+        if failed:
+            status = random.choice([429, 500])
+            # 429时和真实接口一样返回Retry-After
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send_json({"error": {"message": "simulated error", "code": status}}, status, headers)
+        return failed
+
+    # 路由
+    def do_GET(self):
+        if self.path.startswith("/llm/") and "/files/" in self.path and self.path.endswith("/content"):
+            self._file_content()
+        elif self.path.startswith("/llm/") and "/batches/" in self.path:
+            self._batch_status()
+        elif self.path.startswith("/llm/") and "/files/" in self.path:
+            self._file_retrieve()
+        elif self.path.startswith("/docs/"):
+            self._document()
+        elif self.path.startswith("/pubchem/"):
+            self._pubchem()
+        elif self.path.startswith("/google/"):
+            self._google()
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path.startswith("/llm/") and self.path.endswith("/chat/completions"):
+            self._llm()
+        elif self.path.startswith("/llm/") and self.path.endswith("/files"):
+            self._file_upload()
+        elif self.path.startswith("/llm/") and self.path.endswith("/batches"):
+            self._batch_create()
+        elif self.path.startswith("/llm/") and self.path.endswith("/cancel"):
+            self._batch_cancel()
+        elif self.path.startswith("/perplexity/"):
+            self._perplexity()
+        elif self.path.startswith("/bocha/"):
+            self._bocha()
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    # 各服务
+    def _llm(self):
+        payload = self._read_json()
+        if self._simulate("llm"):
+            return
+        if "response_format" in payload and not self.server.backend.config.response_format:
+            self._send_json({"error": {"message": "response_format is not supported", "code": 400}}, 400)
+            return
+        # 和真实接口一样，引用不存在(已过期或被删除)的文件时返回400
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str) and content.startswith("fileid://"):
+                file_id = content[len("fileid://"):]
+                if file_id not in self.server.backend.files:
+                    self._send_json({"error": {"message": f"File not found: {file_id}", "code": 400}}, 400)
+                    return
+        completion = chat_completion(payload)
+        if not payload.get("stream"):
+            self._send_json(completion)
+            return
+        request_id, model, created = completion["id"], completion["model"], completion["created"]
+        content = completion["choices"][0]["message"]["content"]
+        usage = completion["usage"]
+        # 流式输出：SSE，最后一个chunk携带usage
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        pieces = self.server.backend.config.stream_chunks
+        size = max(len(content) // pieces + 1, 1)
+        for start in range(0, len(content), size):
+            self._sse({
+                "id": request_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"role": "assistant", "content": content[start:start + size]}}],
+            })
+        self._sse({
+            "id": request_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "delta": {"content": ""}}],
+        })
+        self._sse({
+            "id": request_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [], "usage": usage,
+        })
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    # 批处理
+    def _file_upload(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        message = BytesParser(policy=policy.default).parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode() + b"\r\n\r\n" + body)
+        content, filename, purpose = b"", "upload.jsonl", "batch"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True) or b""
+                filename = part.get_filename() or filename
+            elif name == "purpose":
+                purpose = part.get_content().strip()
+        self._send_json(self.server.backend.add_file(content, filename, purpose))
+
+    def _file_retrieve(self):
+        file_id = self.path.split("?")[0].rstrip("/").split("/")[-1]
+        content = self.server.backend.files.get(file_id)
+        if content is None:
+            self._send_json({"error": {"message": f"No such file: {file_id}"}}, 404)
+            return
+        self._send_json({"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                         "filename": file_id, "purpose": "file-extract", "status": "processed"})
+
+    def _document(self):
+        backend = self.server.backend
+        name = self.path.split("?")[0][len("/docs/"):]
+        content = backend.documents.get(name)
+        with backend._lock:
+            backend.document_requests.append((name, self.headers.get("If-None-Match")))
+        if content is None:
+            self._send_json({"error": "not found"}, 404)
+            return
+        etag = '"{}"'.format(hashlib.sha256(content).hexdigest()[:16])
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _file_content(self):
+        file_id = self.path.split("?")[0].rstrip("/").split("/")[-2]
+        content = self.server.backend.files.get(file_id)
+        if content is None:
+            self._send_json({"error": {"message": f"No such file: {file_id}"}}, 404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _batch_create(self):
+        payload = self._read_json()
+        backend = self.server.backend
+        if payload.get("input_file_id") not in backend.files:
+            self._send_json({"error": {"message": "input file not found"}}, 400)
+            return
+        self._send_json(backend.create_batch(payload))
+
+    def _batch_status(self):
+        batch = self.server.backend.batches.get(self.path.split("?")[0].rstrip("/").split("/")[-1])
+        if batch is None:
+            self._send_json({"error": {"message": "batch not found"}}, 404)
+        else:
+            self._send_json(batch)
+
+    def _batch_cancel(self):
+        batch = self.server.backend.batches.get(self.path.split("?")[0].rstrip("/").split("/")[-2])
+        if batch is None:
+            self._send_json({"error": {"message": "batch not found"}}, 404)
+            return
+        if batch["status"] not in ("completed", "failed", "expired"):
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+        self._send_json(batch)
+
+    def _sse(self, data):
+        self.wfile.write(("data: " + json.dumps(data, ensure_ascii=False) + "\n\n").encode('utf-8'))
+        self.wfile.flush()
+
+    def _perplexity(self):
+        payload = self._read_json()
+        if self._simulate("perplexity"):
+            return
+        query = "\n".join(str(m.get("content", "")) for m in payload.get("messages", []) if m.get("role") == "user")
+        content = search_output(query)
+        self._send_json({
+            "id": f"pplx-{random.getrandbits(48):x}",
+            "model": payload.get("model", "sonar"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "citations": ["https://example.org/simulated/1", "https://example.org/simulated/2"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(query) // 4, "completion_tokens": len(content) // 4},
+        })
+
+    def _bocha(self):
+        payload = self._read_json()
+        if self._simulate("bocha"):
+            return
+        query = payload.get("query", "")
+        count = payload.get("count", 8)
+        self._send_json({"code": 200, "data": {"webPages": {"value": [
+            {"url": f"https://example.org/simulated/{i}",
+             "snippet": f"Simulated snippet {i} for {query[:80]}",
+             "summary": f"Simulated summary {i} for {query[:80]}"}
+            for i in range(count)
+        ]}}})
+
+    def _google(self):
+        if self._simulate("google"):
+            return
+        self._send_json({"items": [
+            {"title": f"Simulated result {i}", "link": f"https://example.org/simulated/{i}",
+             "snippet": f"Simulated snippet {i}"}
+            for i in range(10)
+        ]})
+
+    def _pubchem(self):
+        if self._simulate("pubchem"):
+            return
+        path = self.path.split("?")[0]
+        if path.endswith("/cids/JSON"):
+            self._send_json({"IdentifierList": {"CID": [abs(hash(path)) % 10 ** 6]}})
+        elif path.endswith("/sids/JSON"):
+            self._send_json({"IdentifierList": {"SID": [abs(hash(path)) % 10 ** 6]}})
+        elif "/pug_view/data/" in path:
+            self._send_json({"Record": {"RecordTitle": "Simulated compound", "Section": []}})
+        else:
+            self._send_json({"Fault": {"Code": "PUGREST.NotFound"}}, 404)
+
+
+class FakeBackend:
+    """
+    在后台线程中运行的模拟服务
+    用法:
+        with FakeBackend() as backend:
+            os.environ.update(backend.environ())
+            ...
+    """
+
+    def __init__(self, config: BackendConfig = None, host="127.0.0.1", port=0):
+        self.config = config or BackendConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = {name: 0 for name in self.config.services}
+        self.errors = {name: 0 for name in self.config.services}
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.backend = self
+        self._thread = None
+        # 上传的文件和批处理任务
+        self.files = {}
+        self.batches = {}
+        # /docs/<name> 下载的文档内容，以及收到的下载请求 (name, If-None-Match)
+        self.documents = {}
+        self.document_requests = []
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sample(self, config):
+        """返回 (延迟, 是否失败)，共用一个带种子的随机数生成器，结果可复现"""
+        with self._lock:
+            return config.latency.sample(self._rng), self._rng.random() < config.error_rate
+
+    def record(self, service, failed):
+        with self._lock:
+            self.requests[service] += 1
+            if failed:
+                self.errors[service] += 1
+
+    def add_file(self, content, filename, purpose):
+        file_id = f"file-{random.getrandbits(48):x}"
+        with self._lock:
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def create_batch(self, payload):
+        """创建批处理任务，在后台线程中按配置的延迟完成"""
+        lines = [json.loads(line) for line in self.files[payload["input_file_id"]].decode('utf-8').splitlines()
+                 if line.strip()]
+        batch = {
+            "id": f"batch_{random.getrandbits(48):x}",
+            "object": "batch",
+            "endpoint": payload.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": payload["input_file_id"],
+            "completion_window": payload.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._complete_batch, args=(batch, lines), daemon=True).start()
+        return batch
+
+    def _complete_batch(self, batch, lines):
+        config = self.config.services["batch"]
+        delay, _ = self.sample(config)
+        time.sleep(delay)
+        if batch["status"] == "cancelled":
+            return
+        outputs, errors = [], []
+        for line in lines:
+            _, failed = self.sample(config)
+            self.record("batch", failed)
+            item = {"id": f"batch_req_{random.getrandbits(48):x}", "custom_id": line["custom_id"], "error": None}
+            if failed:
+                item["response"] = {"status_code": 500, "body": {"error": {"message": "simulated error", "code": 500}}}
+                errors.append(item)
+            else:
+                item["response"] = {"status_code": 200, "request_id": item["id"], "body": chat_completion(line["body"])}
+                outputs.append(item)
+        for key, items in (("output_file_id", outputs), ("error_file_id", errors)):
+            if items:
+                content = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode('utf-8')
+                batch[key] = self.add_file(content, f"{batch['id']}_{key}.jsonl", "batch_output")["id"]
+        batch["request_counts"] = {"total": len(lines), "completed": len(outputs), "failed": len(errors)}
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+    def environ(self):
+        """各模块读取的环境变量，指向本模拟服务"""
+        return {
+            "AITEP_BASE_URL": f"{self.url}/llm/v1",
+            "AITEP_API_KEY": "fake-key",
+            "PERPLEXITY_API_URL": f"{self.url}/perplexity/chat/completions",
+            "PERPLEXITY_API_KEY": "fake-key",
+            "BOCHA_API_URL": f"{self.url}/bocha/v1/web-search",
+            "BOCHA_API_KEY": "fake-key",
+            "GOOGLE_API_ENDPOINT": f"{self.url}/google/",
+            "GOOGLE_API_KEY": "fake-key",
+            "GOOGLE_CSE_ID": "fake-cse",
+            "PUBCHEM_BASE_URL": f"{self.url}/pubchem",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    with FakeBackend(port=8765) as backend:
+        for key, value in backend.environ().items():
+            print(f"export {key}={value}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -1,5 +1,6 @@
 import json
-from utils.search_utils import perform_search
+import asyncio
+from utils.search_utils import perform_search, perform_search_async
 from utils.search_utils import PerplexitySearch
 import json
 # especial for daily_med need to upgrade
@@ -51,18 +52,19 @@ When sources from the same level conflict:
 """
 
 
-def process_toxicity(ingredient, toxicity_type="Genotoxicity"):
-    """
-    处理单个成分的毒性信息
-    
-    参数:
-        ingredient (str): 成分名称
-        toxicity_type (str): 毒性类型，默认为"Genotoxicity"
-        
-    返回:
-        str: 包含处理结果的JSON字符串
-    """
-    result = {
+# 定义需要处理的毒性类型
+toxicity_types = [
+    "Genotoxicant",
+    "Carcinogen",
+    "Reproductive/Developmental Toxicant",
+    "Highly Sensitizing Potential"
+]
+
+# 版本指纹：查询模板、毒性类型或搜索请求参数变化时，已保存的步骤结果失效
+VERSION = PerplexitySearch.fingerprint(regulation_prompt, toxicity_types)
+
+def _new_result(toxicity_type):
+    return {
         "toxicity_type": toxicity_type,
         "reference_links": "",
         "result": "",
@@ -75,6 +77,38 @@ def process_toxicity(ingredient, toxicity_type="Genotoxicity"):
         "message":"",
         "GAI_original": ""
     }
+
+def _fill_result(result, result_json):
+    # 确保result_json是有效的JSON字符串
+    result_json = json.loads(result_json) if isinstance(result_json, str) else result_json
+    result["GAI_original"] = result_json
+    # 解析搜索结果 (后处理方法)
+    api_result = PerplexitySearch.extract_json_data(result_json)
+
+    result["citation"] = api_result.get("citations", "")
+    # 提取内容 (后处理方法)
+    content_json = PerplexitySearch.extract_json_from_content(api_result.get("contents", ""))
+    
+    # 填充结果字段
+    result["ingredient_name"] = content_json.get("ingredient_name","")
+    result["section_name"] = content_json.get("section_name", "")
+    result["content"] = content_json.get("content", "")
+    result["reference_links"] = content_json.get("link", "")
+    result["result"] = content_json.get("result", "")
+    result["result_detail"] = content_json.get("result_detail", "")
+
+def process_toxicity(ingredient, toxicity_type="Genotoxicity"):
+    """
+    处理单个成分的毒性信息
+    
+    参数:
+        ingredient (str): 成分名称
+        toxicity_type (str): 毒性类型，默认为"Genotoxicity"
+        
+    返回:
+        str: 包含处理结果的JSON字符串
+    """
+    result = _new_result(toxicity_type)
     
     try:
         # 构建搜索查询
@@ -82,23 +116,7 @@ def process_toxicity(ingredient, toxicity_type="Genotoxicity"):
         
         # 调用API获取搜索结果
         result_json = perform_search(searchword)
-        # 确保result_json是有效的JSON字符串
-        result_json = json.loads(result_json) if isinstance(result_json, str) else result_json
-        result["GAI_original"] = result_json
-        # 解析搜索结果 (后处理方法)
-        api_result = PerplexitySearch.extract_json_data(result_json)
-
-        result["citation"] = api_result.get("citations", "")
-        # 提取内容 (后处理方法)
-        content_json = PerplexitySearch.extract_json_from_content(api_result.get("contents", ""))
-        
-        # 填充结果字段
-        result["ingredient_name"] = content_json.get("ingredient_name","")
-        result["section_name"] = content_json.get("section_name", "")
-        result["content"] = content_json.get("content", "")
-        result["reference_links"] = content_json.get("link", "")
-        result["result"] = content_json.get("result", "")
-        result["result_detail"] = content_json.get("result_detail", "")
+        _fill_result(result, result_json)
     except Exception as e:
         # 发生异常时记录错误信息
         result["status"] = "error"
@@ -107,6 +125,20 @@ def process_toxicity(ingredient, toxicity_type="Genotoxicity"):
     # 将结果转换为JSON字符串并返回
     return json.dumps(result, ensure_ascii=False)
 
+async def process_toxicity_async(ingredient, toxicity_type="Genotoxicity"):
+    """process_toxicity的异步版本，参数和返回值相同"""
+    result = _new_result(toxicity_type)
+    
+    try:
+        searchword = regulation_prompt % (toxicity_type, ingredient, toxicity_type, toxicity_type, toxicity_type)
+        result_json = await perform_search_async(searchword)
+        _fill_result(result, result_json)
+    except Exception as e:
+        result["status"] = "error"
+        result["message"] = str(e)
+    
+    return json.dumps(result, ensure_ascii=False)
+
 def all_toxicities(ingredient):
     """
     处理单个成分的多种毒性信息
@@ -117,14 +149,6 @@ def all_toxicities(ingredient):
     返回:
         str: 包含所有毒性处理结果的JSON字符串
     """
-    # 定义需要处理的毒性类型
-    toxicity_types = [
-        "Genotoxicant",
-        "Carcinogen",
-        "Reproductive/Developmental Toxicant",
-        "Highly Sensitizing Potential"
-    ]
-    
     try:
         # 处理每种毒性类型
         toxicity_results = []
@@ -152,6 +176,26 @@ def all_toxicities(ingredient):
     # 将结果转换为JSON字符串并返回
     return json.dumps(result, ensure_ascii=False)
 
+async def all_toxicities_async(ingredient):
+    """all_toxicities的异步版本，各毒性类型的搜索并发执行，结果顺序与toxicity_types一致"""
+    try:
+        toxicity_result_jsons = await asyncio.gather(
+            *(process_toxicity_async(ingredient, toxicity_type) for toxicity_type in toxicity_types)
+        )
+        result = {
+            "harzard_identification": [json.loads(r) for r in toxicity_result_jsons],
+            "status": "success",
+            "message": ""
+        }
+    except Exception as e:
+        result = {
+            "harzard_identification": [],
+            "status": "error",
+            "message": str(e)
+        }
+    
+    return json.dumps(result, ensure_ascii=False)
+
     
 if __name__ == "__main__":
     # 测试
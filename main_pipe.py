@@ -1,6 +1,39 @@
+import asyncio
+import contextvars
+import copy
+import queue
+import threading
+import json
+import time
+import hashlib
+import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dataclasses import dataclass
-from typing import Dict, List, Any, Optional, Callable
+from fnmatch import fnmatchcase
+from typing import Dict, List, Any, Optional, Callable, Set, Tuple, Iterable
+from utils import metrics
+
+
+def run_sync(coro):
+    """
+    在同步代码中运行协程并返回结果
+    如果当前线程已有运行中的事件循环（例如在Jupyter中），则在独立线程的新事件循环中运行
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_closing_clients(coro))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, _closing_clients(coro)).result()
+
+
+async def _closing_clients(coro):
+    # 事件循环结束前关闭该循环中缓存的HTTP客户端，避免连接泄漏
+    try:
+        return await coro
+    finally:
+        await close_loop_clients()
 
 # 数据模型
 @dataclass
@@ -14,62 +47,391 @@ class DrugInfo:
         if self.data is None:
             self.data = {}
 
+# 同步处理器共用的线程池
+_step_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="pipeline-step")
+
 # 处理器接口
-# 
+# requires/provides 声明处理器读取和写入的 DrugInfo.data 键，Pipeline 据此构建依赖图(DAG)
+# 未声明(None)的处理器按顺序屏障处理：等待之前所有步骤完成，之后的步骤也都等待它
+# version 为处理器的版本指纹（提示词模板、模型、参数），变化后该步骤已保存的检查点失效
 class InfoProvider(ABC):
+    requires: Optional[Tuple[str, ...]] = None
+    provides: Optional[Tuple[str, ...]] = None
+    version: Optional[str] = None
+
     @abstractmethod
     def process(self, drug_info: DrugInfo) -> DrugInfo:
         """处理药物信息并返回更新后的DrugInfo对象"""
         pass
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
+        """
+        异步处理接口，同步处理器默认在共享线程池中执行process
+        不使用事件循环自带的线程池：超时被放弃的步骤仍在运行时，事件循环关闭不必等它结束
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_step_executor, context.run, self.process, drug_info)
     
     @property
     def provider_name(self) -> str:
         """返回处理器名称"""
         return self.__class__.__name__
 
+# 异步处理器接口：实现aprocess，process为同步包装
+class AsyncInfoProvider(InfoProvider):
+    @abstractmethod
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
+        """异步处理药物信息并返回更新后的DrugInfo对象"""
+        pass
+
+    def process(self, drug_info: DrugInfo) -> DrugInfo:
+        return run_sync(self.aprocess(drug_info))
+
 class Pipeline:
-    def __init__(self):
+    def __init__(self, max_workers: int = 4, checkpoint_store=None, step_timeout: Optional[float] = None,
+                 step_timeouts: Optional[Dict[str, float]] = None, deadline: Optional[float] = None):
+        """
+        参数:
+            max_workers (int): 同时执行的步骤数上限，1 表示严格按顺序执行
+            checkpoint_store: 步骤检查点存储(如 StepCheckpointStore)，为None时不保存也不恢复
+            step_timeout (float): 每个步骤的默认时限(秒)，None 表示不限
+            step_timeouts (dict): 处理器名称 -> 该步骤的时限(秒)，覆盖step_timeout
+            deadline (float): 单个药物的总时限(秒)，到时后未开始的步骤被跳过，正在运行的步骤被放弃
+        """
         self.steps = []
         self.event_bus = EventBus()
+        self.max_workers = max_workers
+        self.checkpoint_store = checkpoint_store
+        self.step_timeout = step_timeout
+        self.step_timeouts = step_timeouts or {}
+        self.deadline = deadline
     
     def add_step(self, provider: InfoProvider):
         self.steps.append(provider)
         return self
-    
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
-        result = drug_info
-        for step in self.steps:
+
+    @staticmethod
+    def _depends_on(step: InfoProvider, earlier: InfoProvider) -> bool:
+        """判断step是否必须在earlier之后执行"""
+        if None in (step.requires, step.provides, earlier.requires, earlier.provides):
+            return True
+        earlier_out = set(earlier.provides)
+        # 写后读、写后写、读后写 三种冲突都需要保持原有顺序
+        return bool(earlier_out & set(step.requires)
+                    or earlier_out & set(step.provides)
+                    or set(earlier.requires) & set(step.provides))
+
+    def build_dependencies(self) -> Dict[int, Set[int]]:
+        """
+        根据各步骤的requires/provides声明构建DAG
+        
+        返回:
+            dict: 步骤索引 -> 必须先完成的步骤索引集合（只会指向更早添加的步骤，因此不会成环）
+        """
+        return {
+            i: {j for j in range(i) if self._depends_on(step, self.steps[j])}
+            for i, step in enumerate(self.steps)
+        }
+
+    def _step_budget(self, step: InfoProvider, deadline_at: Optional[float]) -> Optional[float]:
+        """步骤可用的时间(秒)：步骤时限与药物剩余时间中较小的一个"""
+        budget = self.step_timeouts.get(step.provider_name, self.step_timeout)
+        if deadline_at is not None:
+            remaining = deadline_at - time.monotonic()
+            budget = remaining if budget is None else min(budget, remaining)
+        return budget
+
+    def _record_error(self, drug_info: DrugInfo, step: InfoProvider, message: str, error: str):
+        drug_info.data['errors'] = drug_info.data.get('errors', [])
+        drug_info.data['errors'].append(message)
+        self.event_bus.publish("pipeline_error", {"step": step.provider_name, "error": error})
+
+    async def _run_step(self, step: InfoProvider, drug_info: DrugInfo, timeout: Optional[float] = None,
+                        run_id: Optional[str] = None) -> DrugInfo:
+        """
+        在步骤私有的DrugInfo副本上执行单个步骤，异常记录到副本的errors中
+        超过timeout(秒)的步骤被放弃，只返回超时错误，不合并它写了一半的数据
+        完成后发布step_metrics事件：耗时、LLM token用量、搜索次数和缓存命中次数
+        run_id 为本次aprocess的标识，同一成分和途径的多行并发处理时按它区分各自的指标
+        """
+        start = time.perf_counter()
+        apid = drug_info.data.get('APID')
+        with metrics.collect() as step_metrics:
             try:
                 # 发布处理前事件
-                self.event_bus.publish(f"before_{step.provider_name}", result)
+                self.event_bus.publish(f"before_{step.provider_name}", drug_info)
                 
                 # 执行处理步骤
-                result = step.process(result)
+                drug_info = await asyncio.wait_for(step.aprocess(drug_info), timeout)
                 
                 # 发布处理后事件
-                self.event_bus.publish(f"after_{step.provider_name}", result)
+                self.event_bus.publish(f"after_{step.provider_name}", drug_info)
             except Exception as e:
-                result.data['errors'] = result.data.get('errors', [])
-                result.data['errors'].append(f"Error in pipeline step {step.provider_name}: {str(e)}")
-                self.event_bus.publish("pipeline_error", {"step": step.provider_name, "error": str(e)})
+                if isinstance(e, asyncio.TimeoutError) and timeout is not None:
+                    drug_info = DrugInfo(drug_name=drug_info.drug_name, route=drug_info.route)
+                    self._record_error(drug_info, step,
+                                       f"Timeout in pipeline step {step.provider_name}: exceeded {timeout:.1f}s",
+                                       f"timeout after {timeout:.1f}s")
+                else:
+                    self._record_error(drug_info, step,
+                                       f"Error in pipeline step {step.provider_name}: {str(e)}", str(e))
+        self.event_bus.publish("step_metrics", {
+            "run_id": run_id,
+            "APID": apid,
+            "drug_name": drug_info.drug_name,
+            "route": drug_info.route,
+            "step": step.provider_name,
+            "wall_time": time.perf_counter() - start,
+            "success": not drug_info.data.get('errors'),
+            **step_metrics,
+        })
+        return drug_info
+
+    @staticmethod
+    def _step_input(drug_info: DrugInfo) -> DrugInfo:
+        """为步骤创建独立副本，并行步骤之间互不干扰；errors 由各步骤单独收集后合并"""
+        data = {k: copy.deepcopy(v) for k, v in drug_info.data.items() if k != 'errors'}
+        return DrugInfo(drug_name=drug_info.drug_name, route=drug_info.route, data=data)
 
+    @staticmethod
+    def _merge(drug_info: DrugInfo, step_result: DrugInfo, baseline: Dict[str, Any]):
+        """把步骤相对其输入(baseline)新增或修改的键合并回共享的DrugInfo，避免用旧值覆盖并行步骤的结果"""
+        missing = object()
+        for key, value in step_result.data.items():
+            if key == 'errors':
+                if value:
+                    drug_info.data.setdefault('errors', []).extend(value)
+            elif baseline.get(key, missing) != value:
+                drug_info.data[key] = value
+
+    @staticmethod
+    def _fingerprint(step: InfoProvider, data: Dict[str, Any]) -> str:
+        """
+        步骤检查点的指纹：由步骤版本和它读取的输入共同决定
+        上游步骤的版本变化会改变下游的输入，下游的检查点也随之失效
+        """
+        keys = step.requires if step.requires is not None else sorted(k for k in data if k != 'errors')
+        content = json.dumps({"version": step.version, "inputs": {k: data.get(k) for k in keys}},
+                             ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _is_successful(step: InfoProvider, step_result: DrugInfo) -> bool:
+        """步骤没有记录错误、写入了声明的所有键，且其中的PoD/因子结果都已算出，才视为成功"""
+        if step_result.data.get('errors'):
+            return False
+        provides = step.provides or ()
+        if not all(key in step_result.data for key in provides):
+            return False
+        return not any(Pipeline._has_failed_entry(step_result.data[key]) for key in provides)
+
+    @staticmethod
+    def _has_failed_entry(value) -> bool:
+        """结果（字典或字典列表）中有status不是success、或PoD_value/value为None的条目"""
+        for entry in (value if isinstance(value, list) else [value]):
+            if not isinstance(entry, dict):
+                continue
+            if entry.get('status', 'success') != 'success':
+                return True
+            if any(key in entry and entry[key] is None for key in ('PoD_value', 'value')):
+                return True
+        return False
+
+    def _save_checkpoint(self, step: InfoProvider, step_result: DrugInfo, fingerprint: str):
+        try:
+            self.checkpoint_store.save(step_result.drug_name, step_result.route,
+                                       step.provider_name, step_result.data, fingerprint)
+        except Exception as e:
+            # 检查点只是加速重跑，写入失败不影响本次处理
+            print(f"保存检查点失败 {step.provider_name}: {str(e)}")
+
+    def _restore_checkpoints(self, drug_info: DrugInfo, pending: Dict[int, Set[int]]) -> Set[int]:
+        """
+        从检查点恢复已完成的步骤
+        只有步骤的检查点指纹与当前版本和输入一致、且它依赖的步骤也都已恢复时才复用，否则从该步骤开始重新执行
+
+        返回:
+            set: 已恢复(无需执行)的步骤索引
+        """
+        restored = set()
+        for index in sorted(pending):
+            if not pending[index] <= restored:
+                continue
+            step = self.steps[index]
+            checkpoint = self.checkpoint_store.load(drug_info.drug_name, drug_info.route, step.provider_name)
+            if checkpoint is None or checkpoint.get('fingerprint') != self._fingerprint(step, drug_info.data):
+                continue
+            snapshot = checkpoint.get('data', {})
+            # 声明了provides的步骤只恢复它写入的键，未声明的步骤恢复整个快照
+            keys = step.provides if step.provides is not None else snapshot.keys()
+            if not all(key in snapshot for key in keys):
+                continue
+            for key in keys:
+                if key != 'errors':
+                    drug_info.data[key] = snapshot[key]
+            restored.add(index)
+            self.event_bus.publish(f"restored_{step.provider_name}", drug_info)
+        return restored
+
+    def process(self, drug_info: DrugInfo, deadline: Optional[float] = None) -> DrugInfo:
+        """aprocess的同步包装"""
+        return run_sync(self.aprocess(drug_info, deadline))
+
+    async def aprocess(self, drug_info: DrugInfo, deadline: Optional[float] = None) -> DrugInfo:
+        """
+        执行所有步骤
+        deadline(秒)覆盖Pipeline的默认药物总时限；超时时返回已完成步骤的结果，超时和跳过的步骤记录在errors中
+        """
+        result = drug_info
+        start = time.perf_counter()
+        run_id = uuid.uuid4().hex
+        deadline = self.deadline if deadline is None else deadline
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        # 依赖已满足的步骤并发执行，单个药物的耗时由关键路径决定
+        pending = self.build_dependencies()
+        if self.checkpoint_store is not None:
+            for index in self._restore_checkpoints(result, pending):
+                del pending[index]
+                for deps in pending.values():
+                    deps.discard(index)
+        running = {}
+        while pending or running:
+            if deadline_at is not None and time.monotonic() >= deadline_at:
+                # 总时限已到，跳过尚未开始的步骤，正在运行的步骤会在自己的时限内结束
+                for index in sorted(pending):
+                    step = self.steps[index]
+                    self._record_error(result, step,
+                                       f"Skipped pipeline step {step.provider_name}: deadline of {deadline:.1f}s exceeded",
+                                       "deadline exceeded")
+                pending.clear()
+                if not running:
+                    break
+            ready = sorted(i for i, deps in pending.items() if not deps)
+            for index in ready[:max(self.max_workers, 1) - len(running)]:
+                del pending[index]
+                step = self.steps[index]
+                # 指纹按步骤开始时读取的输入计算
+                fingerprint = self._fingerprint(step, result.data) if self.checkpoint_store is not None else None
+                task = asyncio.ensure_future(self._run_step(step, self._step_input(result),
+                                                            self._step_budget(step, deadline_at), run_id))
+                running[task] = (index, dict(result.data), fingerprint)
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            # 按步骤顺序合并，保证errors等输出的顺序稳定
+            for task in sorted(done, key=lambda t: running[t][0]):
+                index, baseline, fingerprint = running.pop(task)
+                step_result = task.result()
+                if self.checkpoint_store is not None and self._is_successful(self.steps[index], step_result):
+                    self._save_checkpoint(self.steps[index], step_result, fingerprint)
+                self._merge(result, step_result, baseline)
+                for deps in pending.values():
+                    deps.discard(index)
+
+        self.event_bus.publish("drug_metrics", {
+            "run_id": run_id,
+            "APID": result.data.get('APID'),
+            "drug_name": result.drug_name,
+            "route": result.route,
+            "wall_time": time.perf_counter() - start,
+        })
         return result
 
+class _BackgroundSubscriber:
+    """在后台线程中从有界队列取出事件并调用订阅者，发布方不等待订阅者执行完成"""
+
+    def __init__(self, callback: Callable, maxsize: int = 1000, policy: str = "block"):
+        if policy not in ("block", "drop"):
+            raise ValueError(f"未知的队列策略: {policy}")
+        self.callback = callback
+        self.policy = policy
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name=f"EventBus-{getattr(callback, '__name__', 'subscriber')}")
+        self.thread.start()
+
+    def __call__(self, *args):
+        if self.policy == "block":
+            # 队列满时阻塞发布方，不丢事件
+            self.queue.put(args)
+            return
+        try:
+            self.queue.put_nowait(args)
+        except queue.Full:
+            # 队列满时丢弃新事件，发布方不受影响
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            args = self.queue.get()
+            try:
+                if args is None:
+                    return
+                self.callback(*args)
+            except Exception as e:
+                print(f"Error in event subscriber {getattr(self.callback, '__name__', self.callback)}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """等待队列中已有的事件处理完"""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
 class EventBus:
     def __init__(self):
         self.subscribers = {}
+        self._background = []
     
-    def subscribe(self, event_name: str, callback: Callable):
+    def subscribe(self, event_name: str, callback: Callable, background: bool = False,
+                  maxsize: int = 1000, policy: str = "block", with_event_name: bool = False):
+        """
+        订阅事件
+        
+        参数:
+            event_name (str): 事件名，支持通配符，例如 after_* 订阅所有步骤的处理后事件
+            callback: 回调函数，默认以 callback(data) 调用
+            background (bool): 是否在后台线程中执行回调，避免慢的订阅者（如写磁盘）增加每个步骤的耗时
+                后台回调拿到的是事件数据的引用，执行时数据可能已被后续步骤修改
+            maxsize (int): 后台队列长度上限
+            policy (str): 后台队列满时的策略，block 阻塞发布方，drop 丢弃新事件
+            with_event_name (bool): 为True时以 callback(event_name, data) 调用，便于通配符订阅区分事件
+        """
+        if with_event_name:
+            handler = callback
+        else:
+            handler = lambda name, data: callback(data)
+        if background:
+            handler = _BackgroundSubscriber(handler, maxsize, policy)
+            self._background.append(handler)
         if event_name not in self.subscribers:
             self.subscribers[event_name] = []
-        self.subscribers[event_name].append(callback)
+        self.subscribers[event_name].append(handler)
     
     def publish(self, event_name: str, data: Any):
-        if event_name in self.subscribers:
-            for callback in self.subscribers[event_name]:
-                callback(data)
+        for pattern, callbacks in list(self.subscribers.items()):
+            if pattern == event_name or (any(c in pattern for c in "*?[") and fnmatchcase(event_name, pattern)):
+                for callback in list(callbacks):
+                    callback(event_name, data)
+
+    def join(self):
+        """等待所有后台订阅者处理完已发布的事件"""
+        for subscriber in self._background:
+            subscriber.join()
+
+    def close(self):
+        """处理完已发布的事件后停止后台线程，并取消这些订阅"""
+        background = self._background
+        self._background = []
+        for event_name, callbacks in self.subscribers.items():
+            self.subscribers[event_name] = [c for c in callbacks if c not in background]
+        for subscriber in background:
+            subscriber.close()
 
-import json
 import baseinfo
 import pharmacy
 import hazards
@@ -78,10 +440,35 @@ import PoD
 import F3
 import F4
 import F5
+import F345
 import other_factors
 import alpha_factor
+from utils import search_utils
+from utils.llm_utils import client_pool
+from utils.result_sink import JsonlResultSink
+from utils.checkpoint_store import StepCheckpointStore
+from utils.profiler import PipelineProfiler
+
+
+async def close_loop_clients():
+    """关闭当前事件循环中缓存的异步客户端（AsyncOpenAI和搜索用的httpx.AsyncClient），在事件循环结束前调用"""
+    await client_pool.aclose_loop()
+    await search_utils.aclose_async_clients()
+
+
+def _close_loops(loops):
+    """关闭各事件循环中缓存的客户端后关闭事件循环，需要在没有运行中事件循环的线程中调用"""
+    for loop in loops:
+        try:
+            loop.run_until_complete(close_loop_clients())
+        finally:
+            loop.close()
 
 class ChemicalInfoProvider(InfoProvider):
+    requires = ()
+    provides = ('chemical_info',)
+    version = baseinfo.VERSION
+
     def process(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             name = drug_info.drug_name
@@ -114,12 +501,16 @@ class ChemicalInfoProvider(InfoProvider):
         
         return drug_info
 
-class PharmacyInfoProvider(InfoProvider):
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
+class PharmacyInfoProvider(AsyncInfoProvider):
+    requires = ()
+    provides = ('pharmacokinetics',)
+    version = pharmacy.VERSION
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             name = drug_info.drug_name
             print(name)
-            json_data = pharmacy.get_pharmacokinetics(name)
+            json_data = await pharmacy.get_pharmacokinetics_async(name)
             data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
             
             if data_dict.get('status') == 'success':
@@ -130,6 +521,10 @@ class PharmacyInfoProvider(InfoProvider):
                     "Mechanism of Action": data_dict.get('Mechanism of Action'),
                     "reference_links": data_dict.get('reference_links')
                 }
+                # 部分关键词搜索失败时保留已提取的信息，但记录错误，该步骤不保存检查点
+                for message in data_dict.get('search_errors') or []:
+                    drug_info.data['errors'] = drug_info.data.get('errors', [])
+                    drug_info.data['errors'].append(message)
             else:
                 drug_info.data['errors'] = drug_info.data.get('errors', [])
                 drug_info.data['errors'].append(data_dict.get('message', "Unknown"))
@@ -139,12 +534,16 @@ class PharmacyInfoProvider(InfoProvider):
         
         return drug_info
 
-class ClinicalInfoProvider(InfoProvider):
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
+class ClinicalInfoProvider(AsyncInfoProvider):
+    requires = ()
+    provides = ('clinical_info', 'dosage_detail', 'new_route')
+    version = Clinical.VERSION
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             name = drug_info.drug_name
             route = drug_info.route
-            json_data = Clinical.clinical(name, route)
+            json_data = await Clinical.clinical_async(name, route)
             data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
             
             if data_dict.get('status') == 'success':
@@ -166,6 +565,8 @@ class ClinicalInfoProvider(InfoProvider):
         return drug_info
 # 特异性功能：从APID_A_3_temple.xlsx中读取数据，然后调用Clinical.clinical()函数
 class ClinicalInfoProvider_function(InfoProvider):
+    requires = ()
+    provides = ('clinical_info', 'dosage_detail', 'new_route')
 
     def process(self, drug_info: DrugInfo) -> DrugInfo:
         name = drug_info.drug_name
@@ -187,11 +588,15 @@ class ClinicalInfoProvider_function(InfoProvider):
 
 
 
-class HazardInfoProvider(InfoProvider):
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
+class HazardInfoProvider(AsyncInfoProvider):
+    requires = ()
+    provides = ('hazard_info',)
+    version = hazards.VERSION
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             name = drug_info.drug_name
-            json_data = hazards.all_toxicities(name)
+            json_data = await hazards.all_toxicities_async(name)
             data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
             
             data_output = []
@@ -203,6 +608,11 @@ class HazardInfoProvider(InfoProvider):
                         "param3": row.get('result_detail'),
                         "reference_links": row.get('reference_links')
                     })
+                    # 单个毒性类型的搜索失败时记录错误，该步骤不保存检查点，重跑时重新查询
+                    if row.get('status') != 'success':
+                        drug_info.data['errors'] = drug_info.data.get('errors', [])
+                        drug_info.data['errors'].append("Hazard {} failed: {}".format(
+                            row.get('toxicity_type'), row.get('message') or "Unknown error"))
                 drug_info.data['hazard_info'] = data_output
             else:
                 drug_info.data['errors'] = drug_info.data.get('errors', [])
@@ -213,8 +623,12 @@ class HazardInfoProvider(InfoProvider):
         
         return drug_info
 
-class PoDCalculator(InfoProvider):
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
+class PoDCalculator(AsyncInfoProvider):
+    requires = ('clinical_info', 'dosage_detail')
+    provides = ('PoD_info',)
+    version = PoD.VERSION
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             # 确保必要的数据已经存在
             if 'clinical_info' not in drug_info.data or 'dosage_detail' not in drug_info.data:
@@ -226,7 +640,7 @@ class PoDCalculator(InfoProvider):
             clinical = drug_info.data['clinical_info'].get('Clinical')
             dosage_detail = drug_info.data['dosage_detail']
             
-            json_data = PoD.PoD_value(name, clinical=clinical, dosage_detail=dosage_detail)
+            json_data = await PoD.PoD_value_async(name, clinical=clinical, dosage_detail=dosage_detail)
             data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
             
             if data_dict.get('status') == 'success':
@@ -236,14 +650,30 @@ class PoDCalculator(InfoProvider):
                     "point_of_departure": data_dict.get('point_of_departure'),
                     "point_of_departure_detail": data_dict.get('point_of_departure_detail')
                 }
+            else:
+                drug_info.data['errors'] = drug_info.data.get('errors', [])
+                drug_info.data['errors'].append(f"PoD failed: {data_dict.get('message', 'Unknown error')}")
         except Exception as e:
             drug_info.data['errors'] = drug_info.data.get('errors', [])
             drug_info.data['errors'].append(f"Error in PoDCalculator: {str(e)}")
         
         return drug_info
 
-class FactorsCalculator(InfoProvider):
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
+class FactorsCalculator(AsyncInfoProvider):
+    requires = ('clinical_info', 'hazard_info', 'PoD_info')
+    provides = ('factors',)
+    version = "|".join((F3.VERSION, F4.VERSION, F5.VERSION))
+
+    def __init__(self, fused: bool = False):
+        """
+        参数:
+            fused (bool): 为True时F3/F4/F5通过一次合并的LLM调用计算（F345），合并结果中缺失或不合格的因子再单独计算
+        """
+        self.fused = fused
+        if fused:
+            self.version = "|".join((F345.VERSION, F3.VERSION, F4.VERSION, F5.VERSION))
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             # 确保必要的数据已经存在
             required_keys = ['clinical_info', 'hazard_info', 'PoD_info']
@@ -259,17 +689,20 @@ class FactorsCalculator(InfoProvider):
             
             factors = []
             
-            # 计算F3因子
-            json_data = F3.F3_value(clinical)
-            self._process_factor_result(json_data, factors)
-            
-            # 计算F4因子
-            json_data = F4.F4_value(clinical, hazard)
-            self._process_factor_result(json_data, factors)
-            
-            # 计算F5因子
-            json_data = F5.F5_value(PoD_detail, clinical)
-            self._process_factor_result(json_data, factors)
+            if self.fused:
+                # 一次调用计算F3、F4、F5，按F3、F4、F5的顺序返回
+                for json_data in await F345.F345_values_async(clinical, hazard, PoD_detail):
+                    self._process_factor_result(json_data, factors, drug_info)
+            else:
+                # F3、F4、F5互不依赖（F5需要的PoD_info此时已经存在），并发计算，耗时为三者中最慢的一个
+                # gather按传入顺序返回，因子始终按F3、F4、F5的顺序组装
+                results = await asyncio.gather(
+                    F3.F3_value_async(clinical),
+                    F4.F4_value_async(clinical, hazard),
+                    F5.F5_value_async(PoD_detail, clinical),
+                )
+                for json_data in results:
+                    self._process_factor_result(json_data, factors, drug_info)
             
             # 添加其他因子
             other_factor_data = json.loads(other_factors.other_factors())
@@ -282,7 +715,7 @@ class FactorsCalculator(InfoProvider):
         
         return drug_info
     
-    def _process_factor_result(self, json_data, factors_list):
+    def _process_factor_result(self, json_data, factors_list, drug_info):
         data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
         
         if data_dict.get('status') == 'success':
@@ -291,9 +724,17 @@ class FactorsCalculator(InfoProvider):
                 "value": data_dict.get('value'),
                 "rationale": data_dict.get('rationale')
             })
+        else:
+            # 记录失败的因子，该步骤不会保存检查点，重跑时重新计算
+            drug_info.data['errors'] = drug_info.data.get('errors', [])
+            drug_info.data['errors'].append(f"{data_dict.get('factors')} failed: {data_dict.get('message', 'Unknown error')}")
 
-class AlphaFactorCalculator(InfoProvider):
-    def process(self, drug_info: DrugInfo) -> DrugInfo:
+class AlphaFactorCalculator(AsyncInfoProvider):
+    requires = ('new_route', 'factors')
+    provides = ('factors',)
+    version = alpha_factor.VERSION
+
+    async def aprocess(self, drug_info: DrugInfo) -> DrugInfo:
         try:
             # 检查路由是否发生变化
             if 'new_route' not in drug_info.data or drug_info.data['new_route'].lower() == drug_info.route.lower():
@@ -303,7 +744,7 @@ class AlphaFactorCalculator(InfoProvider):
             new_route = drug_info.data['new_route']
             route = drug_info.route
             
-            json_data = alpha_factor.a_factor(name, new_route, route)
+            json_data = await alpha_factor.a_factor_async(name, new_route, route)
             data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
             
             if data_dict.get('status') == 'success':
@@ -322,6 +763,9 @@ class AlphaFactorCalculator(InfoProvider):
                             break
                     else:
                         factors.append(a_factor)
+            else:
+                drug_info.data['errors'] = drug_info.data.get('errors', [])
+                drug_info.data['errors'].append(f"α failed: {data_dict.get('message', 'Unknown error')}")
         except Exception as e:
             drug_info.data['errors'] = drug_info.data.get('errors', [])
             drug_info.data['errors'].append(f"Error in AlphaFactorCalculator: {str(e)}")
@@ -331,14 +775,27 @@ class AlphaFactorCalculator(InfoProvider):
 class DrugProcessor:
     """药物信息处理类，采用模块化设计和管道模式"""
     
-    def __init__(self, log_errors=True):
+    def __init__(self, log_errors=True, max_workers=4, checkpoint_store=None,
+                 step_timeout=None, step_timeouts=None, deadline=None, fused_factors=False):
         """
         初始化药物处理器
         
         参数:
             log_errors (bool): 是否记录错误信息
+            max_workers (int): 单个药物内可并发执行的步骤数，1 表示按顺序执行
+            checkpoint_store: 步骤检查点存储，重跑时从第一个未完成的步骤继续
+            step_timeout (float): 每个步骤的默认时限(秒)
+            step_timeouts (dict): 处理器名称 -> 该步骤的时限(秒)
+            deadline (float): 单个药物的总时限(秒)，超时后返回已完成部分的结果
+            fused_factors (bool): F3/F4/F5是否合并为一次LLM调用
         """
         self.log_errors = log_errors
+        self.max_workers = max_workers
+        self.checkpoint_store = checkpoint_store
+        self.step_timeout = step_timeout
+        self.step_timeouts = step_timeouts
+        self.deadline = deadline
+        self.fused_factors = fused_factors
         self.pipeline = self._create_default_pipeline()
         self.event_bus = self.pipeline.event_bus
         
@@ -348,7 +805,9 @@ class DrugProcessor:
     
     def _create_default_pipeline(self) -> Pipeline:
         """创建默认的处理管道"""
-        pipeline = Pipeline()
+        pipeline = Pipeline(max_workers=self.max_workers, checkpoint_store=self.checkpoint_store,
+                            step_timeout=self.step_timeout, step_timeouts=self.step_timeouts,
+                            deadline=self.deadline)
         
         # 添加处理步骤
         pipeline.add_step(ChemicalInfoProvider())
@@ -356,7 +815,7 @@ class DrugProcessor:
         pipeline.add_step(ClinicalInfoProvider())
         pipeline.add_step(HazardInfoProvider())
         pipeline.add_step(PoDCalculator())
-        pipeline.add_step(FactorsCalculator())
+        pipeline.add_step(FactorsCalculator(fused=self.fused_factors))
         pipeline.add_step(AlphaFactorCalculator())
         
         return pipeline
@@ -390,7 +849,7 @@ class DrugProcessor:
     
     def process_drug(self, name, route, APID=None, api_id=None):
         """
-        处理药物的完整流程
+        处理药物的完整流程（aprocess_drug的同步包装）
         
         参数:
             name (str): 药物名称
@@ -401,18 +860,26 @@ class DrugProcessor:
         返回:
             dict: 包含所有处理结果的字典
         """
+        return run_sync(self.aprocess_drug(name, route, APID, api_id))
+
+    async def aprocess_drug(self, name, route, APID=None, api_id=None):
+        """
+        处理药物的完整流程（异步版本），可在同一个事件循环中并发处理多个药物
+        
+        参数和返回值同process_drug
+        """
         try:
             # 创建初始药物信息对象
             drug_info = DrugInfo(drug_name=name, route=route)
             
             # 添加额外信息
-            if APID:
+            if APID is not None:
                 drug_info.data['APID'] = APID
-            if api_id:
+            if api_id is not None:
                 drug_info.data['api_id'] = api_id
             
             # 执行处理管道
-            result = self.pipeline.process(drug_info)
+            result = await self.pipeline.aprocess(drug_info)
             
             # 构建最终结果
             final_result = {
@@ -437,11 +904,116 @@ class DrugProcessor:
             return final_result
         except Exception as e:
             return {
+                "APID": APID,
+                "api_id": api_id,
                 "status": "error",
                 "message": f"Error processing drug {name}: {str(e)}",
                 "drug_name": name
             }
     
+    @staticmethod
+    def _pending_rows(rows: Iterable, sink=None):
+        """跳过sink中已经成功处理过的行"""
+        for row in rows:
+            if sink is not None and sink.is_done(row[2], row[3]):
+                continue
+            yield row
+
+    def process_batch(self, rows: Iterable, concurrency: int = 4, ordered: bool = False, sink=None):
+        """
+        批量处理药物，同时处理concurrency个药物，按完成顺序逐个返回结果
+        
+        参数:
+            rows: 可迭代对象，每个元素为 (name, route, APID, api_id)
+            concurrency (int): 同时处理的药物数量
+            ordered (bool): 是否按输入顺序返回结果
+            sink: 可选的JsonlResultSink，已成功的行会被跳过，每个结果完成后立即写入
+            
+        返回:
+            生成器，逐个产出process_drug的结果字典
+        """
+        rows = iter(enumerate(self._pending_rows(rows, sink)))
+        running = {}
+        finished = {}
+        next_index = 0
+        # 每个工作线程使用一个长期的事件循环，同一线程处理的各行共用该循环中的AsyncOpenAI/httpx连接池
+        local = threading.local()
+        loops = []
+
+        def process_row(row):
+            loop = getattr(local, 'loop', None)
+            if loop is None:
+                loop = local.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                loops.append(loop)
+            return loop.run_until_complete(self.aprocess_drug(*row))
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+                def submit_next():
+                    # 按需从rows中取下一行，避免一次性提交整个表格
+                    for index, row in rows:
+                        running[executor.submit(process_row, row)] = index
+                        return
+
+                for _ in range(max(concurrency, 1)):
+                    submit_next()
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = running.pop(future)
+                        submit_next()
+                        if sink is not None:
+                            sink.write(future.result())
+                        if ordered:
+                            finished[index] = future.result()
+                        else:
+                            yield future.result()
+                    # 按输入顺序输出已经连续完成的结果
+                    while next_index in finished:
+                        yield finished.pop(next_index)
+                        next_index += 1
+        finally:
+            # 工作线程已全部结束，关闭各事件循环中的客户端后关闭事件循环
+            # 与run_sync相同，在独立线程中执行：调用方线程可能已有运行中的事件循环（例如在Jupyter中）
+            if loops:
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    executor.submit(_close_loops, loops).result()
+
+    async def aprocess_batch(self, rows: Iterable, concurrency: int = 4, ordered: bool = False, sink=None):
+        """
+        process_batch的异步版本，所有药物在同一个事件循环中并发处理
+        事件循环由调用方管理，结束前调用 await close_loop_clients() 关闭该循环中缓存的客户端
+        
+        参数和返回值同process_batch，返回异步生成器
+        """
+        rows = iter(enumerate(self._pending_rows(rows, sink)))
+        running = {}
+        finished = {}
+        next_index = 0
+
+        def submit_next():
+            for index, row in rows:
+                running[asyncio.ensure_future(self.aprocess_drug(*row))] = index
+                return
+
+        for _ in range(max(concurrency, 1)):
+            submit_next()
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = running.pop(task)
+                submit_next()
+                if sink is not None:
+                    sink.write(task.result())
+                if ordered:
+                    finished[index] = task.result()
+                else:
+                    yield task.result()
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+
     def save_result(self, result, filename='report_result.json'):
         """保存处理结果到JSON文件"""
         try:
@@ -454,8 +1026,9 @@ class DrugProcessor:
             return False
 
 if __name__ == '__main__':
-    # 创建药物处理器实例
-    processor = DrugProcessor()
+    # 创建药物处理器实例，每个步骤成功后保存检查点，失败的药物重跑时只执行未完成的步骤
+    # 每个步骤最多10分钟，每个药物最多30分钟，超时的步骤记录在errors中
+    processor = DrugProcessor(checkpoint_store=StepCheckpointStore(), step_timeout=600, deadline=1800)
     
     # 可选：添加自定义处理器
     # processor.add_processor(CustomProcessor())
@@ -473,20 +1046,13 @@ if __name__ == '__main__':
     df = pd.read_excel('APID_A_4.xlsx')
     df=df[1:]
     # df=df.head(1)
-    # 读取df中每一行的数据
-    result_list = []
-    for index, row in df.iterrows():
-        # 读取每一行的数据
-        drug_name = row['ingredient']
-        route = row['route']
-        APID = row['APID']
-        api_id = row['id']
-        # 处理药物
-        result = processor.process_drug(drug_name, route, APID, api_id)
-        result_list.append(result)
-    # 保存结果到jsonl文件中
-    with open('report_result_base_chemical_A_4.jsonl', 'w') as f:
-        for result in result_list:
-            f.write(json.dumps(result,ensure_ascii=False)+'\n')
-    
-
+    # 读取df中每一行的数据: (ingredient, route, APID, id)
+    rows = ((row['ingredient'], row['route'], row['APID'], row['id']) for _, row in df.iterrows())
+    # 同时处理4个药物，每个结果完成后立即追加到jsonl文件；重新运行时跳过已成功的行
+    # 记录每个步骤的耗时和用量，批处理结束后输出汇总报告
+    profiler = PipelineProfiler().attach(processor.event_bus)
+    with JsonlResultSink('report_result_base_chemical_A_4.jsonl') as sink:
+        for result in processor.process_batch(rows, concurrency=4, sink=sink):
+            print(f"{result.get('APID')} {result.get('drug_name')}: {result.get('status')}")
+    print(profiler.format_report())
+    profiler.write_report('profile_report_A_4.json')
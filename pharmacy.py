@@ -1,69 +1,18 @@
 
 import json
-from utils.search_utils import perform_search
+import asyncio
+from utils.search_utils import perform_search, perform_search_async
+from utils.search_utils import PerplexitySearch
 from utils.llm_utils import AITEP
-ai = AITEP()
-def get_pharmacokinetics(name,searchmethod="perplexity"):
-    """
-    获取药物的药代动力学和其他基本信息
-    
-    参数:
-        name (str): 药物名称
-        
-    返回:
-        dict: 包含药物信息的字典，或在失败时返回带有错误信息的字典
-    """
-    # 默认返回结果结构
-    default_result = {
-        "status": "success",
-        "message": "",
-        "Pharmacokinetics": {
-            "Absorption": "",
-            "Distribution": "",
-            "Metabolism": "",
-            "Excretion": ""
-        },
-        "Indication": "",
-        "Pharmacodynamics": "",
-        "Mechanism of Action": "",
-        "reference_links": "",
-        "AI_search_results": "",
-        "GAI_original": ""
-    }
-    
-    try:
-        # 定义需要搜索的关键词
-        base_info_keywords = [
-            "Pharmacokinetics['Absorption','Distribution','Metabolism','Excretion']", 
-            "Indication", 
-            "Pharmacodynamics", 
-            "Mechanism of Action"
-        ]
-        
-        # 收集所有搜索结果
-        contents = []
-        for keyword in base_info_keywords:
-            try:
-                search_prompt = f'search the drug {name} for {keyword} information'
-                   # 执行搜索
-                json_data = perform_search(search_prompt, searchmethod)
-                # 确保json_data是有效的JSON字符串
-                if not json_data:
-                    print(f"Empty search result for {search_prompt}")
-                    continue
-                data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
-                if data_dict:
-                    contents.append({"keyword": keyword, "data": data_dict})
-                else:
-                    print(f"Empty parsed data for {search_prompt}")
-            except Exception as e:
-                print(f"Error searching for {keyword}: {str(e)}")
-                # 继续处理下一个关键词，而不是整个函数失败
-        default_result["AI_search_results"] = contents
-        # 只有在有搜索结果时才调用AI处理
-        if contents:
-            # 构建AI提示
-            prompt_template = """
+# 定义需要搜索的关键词
+base_info_keywords = [
+    "Pharmacokinetics['Absorption','Distribution','Metabolism','Excretion']", 
+    "Indication", 
+    "Pharmacodynamics", 
+    "Mechanism of Action"
+]
+
+prompt_template = """
 Content Start
 ```json
 {{RESULTS}}
@@ -94,19 +43,136 @@ Requirements:
 }
 ```
                 """
-            
-            # 替换提示中的占位符
-            formatted_prompt = prompt_template.replace("{{DRUG_NAME}}", name)
-            formatted_prompt = formatted_prompt.replace("{{RESULTS}}", json.dumps(contents, ensure_ascii=False))
-            
-            # 调用AI处理
-            ai_response = ai.run_llm(file_id=None, llm_model="qwen-plus", prompt=formatted_prompt)
-            default_result["GAI_original"] = ai_response
-            # 处理AI响应
-            # 确保返回的数据包含所需字段
-            result = ai_response.get('data', {})
-            for key in result:
-                default_result[key] = result[key]
+
+LLM_MODEL = "qwen-plus"
+
+def _new_result():
+    return {
+        "status": "success",
+        "message": "",
+        "Pharmacokinetics": {
+            "Absorption": "",
+            "Distribution": "",
+            "Metabolism": "",
+            "Excretion": ""
+        },
+        "Indication": "",
+        "Pharmacodynamics": "",
+        "Mechanism of Action": "",
+        "reference_links": "",
+        "AI_search_results": "",
+        "search_errors": [],
+        "GAI_original": ""
+    }
+
+def _search_prompt(name, keyword):
+    return f'search the drug {name} for {keyword} information'
+
+# 版本指纹：搜索模板、关键词、提示词模板、模型或请求参数变化时，已保存的步骤结果失效
+VERSION = "|".join((
+    PerplexitySearch.fingerprint(_search_prompt("{name}", "{keyword}"), base_info_keywords),
+    AITEP.fingerprint(prompt_template, LLM_MODEL),
+))
+
+def _collect_content(contents, keyword, search_prompt, json_data):
+    # 确保json_data是有效的JSON字符串
+    if not json_data:
+        print(f"Empty search result for {search_prompt}")
+        return
+    data_dict = json.loads(json_data) if isinstance(json_data, str) else json_data
+    # 搜索失败时返回 {"status": "error", "message": ...}，不作为搜索结果交给LLM
+    if isinstance(data_dict, dict) and data_dict.get("status") == "error":
+        raise ValueError(data_dict.get("message") or "search failed")
+    if data_dict:
+        contents.append({"keyword": keyword, "data": data_dict})
+    else:
+        print(f"Empty parsed data for {search_prompt}")
+
+def _build_prompt(name, contents):
+    # 替换提示中的占位符
+    formatted_prompt = prompt_template.replace("{{DRUG_NAME}}", name)
+    return formatted_prompt.replace("{{RESULTS}}", json.dumps(contents, ensure_ascii=False))
+
+def _fill_result(default_result, ai_response):
+    default_result["GAI_original"] = ai_response
+    # 处理AI响应
+    result = ai_response.get('data')
+    if ai_response.get('error') or not isinstance(result, dict) or not result:
+        # LLM调用失败（重试后仍失败）或输出中没有JSON对象，由调用方标记为错误
+        error = ai_response.get('error') or {}
+        raise ValueError("No pharmacokinetics data from LLM ({}): {}".format(
+            error.get("type", "empty_output"), error.get("message", "LLM output contains no JSON object")))
+    # 确保返回的数据包含所需字段
+    for key in result:
+        default_result[key] = result[key]
+
+def get_pharmacokinetics(name,searchmethod="perplexity"):
+    """
+    获取药物的药代动力学和其他基本信息
+    
+    参数:
+        name (str): 药物名称
+        
+    返回:
+        dict: 包含药物信息的字典，或在失败时返回带有错误信息的字典
+    """
+    # 默认返回结果结构
+    default_result = _new_result()
+    
+    try:
+        # 收集所有搜索结果
+        contents = []
+        for keyword in base_info_keywords:
+            try:
+                search_prompt = _search_prompt(name, keyword)
+                   # 执行搜索
+                json_data = perform_search(search_prompt, searchmethod)
+                _collect_content(contents, keyword, search_prompt, json_data)
+            except Exception as e:
+                print(f"Error searching for {keyword}: {str(e)}")
+                default_result["search_errors"].append(f"Error searching for {keyword}: {str(e)}")
+                # 继续处理下一个关键词，而不是整个函数失败
+        default_result["AI_search_results"] = contents
+        # 只有在有搜索结果时才调用AI处理
+        if contents:
+            # 调用AI处理，每次调用使用自己的AITEP实例（并发处理多个药物时互不影响）
+            ai = AITEP()
+            ai_response = ai.run_llm(file_id=None, llm_model=LLM_MODEL, prompt=_build_prompt(name, contents))
+            _fill_result(default_result, ai_response)
+        else:
+            default_result["status"] = "error"
+            default_result["message"] = f"No search results found for {name}"
+    
+    except Exception as e:
+        default_result["status"] = "error"
+        default_result["message"] = f"Error in pharmacokinetics process: {str(e)}"
+    
+    return json.dumps(default_result, ensure_ascii=False)
+
+async def get_pharmacokinetics_async(name,searchmethod="perplexity"):
+    """get_pharmacokinetics的异步版本，各关键词的搜索并发执行"""
+    default_result = _new_result()
+    
+    try:
+        search_prompts = [_search_prompt(name, keyword) for keyword in base_info_keywords]
+        json_datas = await asyncio.gather(
+            *(perform_search_async(search_prompt, searchmethod) for search_prompt in search_prompts),
+            return_exceptions=True
+        )
+        contents = []
+        for keyword, search_prompt, json_data in zip(base_info_keywords, search_prompts, json_datas):
+            try:
+                if isinstance(json_data, Exception):
+                    raise json_data
+                _collect_content(contents, keyword, search_prompt, json_data)
+            except Exception as e:
+                print(f"Error searching for {keyword}: {str(e)}")
+                default_result["search_errors"].append(f"Error searching for {keyword}: {str(e)}")
+        default_result["AI_search_results"] = contents
+        if contents:
+            ai = AITEP()
+            ai_response = await ai.arun_llm(file_id=None, llm_model=LLM_MODEL, prompt=_build_prompt(name, contents))
+            _fill_result(default_result, ai_response)
         else:
             default_result["status"] = "error"
             default_result["message"] = f"No search results found for {name}"
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 测试从仓库根目录导入模块（utils、main_pipe等），模拟后端使用benchmarks/fake_backends.py
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_backends import BackendConfig, FakeBackend, LatencyModel
+
+_backend = None
+
+
+def pytest_configure(config):
+    # 在导入各模块之前启动模拟后端，并通过环境变量把LLM、搜索和PubChem接口指向它，测试不访问外部网络
+    global _backend
+    _backend = FakeBackend(BackendConfig()).start()
+    os.environ.update(_backend.environ())
+
+
+def pytest_unconfigure(config):
+    if _backend is not None:
+        _backend.stop()
+
+
+@pytest.fixture
+def backend():
+    """模拟后端，每个测试开始时各服务无延迟、无错误，测试可修改config"""
+    for service in _backend.config.services.values():
+        service.latency = LatencyModel(0, 0)
+        service.error_rate = 0.0
+    _backend.config.response_format = True
+    return _backend
+
+
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    # 各模块的缓存（搜索缓存、LLM缓存、文件登记）默认写在当前目录，测试在临时目录中运行
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import F3
+import F345
+
+RESPONSE = {"usage": {}, "cache_hit": False, "retries": 0, "error": None}
+
+
+def test_prompt_and_schema_are_numeric_only():
+    assert "No Data" not in F3.prompt
+    assert F3.SCHEMA["properties"]["value"]["enum"] == [1, 5, 10]
+
+
+@pytest.mark.parametrize("value", [1, 5, 10])
+def test_fill_result_accepts_numeric_values(value):
+    result = F3._new_result()
+    F3._fill_result(result, {**RESPONSE, "data": {"value": value, "rationale": "ok"}})
+    assert result["value"] == value
+
+
+@pytest.mark.parametrize("value", ["No Data", None, True, 3])
+def test_fill_result_rejects_non_numeric_values(value):
+    with pytest.raises(ValueError):
+        F3._fill_result(F3._new_result(), {**RESPONSE, "data": {"value": value, "rationale": "unclear"}})
+
+
+def test_fused_split_drops_no_data_f3():
+    response = {**RESPONSE, "data": {
+        "F3": {"value": "No Data", "rationale": "Duration not provided"},
+        "F4": {"reproductive_value": 1, "animal_tox_value": 1, "clinical_value": 1, "F4_value": 1, "Rationale": ""},
+        "F5": {"Effect_Level": "NOAEL", "F5_value": 1, "Rationale": ""},
+    }}
+    results = F345._split_result(response)
+    # F3不符合schema，由调用方单独重新计算
+    assert results["F3"] is None
+    assert json.loads(results["F5"])["value"] == 1
+
+
+def test_F3_value_with_stub_backend(backend):
+    result = json.loads(F3.F3_value("The study is a clinical study with a duration of 2 weeks."))
+    assert result["status"] == "success"
+    assert result["value"] == 5
@@ -0,0 +1,54 @@
+import pytest
+
+import baseinfo
+from utils.llm_utils import AITEP
+
+
+@pytest.fixture(autouse=True)
+def _no_retry(monkeypatch):
+    # LLM失败时不重试，避免退避等待
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+
+
+def empty_result():
+    return {"status": "success", "message": "", "drug_name": "", "CAS Number": "", "Description": "",
+            "ATC Code": "", "AI_search_results": "", "GAI_original": ""}
+
+
+def test_search_fills_missing_values(backend):
+    result = baseinfo._search_chemical_info("Aspirin", "perplexity", empty_result())
+    assert result["status"] == "success"
+    assert result["CAS Number"]
+    assert result["ATC Code"]
+
+
+def test_llm_failure_is_reported_without_filling(backend):
+    backend.config.services["llm"].error_rate = 1.0
+    result = baseinfo._search_chemical_info("Aspirin", "perplexity", empty_result())
+    assert result["status"] == "error"
+    assert "No basic info data from LLM" in result["message"]
+    assert result["CAS Number"] == ""
+    assert result["GAI_original"]["error"]
+
+
+def test_search_failure_skips_llm(backend):
+    backend.config.services["perplexity"].error_rate = 1.0
+    llm_requests = backend.requests["llm"]
+    result = baseinfo._search_chemical_info("Aspirin", "perplexity", empty_result())
+    assert result["status"] == "error"
+    assert backend.requests["llm"] == llm_requests
+
+
+def test_each_call_uses_its_own_aitep_instance(backend, monkeypatch):
+    instances = []
+    original = AITEP.run_llm
+
+    def run_llm(self, *args, **kwargs):
+        instances.append(self)
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(AITEP, "run_llm", run_llm)
+    for name in ("Aspirin", "Ibuprofen"):
+        assert baseinfo._search_chemical_info(name, "perplexity", empty_result())["status"] == "success"
+    assert len(instances) == 2 and instances[0] is not instances[1]
+    assert not hasattr(baseinfo, "ai")
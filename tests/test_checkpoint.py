@@ -0,0 +1,225 @@
+import os
+import threading
+
+import pytest
+
+import hazards
+import pharmacy
+from main_pipe import (DrugInfo, DrugProcessor, HazardInfoProvider, InfoProvider, PharmacyInfoProvider, Pipeline,
+                       PoDCalculator)
+from utils.checkpoint_store import StepCheckpointStore
+from utils.llm_utils import AITEP
+from utils.search_utils import PerplexitySearch
+
+
+class CountingProvider(InfoProvider):
+    """测试用的处理器：记录调用次数，把produce(data)的结果写入provides"""
+
+    def __init__(self, name, requires, provides, produce, version="v1"):
+        self.name = name
+        self.requires = requires
+        self.provides = provides
+        self.produce = produce
+        self.version = version
+        self.calls = 0
+
+    @property
+    def provider_name(self):
+        return self.name
+
+    def process(self, drug_info):
+        self.calls += 1
+        drug_info.data.update(self.produce(drug_info.data))
+        return drug_info
+
+
+def make_pipeline(store, base_result=None, pod_result=None, pod_version="v1"):
+    base = CountingProvider("Base", (), ("APID",), lambda data: {"APID": base_result or "AP-1"})
+    pod = CountingProvider("PoD", ("APID",), ("PoD",),
+                           lambda data: {"PoD": pod_result or {"status": "success", "PoD_value": 1.5}},
+                           version=pod_version)
+    factors = CountingProvider("Factors", ("PoD",), ("factors",),
+                               lambda data: {"factors": [{"name": "F3", "status": "success", "value": 5}]})
+    pipeline = Pipeline(max_workers=2, checkpoint_store=store)
+    for step in (base, pod, factors):
+        pipeline.add_step(step)
+    return pipeline, (base, pod, factors)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StepCheckpointStore(str(tmp_path / "checkpoints"))
+
+
+def test_store_save_and_load(store):
+    store.save("Aspirin", "oral", "PoD", {"PoD": {"PoD_value": 1}, "errors": ["ignored"]}, fingerprint="abc")
+    checkpoint = store.load("Aspirin", "oral", "PoD")
+    assert checkpoint["fingerprint"] == "abc"
+    assert checkpoint["data"] == {"PoD": {"PoD_value": 1}}
+    assert store.load("Aspirin", "iv", "PoD") is None
+    store.clear("Aspirin", "oral")
+    assert store.load("Aspirin", "oral", "PoD") is None
+
+
+def test_store_ignores_corrupt_checkpoint(store):
+    store.save("Aspirin", "oral", "PoD", {"PoD": 1})
+    with open(store._step_file("Aspirin", "oral", "PoD"), "w", encoding="utf-8") as f:
+        f.write('{"data": ')
+    assert store.load("Aspirin", "oral", "PoD") is None
+
+
+def test_store_concurrent_saves(store):
+    def save(i):
+        store.save("Aspirin", "oral", "PoD", {"PoD": i, "payload": "x" * 10000})
+
+    threads = [threading.Thread(target=save, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    checkpoint = store.load("Aspirin", "oral", "PoD")
+    assert checkpoint["data"]["PoD"] in range(16)
+    assert not [name for name in os.listdir(store._drug_dir("Aspirin", "oral"))
+                if name.endswith(".tmp")]
+
+
+@pytest.mark.parametrize("value, failed", [
+    ({"status": "success", "PoD_value": 1.0}, False),
+    ({"status": "error", "PoD_value": 1.0}, True),
+    ({"status": "success", "PoD_value": None}, True),
+    ([{"status": "success", "value": 5}, {"status": "success", "value": None}], True),
+    ([{"status": "success", "value": 5}], False),
+    ("plain value", False),
+])
+def test_has_failed_entry(value, failed):
+    assert Pipeline._has_failed_entry(value) is failed
+
+
+def test_is_successful():
+    step = CountingProvider("PoD", ("APID",), ("PoD",), None)
+    ok = DrugInfo("Aspirin", "oral", {"PoD": {"status": "success", "PoD_value": 1.0}})
+    assert Pipeline._is_successful(step, ok)
+    assert not Pipeline._is_successful(step, DrugInfo("Aspirin", "oral", {"PoD": {}, "errors": ["boom"]}))
+    assert not Pipeline._is_successful(step, DrugInfo("Aspirin", "oral", {}))
+    assert not Pipeline._is_successful(step, DrugInfo("Aspirin", "oral", {"PoD": {"status": "error"}}))
+
+
+def test_pipeline_restores_completed_steps(store):
+    pipeline, steps = make_pipeline(store)
+    first = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert [step.calls for step in steps] == [1, 1, 1]
+
+    pipeline, steps = make_pipeline(store)
+    second = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert [step.calls for step in steps] == [0, 0, 0]
+    assert second.data == first.data
+
+
+def test_pipeline_reruns_failed_step_and_downstream(store):
+    pipeline, steps = make_pipeline(store, pod_result={"status": "error", "PoD_value": None})
+    pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert store.load("Aspirin", "oral", "Base") is not None
+    assert store.load("Aspirin", "oral", "PoD") is None
+
+    pipeline, steps = make_pipeline(store)
+    result = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert [step.calls for step in steps] == [0, 1, 1]
+    assert result.data["PoD"]["PoD_value"] == 1.5
+
+
+def test_pipeline_version_change_invalidates_step_and_downstream(store):
+    pipeline, _ = make_pipeline(store)
+    pipeline.process(DrugInfo("Aspirin", "oral"))
+
+    pipeline, steps = make_pipeline(store, pod_result={"status": "success", "PoD_value": 2.0}, pod_version="v2")
+    result = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert [step.calls for step in steps] == [0, 1, 1]
+    assert result.data["PoD"]["PoD_value"] == 2.0
+    saved = store.load("Aspirin", "oral", "PoD")
+    assert saved["data"]["PoD"] == {"status": "success", "PoD_value": 2.0}
+
+
+def run_step(provider, store):
+    pipeline = Pipeline(checkpoint_store=store).add_step(provider)
+    return pipeline.process(DrugInfo("Aspirin", "Oral"))
+
+
+def test_failed_hazard_searches_are_not_checkpointed(backend, store):
+    backend.config.services["perplexity"].error_rate = 1.0
+    result = run_step(HazardInfoProvider(), store)
+    assert len(result.data["hazard_info"]) == len(hazards.toxicity_types)
+    assert len(result.data["errors"]) == len(hazards.toxicity_types)
+    assert store.load("Aspirin", "Oral", "HazardInfoProvider") is None
+
+    backend.config.services["perplexity"].error_rate = 0.0
+    result = run_step(HazardInfoProvider(), store)
+    assert not result.data.get("errors")
+    assert store.load("Aspirin", "Oral", "HazardInfoProvider") is not None
+
+
+def test_partial_pharmacy_search_failure_is_not_checkpointed(backend, store):
+    result = run_step(PharmacyInfoProvider(), store)
+    assert not result.data.get("errors")
+    store.clear("Aspirin", "Oral")
+
+    # 一个关键词没有缓存且搜索失败，其余关键词使用缓存
+    searcher = PerplexitySearch()
+    query = pharmacy._search_prompt("Aspirin", pharmacy.base_info_keywords[0])
+    os.remove(os.path.join(searcher.cache_path, searcher._generate_cache_key(query)))
+    backend.config.services["perplexity"].error_rate = 1.0
+    result = run_step(PharmacyInfoProvider(), store)
+    assert result.data["pharmacokinetics"]["Indication"]
+    assert len(result.data["errors"]) == 1
+    assert pharmacy.base_info_keywords[0] in result.data["errors"][0]
+    assert store.load("Aspirin", "Oral", "PharmacyInfoProvider") is None
+
+
+def test_upstream_output_change_invalidates_downstream(store):
+    pipeline, _ = make_pipeline(store)
+    pipeline.process(DrugInfo("Aspirin", "oral"))
+    # Base重新执行且输出变化，PoD和Factors的输入指纹随之变化
+    os.remove(store._step_file("Aspirin", "oral", "Base"))
+
+    pipeline, steps = make_pipeline(store, base_result="AP-2")
+    result = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert [step.calls for step in steps] == [1, 1, 1]
+    assert result.data["APID"] == "AP-2"
+    assert store.load("Aspirin", "oral", "PoD")["fingerprint"] == Pipeline._fingerprint(steps[1], {"APID": "AP-2"})
+
+
+def test_checkpoints_are_per_drug_and_route(store):
+    pipeline, _ = make_pipeline(store)
+    pipeline.process(DrugInfo("Aspirin", "oral"))
+    pipeline, steps = make_pipeline(store)
+    pipeline.process(DrugInfo("Aspirin", "iv"))
+    pipeline.process(DrugInfo("Ibuprofen", "oral"))
+    assert [step.calls for step in steps] == [2, 2, 2]
+
+
+def run_processor(store):
+    processor = DrugProcessor(log_errors=False, checkpoint_store=store)
+    events = []
+    processor.event_bus.subscribe("before_*", lambda name, data: events.append(name), with_event_name=True)
+    processor.event_bus.subscribe("restored_*", lambda name, data: events.append(name), with_event_name=True)
+    return processor, events
+
+
+def test_default_pipeline_resumes_and_reruns_changed_step(backend, store, monkeypatch):
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+    processor, events = run_processor(store)
+    first = processor.process_drug("Aspirin", "Oral", "AP-1", 1)
+    assert first["status"] == "success", first["message"]
+    steps = [step.provider_name for step in processor.pipeline.steps]
+    assert sorted(events) == sorted(f"before_{name}" for name in steps)
+
+    processor, events = run_processor(store)
+    second = processor.process_drug("Aspirin", "Oral", "AP-1", 1)
+    assert sorted(events) == sorted(f"restored_{name}" for name in steps)
+    assert second == first
+
+    # PoD的提示词或模型变化：PoD和依赖它的因子步骤重新执行，其余步骤从检查点恢复
+    monkeypatch.setattr(PoDCalculator, "version", "changed")
+    processor, events = run_processor(store)
+    processor.process_drug("Aspirin", "Oral", "AP-1", 1)
+    rerun = sorted(name[len("before_"):] for name in events if name.startswith("before_"))
+    assert rerun == ["AlphaFactorCalculator", "FactorsCalculator", "PoDCalculator"]
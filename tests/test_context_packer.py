@@ -0,0 +1,93 @@
+import F3
+import PoD
+from utils import context_packer, metrics
+from utils.context_packer import (count_tokens, fingerprint_params, pack, pack_detail, pack_sections, parse_sections,
+                                  truncate_tokens)
+
+REPORT = """Intro text
+
+## Adverse Effects
+Nausea and headache.
+<br>
+
+## Clinical Therapeutic Doses
+10 mg once daily.
+
+### Clinical Critical Effects
+Hepatotoxicity at high doses.
+"""
+
+
+def test_parse_sections():
+    sections = parse_sections(REPORT)
+    assert [title for title, _ in sections] == ["", "Adverse Effects", "Clinical Therapeutic Doses",
+                                                "Clinical Critical Effects"]
+    assert sections[1][1] == "## Adverse Effects\nNausea and headache."
+
+
+def test_pack_sections_keeps_wanted_sections_in_original_order():
+    packed, stats = pack_sections(REPORT, ["clinical critical", "Clinical Therapeutic Doses"])
+    assert packed == ("## Clinical Therapeutic Doses\n10 mg once daily.\n\n"
+                      "### Clinical Critical Effects\nHepatotoxicity at high doses.")
+    assert stats["sections"] == ["Clinical Therapeutic Doses", "Clinical Critical Effects"]
+    assert stats["packed_tokens"] == count_tokens(packed)
+    assert stats["saved_tokens"] == stats["original_tokens"] - stats["packed_tokens"]
+
+
+def test_pack_sections_budget_prefers_first_wanted_section():
+    budget = count_tokens("## Clinical Therapeutic Doses\n10 mg once daily.")
+    packed, stats = pack_sections(REPORT, ["Clinical Therapeutic Doses", "Adverse Effects"], budget)
+    assert stats["sections"] == ["Clinical Therapeutic Doses"]
+    assert stats["packed_tokens"] <= budget
+
+
+def test_pack_sections_returns_original_when_nothing_matches():
+    packed, stats = pack_sections(REPORT, ["Box warning"], 10)
+    assert packed == REPORT
+    assert stats["saved_tokens"] == 0 and stats["sections"] == []
+
+
+def test_truncate_tokens():
+    text = "\n".join("line {} with some words".format(i) for i in range(50))
+    assert truncate_tokens(text, count_tokens(text)) == text
+    truncated = truncate_tokens(text, 20)
+    assert truncated.endswith(" ...")
+    assert truncated.startswith("line 0 with some words")
+    assert count_tokens(truncated) <= 20 + count_tokens(" ...")
+
+
+def test_pack_records_saved_tokens():
+    with metrics.collect() as step_metrics:
+        packed = pack(REPORT, "PoD")
+    assert packed == "## Clinical Therapeutic Doses\n10 mg once daily."
+    assert step_metrics["context_tokens_saved"] == count_tokens(REPORT) - count_tokens(packed)
+
+
+def test_pack_disabled_or_non_text(monkeypatch):
+    assert pack({"Clinical": REPORT}, "PoD") == {"Clinical": REPORT}
+    monkeypatch.setattr(context_packer, "ENABLED", False)
+    assert pack(REPORT, "PoD") == REPORT
+    assert pack_detail("word " * 1000) == "word " * 1000
+
+
+def test_pack_detail_truncates_to_hazard_budget():
+    text = "\n".join("Hepatotoxicity finding {} in rats".format(i) for i in range(200))
+    with metrics.collect() as step_metrics:
+        packed = pack_detail(text)
+    assert count_tokens(packed) <= context_packer.HAZARD_DETAIL_BUDGET + count_tokens(" ...")
+    assert step_metrics["context_tokens_saved"] == count_tokens(text) - count_tokens(packed)
+
+
+def test_fingerprint_params_follow_profile(monkeypatch):
+    before = fingerprint_params("F3")
+    monkeypatch.setitem(context_packer.PROFILES, "F3", {**context_packer.PROFILES["F3"], "budget": 100})
+    assert fingerprint_params("F3") != before
+    assert fingerprint_params("F3")["budget"] == 100
+
+
+def test_prompts_contain_only_wanted_sections():
+    pod_prompt = PoD._build_prompt("Aspirin", {"clinical": REPORT, "dosage_detail": {}})
+    assert "10 mg once daily" in pod_prompt
+    assert "Nausea" not in pod_prompt and "Hepatotoxicity" not in pod_prompt
+    f3_prompt = F3._build_prompt(REPORT)
+    assert "Hepatotoxicity" in f3_prompt and "Nausea" not in f3_prompt
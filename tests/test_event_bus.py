@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from main_pipe import AsyncInfoProvider, DrugInfo, EventBus, Pipeline
+
+
+def test_exact_and_wildcard_subscriptions():
+    bus = EventBus()
+    received = []
+    bus.subscribe("after_PoD", lambda data: received.append(("exact", data)))
+    bus.subscribe("after_*", lambda name, data: received.append((name, data)), with_event_name=True)
+    bus.publish("after_PoD", 1)
+    bus.publish("before_PoD", 2)
+    bus.publish("after_Factors", 3)
+    assert received == [("exact", 1), ("after_PoD", 1), ("after_Factors", 3)]
+
+
+def test_subscriber_error_in_background_does_not_stop_later_events(capsys):
+    bus = EventBus()
+    received = []
+
+    def callback(data):
+        if data == "bad":
+            raise ValueError("boom")
+        received.append(data)
+
+    bus.subscribe("event", callback, background=True)
+    for data in ("a", "bad", "b"):
+        bus.publish("event", data)
+    bus.join()
+    assert received == ["a", "b"]
+    assert "boom" in capsys.readouterr().out
+    bus.close()
+
+
+def test_background_subscriber_does_not_block_publisher():
+    bus = EventBus()
+    release = threading.Event()
+    received = []
+
+    def slow(data):
+        release.wait(5)
+        received.append(data)
+
+    bus.subscribe("event", slow, background=True)
+    start = time.perf_counter()
+    for i in range(5):
+        bus.publish("event", i)
+    assert time.perf_counter() - start < 0.5
+    assert received == []
+    release.set()
+    bus.join()
+    assert received == list(range(5))
+    bus.close()
+
+
+def test_drop_policy_discards_events_when_queue_is_full():
+    bus = EventBus()
+    started = threading.Event()
+    release = threading.Event()
+    received = []
+
+    def slow(data):
+        started.set()
+        release.wait(5)
+        received.append(data)
+
+    bus.subscribe("event", slow, background=True, maxsize=2, policy="drop")
+    bus.publish("event", 0)
+    # 等后台线程取出第一个事件，队列中再放2个，其余被丢弃
+    assert started.wait(5)
+    for i in range(1, 6):
+        bus.publish("event", i)
+    subscriber = bus._background[0]
+    assert subscriber.dropped == 3
+    release.set()
+    bus.join()
+    assert received == [0, 1, 2]
+    bus.close()
+
+
+def test_block_policy_waits_for_queue_space():
+    bus = EventBus()
+    release = threading.Event()
+    received = []
+
+    def slow(data):
+        release.wait(5)
+        received.append(data)
+
+    bus.subscribe("event", slow, background=True, maxsize=1, policy="block")
+    published = []
+
+    def publish():
+        for i in range(4):
+            bus.publish("event", i)
+            published.append(i)
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    time.sleep(0.1)
+    # 队列满时发布方阻塞，不丢事件
+    assert len(published) < 4
+    release.set()
+    publisher.join(5)
+    bus.join()
+    assert received == [0, 1, 2, 3]
+    bus.close()
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        EventBus().subscribe("event", print, background=True, policy="ignore")
+
+
+def test_close_processes_pending_events_and_unsubscribes():
+    bus = EventBus()
+    received = []
+    bus.subscribe("event", lambda data: (time.sleep(0.01), received.append(data)), background=True)
+    bus.subscribe("event", lambda data: received.append(("sync", data)))
+    for i in range(3):
+        bus.publish("event", i)
+    bus.close()
+    assert [data for data in received if not isinstance(data, tuple)] == [0, 1, 2]
+    assert bus._background == []
+    assert len(bus.subscribers["event"]) == 1
+    bus.publish("event", 3)
+    assert received[-1] == ("sync", 3)
+
+
+class StepProvider(AsyncInfoProvider):
+    requires = ()
+    provides = ('chemical_info',)
+
+    async def aprocess(self, drug_info):
+        drug_info.data['chemical_info'] = {"name": drug_info.drug_name}
+        return drug_info
+
+
+def test_pipeline_events_reach_wildcard_background_subscribers():
+    pipeline = Pipeline().add_step(StepProvider())
+    events = []
+    pipeline.event_bus.subscribe("*_StepProvider", lambda name, data: events.append(name),
+                                 background=True, with_event_name=True)
+    pipeline.process(DrugInfo("Aspirin", "oral"))
+    pipeline.event_bus.join()
+    assert events == ["before_StepProvider", "after_StepProvider"]
+    pipeline.event_bus.close()
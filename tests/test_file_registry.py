@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils import file_registry
+from utils.file_registry import FileRegistry
+from utils.llm_utils import AITEP
+
+PROMPT = 'Return the value.\n```json\n{"value": 5}\n```'
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return FileRegistry(str(tmp_path / "registry"))
+
+
+def test_upload_entries_expire(registry, monkeypatch):
+    registry.set_upload("abc", "account", "file-1", "/tmp/report.pdf")
+    assert registry.get_upload("abc", "account") == "file-1"
+    assert registry.get_upload("abc", "other") is None
+    assert registry.find_upload("file-1", "account") == {"sha256": "abc", "path": "/tmp/report.pdf"}
+    now = time.time()
+    monkeypatch.setattr(file_registry, "time", SimpleNamespace(time=lambda: now + 120))
+    assert registry.get_upload("abc", "account", ttl=60) is None
+    assert registry.find_upload("file-1", "account") is None
+
+
+def test_download_entry_removed_when_file_is_missing(registry, tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(b"report")
+    registry.set_download("https://example.org/report.pdf", str(path), "abc", etag='"v1"', size=6)
+    assert registry.get_download("https://example.org/report.pdf")["etag"] == '"v1"'
+    assert registry.local_file("abc") == str(path)
+    os.remove(path)
+    assert registry.get_download("https://example.org/report.pdf") is None
+    assert registry.local_file("abc") is None
+
+
+@pytest.fixture
+def llm(backend, monkeypatch):
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+    backend.documents.clear()
+    backend.document_requests.clear()
+    return backend
+
+
+def test_get_file_uses_conditional_get(llm, tmp_path):
+    llm.documents["report.pdf"] = b"version 1"
+    url = f"{llm.url}/docs/report.pdf"
+    ai = AITEP()
+    assert ai.get_file(url, outfile=str(tmp_path / "first.pdf")) == str(tmp_path / "first.pdf")
+    assert ai.get_file(url, outfile=str(tmp_path / "second.pdf")) == str(tmp_path / "second.pdf")
+    assert (tmp_path / "second.pdf").read_bytes() == b"version 1"
+    # 第二次下载带上次的ETag，服务器返回304，使用已保存的文件
+    first, second = llm.document_requests
+    assert first[1] is None and second[1] is not None
+
+    llm.documents["report.pdf"] = b"version 2"
+    ai.get_file(url, outfile=str(tmp_path / "third.pdf"))
+    assert (tmp_path / "third.pdf").read_bytes() == b"version 2"
+
+
+def test_upload_reuses_file_id_for_same_content(llm, tmp_path):
+    for name in ("a.txt", "b.txt"):
+        (tmp_path / name).write_text("Clinical report.", encoding="utf-8")
+    (tmp_path / "c.txt").write_text("Another report.", encoding="utf-8")
+    files_before = len(llm.files)
+    ai = AITEP()
+    file_id = ai.upload_to_openai(str(tmp_path / "a.txt"))
+    assert AITEP().upload_to_openai(str(tmp_path / "b.txt")) == file_id
+    assert AITEP().upload_to_openai(str(tmp_path / "c.txt")) != file_id
+    assert len(llm.files) - files_before == 2
+
+
+def test_upload_again_when_server_no_longer_has_file(llm, tmp_path):
+    path = tmp_path / "report.txt"
+    path.write_text("Clinical report.", encoding="utf-8")
+    file_id = AITEP().upload_to_openai(str(path))
+    del llm.files[file_id]
+    new_file_id = AITEP().upload_to_openai(str(path))
+    assert new_file_id and new_file_id != file_id
+    assert new_file_id in llm.files
+
+
+def upload_then_expire(llm, tmp_path, monkeypatch):
+    path = tmp_path / "report.txt"
+    path.write_text("Clinical report.", encoding="utf-8")
+    file_id = AITEP().upload_to_openai(str(path))
+    # 服务端删除了文件，复用登记的file_id时不向服务端确认
+    del llm.files[file_id]
+    monkeypatch.setattr(AITEP, "verify_file_id", False)
+    return file_id
+
+
+def test_run_llm_reuploads_rejected_file_id(llm, tmp_path, monkeypatch):
+    file_id = upload_then_expire(llm, tmp_path, monkeypatch)
+    ai = AITEP()
+    response = ai.run_llm(file_id=file_id, llm_model="qwen-plus", prompt=PROMPT)
+    assert response["data"] == {"value": 5}
+    new_file_id = ai._replaced_file_ids[file_id]
+    assert new_file_id in llm.files
+    # 之后使用旧file_id的请求直接换成新的file_id
+    files_before = len(llm.files)
+    assert ai.run_llm(file_id=file_id, llm_model="qwen-plus", prompt=PROMPT)["data"] == {"value": 5}
+    assert len(llm.files) == files_before
+
+
+def test_arun_llm_reuploads_rejected_file_id(llm, tmp_path, monkeypatch):
+    file_id = upload_then_expire(llm, tmp_path, monkeypatch)
+    response = asyncio.run(AITEP().arun_llm(file_id=file_id, llm_model="qwen-plus", prompt=PROMPT))
+    assert response["data"] == {"value": 5}
+
+
+def test_rejected_file_id_without_registry_entry_is_reported(llm):
+    response = AITEP().run_llm(file_id="file-unknown", llm_model="qwen-plus", prompt=PROMPT)
+    assert response["data"] == []
+    assert response["error"]["type"] == "client_error"
@@ -0,0 +1,99 @@
+import pytest
+
+from utils.json_extract import FencedJSONDetector, extract_json, repair_json
+from utils.llm_utils import AITEP
+from utils.retry_policy import JSONExtractionError
+
+
+def test_extract_json_prefers_last_fenced_block():
+    text = 'draft:\n```json\n{"a": 1}\n```\nfinal:\n```json\n{"a": 2}\n```\n'
+    assert extract_json(text) == {"a": 2}
+    assert extract_json(text, prefer="first") == {"a": 1}
+
+
+def test_extract_json_keeps_nested_braces_in_strings():
+    text = '```json\n{"text": "a } b { c", "items": [{"x": [1, 2]}]}\n```'
+    assert extract_json(text) == {"text": "a } b { c", "items": [{"x": [1, 2]}]}
+
+
+def test_extract_json_without_fence_ignores_citation_markers():
+    text = 'See [1] and [2].\n{"value": 5}\nDone.'
+    assert extract_json(text) == {"value": 5}
+
+
+def test_extract_json_returns_none_without_json():
+    assert extract_json("") is None
+    assert extract_json("no json here [1]") is None
+
+
+def test_extract_json_recovers_valid_objects_from_broken_array():
+    text = '```json\n[{"a": 1}, {"b": oops}, {"c": 3}]\n```'
+    assert extract_json(text) == [{"a": 1}, {"c": 3}]
+
+
+@pytest.mark.parametrize("fragment, expected", [
+    ('[1, 2,]', [1, 2]),
+    ('{"a": 1,}', {"a": 1}),
+    ('{"a": "x\\*y"}', {"a": "x*y"}),
+    ('{"a": "line1\nline2\tend"}', {"a": "line1\nline2\tend"}),
+    ('{"a": [1, 2], "b": "trunc', {"a": [1, 2]}),
+    ('[{"a": 1}, {"b": 2', [{"a": 1}]),
+    ('{"a": 12', {"a": 12}),
+])
+def test_repair_json(fragment, expected):
+    assert repair_json(fragment) == expected
+
+
+def test_repair_json_raises_when_unrepairable():
+    with pytest.raises(ValueError):
+        repair_json('{"a": tru')
+
+
+def test_fenced_detector_completes_across_chunks():
+    detector = FencedJSONDetector()
+    chunks = ["Here you go:\n``", "`json\n", '{"a": "}\\', '"", "b": [1, ', '{"c": 2}]}', "\n```\nExplanation..."]
+    completed_at = None
+    for i, chunk in enumerate(chunks):
+        if detector.feed(chunk):
+            completed_at = i
+            break
+    assert completed_at == 4
+    assert detector.block().endswith('{"c": 2}]}\n```')
+    assert extract_json(detector.block()) == {"a": '}"', "b": [1, {"c": 2}]}
+
+
+def test_fenced_detector_incomplete_output():
+    detector = FencedJSONDetector()
+    assert not detector.feed('```json\n{"a": [1, 2')
+    assert not detector.complete
+    assert detector.block() == '```json\n{"a": [1, 2'
+
+
+def test_fenced_detector_ignores_non_container_values():
+    detector = FencedJSONDetector()
+    assert not detector.feed('```json\n"just a string"\n```')
+    assert not detector.feed('{"a": 1}')
+
+
+def test_aitep_extract_json_from_llm_output():
+    ai = AITEP(debug=False)
+    ai.quiet = True
+    text = 'Answer [1]:\n```json\n{"items": [{"a": 1,}, {"b": "x\\*y"}],}\n```'
+    assert ai.extract_json_from_llm_output(text) == {"items": [{"a": 1}, {"b": "x*y"}]}
+    assert ai.extract_json_from_llm_output("no json here") == []
+    assert "No JSON found" in ai.msg
+
+
+def test_check_extracted_distinguishes_empty_json_from_missing_json():
+    AITEP._check_extracted('```json\n{}\n```', {})
+    AITEP._check_extracted('```json\n[]\n```', [])
+    with pytest.raises(JSONExtractionError):
+        AITEP._check_extracted("I could not find the data.", [])
+
+
+def test_run_llm_accepts_explicit_empty_json(backend, monkeypatch):
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    # 提示词中没有JSON示例时模拟后端输出空的{}，不算提取失败，不重试
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt="Return nothing.")
+    assert response["data"] == {}
+    assert response["retries"] == 0 and response["error"] is None
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from utils.json_schema import response_format, validate
+from utils.llm_utils import AITEP
+
+SCHEMA = {
+    "type": "object",
+    "required": ["value", "items"],
+    "additionalProperties": False,
+    "properties": {
+        "value": {"enum": [1, 5, 10, "No Data"]},
+        "score": {"type": "number", "minimum": 0, "maximum": 1},
+        "flag": {"type": "boolean"},
+        "items": {"type": "array", "items": {"type": ["string", "null"]}},
+    },
+}
+
+
+def test_valid_data():
+    assert validate({"value": 5, "score": 0.5, "flag": True, "items": ["a", None]}, SCHEMA) == []
+    assert validate({"value": "No Data", "items": []}, SCHEMA) == []
+
+
+def test_type_mismatch_stops_at_path():
+    errors = validate([], SCHEMA)
+    assert len(errors) == 1 and errors[0].startswith("$: expected object")
+
+
+def test_enum_does_not_treat_bool_as_number():
+    assert validate({"value": True, "items": []}, SCHEMA) == [
+        '$.value: true is not one of [1, 5, 10, "No Data"]']
+    assert validate({"value": 2, "items": []}, SCHEMA)
+
+
+def test_integer_and_number_reject_bool():
+    assert validate(True, {"type": "integer"})
+    assert validate(False, {"type": "number"})
+    assert validate(3, {"type": "integer"}) == []
+    assert validate(3.5, {"type": "integer"})
+
+
+def test_required_and_additional_properties():
+    errors = validate({"value": 1, "extra": 0}, SCHEMA)
+    assert "$: missing required property 'items'" in errors
+    assert "$: unexpected property 'extra'" in errors
+
+
+def test_items_and_bounds():
+    errors = validate({"value": 1, "score": 2, "items": ["a", 3]}, SCHEMA)
+    assert "$.score: 2 is greater than 1" in errors
+    assert any(error.startswith("$.items[1]: expected string or null") for error in errors)
+    assert validate({"value": 1, "score": -1, "items": []}, SCHEMA) == ["$.score: -1 is less than 0"]
+
+
+def test_response_format_modes():
+    assert response_format(SCHEMA) == {"type": "json_object"}
+    assert response_format(SCHEMA, mode="json_schema", name="F3") == {
+        "type": "json_schema", "json_schema": {"name": "F3", "schema": SCHEMA}}
+    assert response_format(SCHEMA, mode=None) is None
+
+
+LLM_SCHEMA = {"type": "object", "required": ["value"], "properties": {"value": {"enum": [1, 5, 10]}}}
+
+
+def llm_prompt(value):
+    return 'Return the value.\n```json\n{"value": %d}\n```' % value
+
+
+@pytest.fixture
+def llm(backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(AITEP, "cache_path", str(tmp_path / "llm.sqlite3"))
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+    return backend
+
+
+def test_run_llm_valid_output_needs_no_repair(llm):
+    before = llm.requests["llm"]
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=llm_prompt(5), schema=LLM_SCHEMA)
+    assert response["data"] == {"value": 5}
+    assert "repaired" not in response and "schema_errors" not in response
+    assert llm.requests["llm"] - before == 1
+
+
+def test_run_llm_reports_output_that_repair_cannot_fix(llm):
+    before = llm.requests["llm"]
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=llm_prompt(2), schema=LLM_SCHEMA)
+    # 一次修正请求，修正后仍不符合时保留原来的数据并记录错误
+    assert llm.requests["llm"] - before == 2
+    assert response["repaired"] is True
+    assert response["data"] == {"value": 2}
+    assert response["schema_errors"] == ["$.value: 2 is not one of [1, 5, 10]"]
+    # 不符合schema的结果不写入缓存，下次重新请求
+    again = AITEP().run_llm(llm_model="qwen-plus", prompt=llm_prompt(2), schema=LLM_SCHEMA)
+    assert not again.get("cache_hit")
+    assert llm.requests["llm"] - before == 4
+
+
+def test_arun_llm_repairs_with_schema(llm):
+    response = asyncio.run(AITEP().arun_llm(llm_model="qwen-plus", prompt=llm_prompt(3), schema=LLM_SCHEMA))
+    assert response["repaired"] is True
+    assert response["schema_errors"]
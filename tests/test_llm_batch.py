@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from fake_backends import LatencyModel
+from utils.llm_utils import AITEP, LLMBatchCollector, LLMBatchJob
+
+
+def prompt(value):
+    return 'Return the value.\n```json\n{"value": %d}\n```' % value
+
+
+def body(value):
+    return {"model": "qwen-plus", "messages": [{"role": "user", "content": prompt(value)}]}
+
+
+@pytest.fixture
+def llm(backend, monkeypatch):
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+    return backend
+
+
+def client():
+    ai = AITEP()
+    ai.init_llm()
+    return ai.client
+
+
+def test_batch_job_returns_results_by_custom_id(llm):
+    job = LLMBatchJob(client(), poll_interval=0.05)
+    job.add("a", body(1))
+    job.add("b", body(2))
+    with pytest.raises(ValueError):
+        job.add("a", body(3))
+    results = job.run()
+    assert set(results) == {"a", "b"}
+    assert results["a"]["error"] is None
+    assert '"value": 1' in results["a"]["body"]["choices"][0]["message"]["content"]
+    assert '"value": 2' in results["b"]["body"]["choices"][0]["message"]["content"]
+    assert job.batch.status == "completed"
+
+
+def test_batch_job_reports_failed_requests(llm):
+    llm.config.services["batch"].error_rate = 1.0
+    job = LLMBatchJob(client(), poll_interval=0.05)
+    job.add("a", body(1))
+    results = job.run()
+    assert results["a"]["body"] is None
+    assert results["a"]["error"]
+
+
+def test_batch_job_timeout_cancels_batch(llm):
+    llm.config.services["batch"].latency = LatencyModel(5.0, 0)
+    job = LLMBatchJob(client(), poll_interval=0.05, timeout=0.2)
+    job.add("a", body(1))
+    with pytest.raises(TimeoutError):
+        job.run()
+    assert llm.batches[job.batch.id]["status"] in ("cancelling", "cancelled")
+
+
+def test_run_llm_batch_submits_identical_prompts_once(llm, monkeypatch, tmp_path):
+    monkeypatch.setattr(AITEP, "cache_path", str(tmp_path / "llm.sqlite3"))
+    batches_before = len(llm.batches)
+    requests = {"drug-1": {"prompt": prompt(1)}, "drug-2": {"prompt": prompt(1)}, "drug-3": {"prompt": prompt(3)}}
+    responses = AITEP().run_llm_batch(requests, llm_model="qwen-plus", poll_interval=0.05)
+    assert len(llm.batches) - batches_before == 1
+    batch = list(llm.batches.values())[-1]
+    assert batch["request_counts"]["total"] == 2
+    assert responses["drug-1"]["data"] == responses["drug-2"]["data"] == {"value": 1}
+    assert responses["drug-2"]["coalesced"] is True
+    assert responses["drug-3"]["data"] == {"value": 3}
+
+    # 结果写入缓存，再次提交时不创建新的批处理任务
+    again = AITEP().run_llm_batch(requests, llm_model="qwen-plus", poll_interval=0.05)
+    assert len(llm.batches) - batches_before == 1
+    assert all(response["cache_hit"] for response in again.values())
+
+
+def test_collector_merges_concurrent_requests_into_one_batch(llm, monkeypatch):
+    collector = LLMBatchCollector(window=0.2, poll_interval=0.05)
+    monkeypatch.setattr(AITEP, "batch_collector", collector)
+    batches_before = len(llm.batches)
+    llm_before = llm.requests["llm"]
+
+    async def main():
+        return await asyncio.gather(*(AITEP().arun_llm(llm_model="qwen-plus", prompt=prompt(i), batch=True)
+                                      for i in range(3)))
+
+    responses = asyncio.run(main())
+    assert [response["data"] for response in responses] == [{"value": i} for i in range(3)]
+    assert len(llm.batches) - batches_before == 1
+    assert list(llm.batches.values())[-1]["request_counts"]["total"] == 3
+    # 批处理请求不经过普通的chat.completions接口
+    assert llm.requests["llm"] == llm_before
+
+
+def test_collector_flushes_at_max_size(llm):
+    collector = LLMBatchCollector(window=60, max_size=2, poll_interval=0.05)
+    futures = [collector.submit(client(), body(i)) for i in range(2)]
+    results = [future.result(timeout=5) for future in futures]
+    assert all(result["error"] is None for result in results)
+
+
+def test_batch_false_ignores_collector(llm, monkeypatch):
+    monkeypatch.setattr(AITEP, "batch_collector", LLMBatchCollector(window=60, poll_interval=0.05))
+    batches_before = len(llm.batches)
+    assert AITEP().run_llm(llm_model="qwen-plus", prompt=prompt(7))["data"] == {"value": 7}
+    assert len(llm.batches) == batches_before
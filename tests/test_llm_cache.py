@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import llm_cache
+from utils.llm_cache import LLMResponseCache
+from utils.llm_utils import AITEP
+
+PROMPT = 'Return the value.\n```json\n{"value": 5}\n```'
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # 只替换缓存模块使用的时钟，不影响其他模块的time.time
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+def make_cache(tmp_path, **kwargs):
+    kwargs.setdefault("max_bytes", None)
+    return LLMResponseCache(str(tmp_path / "cache.sqlite3"), **kwargs)
+
+
+def keys(cache):
+    return {key for key, in cache._connect().execute("SELECT key FROM llm_cache")}
+
+
+def test_make_key_ignores_dict_order():
+    assert LLMResponseCache.make_key({"model": "a", "prompt": "b"}) == LLMResponseCache.make_key({"prompt": "b", "model": "a"})
+    assert LLMResponseCache.make_key({"model": "a"}) != LLMResponseCache.make_key({"model": "b"})
+
+
+def test_get_and_set_persist_across_instances(tmp_path, clock):
+    make_cache(tmp_path).set("k", {"data": {"value": 5}})
+    assert make_cache(tmp_path).get("k") == {"data": {"value": 5}}
+    assert make_cache(tmp_path).get("missing") is None
+
+
+def test_ttl_expires_entries(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.set("k", {"data": 1})
+    clock.now += 59
+    assert cache.get("k") == {"data": 1}
+    # 过期时间从写入时算起，读取不会延长
+    clock.now += 2
+    assert cache.get("k") is None
+    assert keys(cache) == set()
+
+
+def test_max_entries_evicts_least_recently_accessed(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    assert cache.get("a") == 1
+    clock.now += 1
+    cache.set("c", 3)
+    assert keys(cache) == {"a", "c"}
+
+
+def test_max_bytes_evicts_until_under_limit(tmp_path, clock):
+    value = "x" * 98
+    size = len('"{}"'.format(value))
+    cache = make_cache(tmp_path, max_bytes=size * 3)
+    for key in "abcd":
+        clock.now += 1
+        cache.set(key, value)
+    assert keys(cache) == {"b", "c", "d"}
+    clock.now += 1
+    cache.set("big", "y" * (size * 2))
+    assert keys(cache) == {"big"}
+
+
+def test_get_cache_shares_instance_and_updates_settings(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    cache = llm_cache.get_cache(path, max_entries=10, ttl=None)
+    assert llm_cache.get_cache(path, max_entries=5, ttl=30) is cache
+    assert cache.max_entries == 5 and cache.ttl == 30
+
+
+@pytest.fixture
+def cached_llm(backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(AITEP, "cache_path", str(tmp_path / "llm.sqlite3"))
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+    return backend
+
+
+def test_run_llm_reads_cache(cached_llm):
+    before = cached_llm.requests["llm"]
+    first = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    second = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    assert cached_llm.requests["llm"] - before == 1
+    assert first["data"] == second["data"] == {"value": 5}
+    assert not first.get("cache_hit") and second["cache_hit"] is True
+
+    refreshed = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT, force_refresh=True)
+    assert cached_llm.requests["llm"] - before == 2
+    assert not refreshed.get("cache_hit")
+
+
+def test_run_llm_does_not_cache_failures(cached_llm):
+    cached_llm.config.services["llm"].error_rate = 1.0
+    assert AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)["data"] == []
+    cached_llm.config.services["llm"].error_rate = 0.0
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    assert response["data"] == {"value": 5} and not response.get("cache_hit")
+
+
+def test_run_llm_cache_ttl(cached_llm, monkeypatch, clock):
+    monkeypatch.setattr(AITEP, "cache_ttl", 60)
+    before = cached_llm.requests["llm"]
+    AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    clock.now += 30
+    assert AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)["cache_hit"] is True
+    clock.now += 31
+    assert not AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT).get("cache_hit")
+    assert cached_llm.requests["llm"] - before == 2
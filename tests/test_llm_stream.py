@@ -0,0 +1,49 @@
+import pytest
+
+from utils.llm_utils import AITEP
+from utils.rate_limiter import estimate_tokens
+
+PROMPT = 'Return the value.\n```json\n{"value": 5}\n```'
+
+
+@pytest.fixture(autouse=True)
+def _settings(monkeypatch):
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    monkeypatch.setattr(AITEP, "stream", True)
+    monkeypatch.setattr(AITEP, "stop_after_json", True)
+    monkeypatch.setattr(AITEP, "_file_tokens", {})
+
+
+@pytest.mark.parametrize("quiet", [True, False])
+def test_stream_stops_after_json_block(backend, monkeypatch, quiet):
+    monkeypatch.setattr(AITEP, "quiet", quiet)
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    assert response["data"] == {"value": 5}
+    assert response["stopped_early"] is True
+    # 携带usage的最后一个chunk没有读取，用估算值代替
+    assert response["usage"]["estimated"] is True
+
+
+def test_stopped_early_usage_includes_attached_file(backend, tmp_path):
+    path = tmp_path / "report.txt"
+    path.write_text("Clinical report. " * 2000, encoding="utf-8")
+    ai = AITEP()
+    file_id = ai.upload_to_openai(str(path))
+    assert file_id
+
+    response = ai.run_llm(file_id=file_id, llm_model="qwen-plus", prompt=PROMPT)
+    assert response["stopped_early"] is True
+    file_tokens = path.stat().st_size // AITEP.file_bytes_per_token
+    messages, _ = ai._build_llm_messages(PROMPT, file_id)
+    assert response["usage"]["prompt_tokens"] == estimate_tokens(messages) + file_tokens
+
+
+def test_file_tokens_learned_from_actual_usage(backend):
+    ai = AITEP()
+    messages, _ = ai._build_llm_messages(PROMPT, "file-abc")
+    # 没有登记的文件不计入
+    assert ai._estimate_prompt_tokens(messages) == estimate_tokens(messages)
+    ai._learn_file_tokens(messages, {"prompt_tokens": estimate_tokens(messages) + 5000, "estimated": True})
+    assert ai._estimate_prompt_tokens(messages) == estimate_tokens(messages)
+    ai._learn_file_tokens(messages, {"prompt_tokens": estimate_tokens(messages) + 5000})
+    assert ai._estimate_prompt_tokens(messages) == estimate_tokens(messages) + 5000
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import pytest
+
+import pharmacy
+from utils.llm_utils import AITEP
+
+
+@pytest.fixture(autouse=True)
+def _no_retry(monkeypatch):
+    # LLM失败时不重试，避免退避等待
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+
+
+def get_pharmacokinetics(name):
+    return json.loads(asyncio.run(pharmacy.get_pharmacokinetics_async(name)))
+
+
+def test_pharmacokinetics_success(backend):
+    result = get_pharmacokinetics("Aspirin")
+    assert result["status"] == "success"
+    assert result["Indication"]
+    assert result["search_errors"] == []
+    assert len(result["AI_search_results"]) == len(pharmacy.base_info_keywords)
+
+
+def test_llm_failure_is_reported(backend):
+    backend.config.services["llm"].error_rate = 1.0
+    result = get_pharmacokinetics("Aspirin")
+    assert result["status"] == "error"
+    assert "No pharmacokinetics data from LLM" in result["message"]
+    assert result["Indication"] == ""
+
+
+def test_search_failure_skips_llm(backend):
+    backend.config.services["perplexity"].error_rate = 1.0
+    llm_requests = backend.requests["llm"]
+    result = get_pharmacokinetics("Aspirin")
+    assert result["status"] == "error"
+    assert result["AI_search_results"] == []
+    assert len(result["search_errors"]) == len(pharmacy.base_info_keywords)
+    assert backend.requests["llm"] == llm_requests
+
+
+def test_sync_version_reports_llm_failure(backend):
+    backend.config.services["llm"].error_rate = 1.0
+    result = json.loads(pharmacy.get_pharmacokinetics("Aspirin"))
+    assert result["status"] == "error"
+    assert "No pharmacokinetics data from LLM" in result["message"]
+
+
+def test_concurrent_calls_use_separate_aitep_instances(backend, monkeypatch):
+    instances = []
+    original = AITEP.arun_llm
+
+    async def arun_llm(self, *args, **kwargs):
+        instances.append(self)
+        return await original(self, *args, **kwargs)
+
+    monkeypatch.setattr(AITEP, "arun_llm", arun_llm)
+
+    async def main():
+        return await asyncio.gather(*(pharmacy.get_pharmacokinetics_async(name) for name in ("Aspirin", "Ibuprofen")))
+
+    results = [json.loads(r) for r in asyncio.run(main())]
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert len(instances) == 2 and instances[0] is not instances[1]
+    assert not hasattr(pharmacy, "ai")
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+from main_pipe import AsyncInfoProvider, DrugInfo, DrugProcessor, InfoProvider, Pipeline
+
+
+class SleepProvider(AsyncInfoProvider):
+    """测试用的异步处理器：等待delay秒后把requires的值拼接写入provides，并记录开始/结束顺序"""
+
+    def __init__(self, name, requires, provides, delay=0.05, log=None, error=None):
+        self.name = name
+        self.requires = requires
+        self.provides = provides
+        self.delay = delay
+        self.log = log if log is not None else []
+        self.error = error
+
+    @property
+    def provider_name(self):
+        return self.name
+
+    async def aprocess(self, drug_info):
+        self.log.append(("start", self.name))
+        await asyncio.sleep(self.delay)
+        self.log.append(("end", self.name))
+        if self.error:
+            raise RuntimeError(self.error)
+        inputs = [str(drug_info.data.get(key)) for key in self.requires or ()]
+        for key in self.provides or ():
+            drug_info.data[key] = "+".join([self.name] + inputs)
+        return drug_info
+
+
+class LegacyProvider(InfoProvider):
+    """未声明requires/provides的同步处理器"""
+
+    def __init__(self, log):
+        self.log = log
+
+    def process(self, drug_info):
+        self.log.append(("start", "Legacy"))
+        self.log.append(("end", "Legacy"))
+        drug_info.data['legacy'] = sorted(k for k in drug_info.data if k != 'errors')
+        return drug_info
+
+
+def make_pipeline(steps, max_workers=4):
+    pipeline = Pipeline(max_workers=max_workers)
+    for step in steps:
+        pipeline.add_step(step)
+    return pipeline
+
+
+def test_build_dependencies_from_declared_keys():
+    log = []
+    pipeline = make_pipeline([
+        SleepProvider("A", (), ("a",)),
+        SleepProvider("B", (), ("b",)),
+        SleepProvider("C", ("a", "b"), ("c",)),
+        SleepProvider("D", ("a",), ("a",)),
+        LegacyProvider(log),
+        SleepProvider("E", (), ("e",)),
+    ])
+    assert pipeline.build_dependencies() == {
+        0: set(),
+        1: set(),
+        2: {0, 1},
+        # 写后写(a)和读后写(C读取a)都要保持原有顺序
+        3: {0, 2},
+        # 未声明的处理器是屏障：依赖之前所有步骤，之后的步骤也都依赖它
+        4: {0, 1, 2, 3},
+        5: {4},
+    }
+
+
+def test_default_pipeline_dependencies():
+    dependencies = DrugProcessor(log_errors=False).pipeline.build_dependencies()
+    # 基础信息、药代、临床、危害四步互相独立；PoD依赖临床，因子依赖临床/危害/PoD，alpha依赖临床和因子
+    assert dependencies == {0: set(), 1: set(), 2: set(), 3: set(), 4: {2}, 5: {2, 3, 4}, 6: {2, 5}}
+
+
+def test_independent_steps_run_concurrently():
+    log = []
+    steps = [SleepProvider(name, (), (name.lower(),), delay=0.1, log=log) for name in "ABC"]
+    steps.append(SleepProvider("D", ("a", "b", "c"), ("d",), delay=0, log=log))
+    start = time.perf_counter()
+    result = make_pipeline(steps).process(DrugInfo("Aspirin", "oral"))
+    elapsed = time.perf_counter() - start
+
+    assert result.data["d"] == "D+A+B+C"
+    assert log[:3] == [("start", "A"), ("start", "B"), ("start", "C")]
+    assert log[-2:] == [("start", "D"), ("end", "D")]
+    assert elapsed < 0.25
+
+
+def test_max_workers_one_runs_in_order():
+    log = []
+    steps = [SleepProvider(name, (), (name.lower(),), delay=0.01, log=log) for name in "ABC"]
+    make_pipeline(steps, max_workers=1).process(DrugInfo("Aspirin", "oral"))
+    assert log == [(event, name) for name in "ABC" for event in ("start", "end")]
+
+
+def test_barrier_step_sees_all_earlier_results():
+    log = []
+    steps = [SleepProvider("A", (), ("a",), log=log), SleepProvider("B", (), ("b",), delay=0.01, log=log),
+             LegacyProvider(log), SleepProvider("E", (), ("e",), log=log)]
+    result = make_pipeline(steps).process(DrugInfo("Aspirin", "oral"))
+    assert result.data["legacy"] == ["a", "b"]
+    assert log.index(("start", "E")) > log.index(("end", "Legacy"))
+
+
+def test_parallel_results_and_errors_are_merged():
+    steps = [SleepProvider("A", (), ("a",), delay=0.05, error="A failed"),
+             SleepProvider("B", (), ("b",), delay=0.01),
+             SleepProvider("C", (), ("c",), delay=0.03, error="C failed"),
+             SleepProvider("D", (), ("d",), delay=0.02)]
+    result = make_pipeline(steps).process(DrugInfo("Aspirin", "oral", {"x": 1}))
+    # 先完成的步骤的结果不会被后完成步骤的旧副本覆盖，失败步骤不写入结果
+    assert result.data["x"] == 1 and result.data["b"] == "B" and result.data["d"] == "D"
+    assert "a" not in result.data and "c" not in result.data
+    assert sorted(result.data["errors"]) == ["Error in pipeline step A: A failed",
+                                             "Error in pipeline step C: C failed"]
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from main_pipe import AsyncInfoProvider, DrugProcessor
+from utils import search_utils
+
+
+class ClientProvider(AsyncInfoProvider):
+    """测试用的处理器：使用当前事件循环共用的httpx客户端，记录客户端和所在线程"""
+    requires = ()
+    provides = ('chemical_info',)
+
+    def __init__(self):
+        self.clients = []
+        self.threads = set()
+
+    async def aprocess(self, drug_info):
+        self.clients.append(search_utils.get_async_client())
+        self.threads.add(threading.get_ident())
+        await asyncio.sleep(0.01)
+        drug_info.data['chemical_info'] = {"name": drug_info.drug_name}
+        return drug_info
+
+
+def make_processor():
+    processor = DrugProcessor(log_errors=False)
+    provider = ClientProvider()
+    processor.pipeline.steps = [provider]
+    return processor, provider
+
+
+ROWS = [(f"Drug-{i}", "Oral", f"AP{i}", i) for i in range(8)]
+
+
+def test_process_batch_reuses_worker_loops_and_closes_clients():
+    processor, provider = make_processor()
+    results = list(processor.process_batch(ROWS, concurrency=3, ordered=True))
+    assert [r["drug_name"] for r in results] == [row[0] for row in ROWS]
+    assert all(r["status"] == "success" for r in results)
+    # 每个工作线程的各行共用一个事件循环和其中的客户端
+    assert len({id(client) for client in provider.clients}) == len(provider.threads) <= 3
+    assert all(client.is_closed for client in provider.clients)
+
+
+def test_process_batch_inside_running_loop():
+    # Jupyter中调用方线程已有运行中的事件循环，结束时关闭客户端不能在该线程中运行其他事件循环
+    processor, provider = make_processor()
+
+    async def main():
+        return list(processor.process_batch(ROWS, concurrency=2))
+
+    results = asyncio.run(main())
+    assert sorted(r["drug_name"] for r in results) == sorted(row[0] for row in ROWS)
+    assert all(client.is_closed for client in provider.clients)
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from utils.llm_utils import AITEP
+from utils.rate_limiter import RateLimiter, TokenBucket, estimate_tokens, retry_after
+
+SCHEMA = {"type": "object", "properties": {"value": {"type": "integer"}}, "required": ["value"]}
+PROMPT = 'Return the value.\n```json\n{"value": 5}\n```'
+
+
+class _Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = _Response(headers)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([{"content": "abcdefgh"}]) == 2 + 4
+    assert estimate_tokens([{"content": "中文"}, {"content": None}]) == (2 + 4) + 4
+
+
+def test_retry_after_headers():
+    assert retry_after(_RateLimitError({"retry-after": "3"})) == 3
+    assert retry_after(_RateLimitError({"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(_RateLimitError({"retry-after": "soon"})) is None
+    assert retry_after(ValueError()) is None
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=10, rate=2)
+    now = bucket.updated
+    assert bucket.reserve(10, now) == 0
+    assert bucket.reserve(4, now) == pytest.approx(2)
+    # 超过容量的请求按容量计算
+    assert bucket.reserve(100, now + 2) == pytest.approx(5)
+    # 退还时不超过容量
+    bucket.adjust(-100, now + 2)
+    assert bucket.tokens == 10
+
+
+def test_rpm_and_tpm_limits():
+    limiter = RateLimiter({"m": {"rpm": 2, "tpm": 600}})
+    assert limiter.reserve("m", 100) == pytest.approx(0, abs=0.01)
+    assert limiter.reserve("m", 100) == pytest.approx(0, abs=0.01)
+    # 每分钟2次请求，第3次需要等约30秒
+    assert limiter.reserve("m", 100) == pytest.approx(30, abs=0.1)
+    limiter = RateLimiter({"m": {"tpm": 600}})
+    assert limiter.reserve("m", 600) == pytest.approx(0, abs=0.01)
+    assert limiter.reserve("m", 60) == pytest.approx(6, abs=0.1)
+    # 未配置的模型不限速
+    assert limiter.reserve("other", 10 ** 9) == 0
+
+
+def test_settle_refunds_unused_tokens():
+    limiter = RateLimiter({"m": {"tpm": 600}})
+    limiter.reserve("m", 600)
+    limiter.settle("m", 600, {"prompt_tokens": 100, "completion_tokens": 50})
+    assert limiter.reserve("m", 450) == pytest.approx(0, abs=0.01)
+
+
+def test_backoff_blocks_all_requests_of_model():
+    limiter = RateLimiter({})
+    limiter.backoff("m", attempt=0, retry_after=5)
+    assert limiter.reserve("m") == pytest.approx(5, abs=0.1)
+    assert limiter.reserve("other") == 0
+    assert 0 <= RateLimiter(backoff_base=1, backoff_cap=2).backoff("m", attempt=5) <= 2
+
+
+class RecordingLimiter(RateLimiter):
+    """记录每次预留和修正的token数"""
+
+    def __init__(self):
+        super().__init__({"qwen-plus": {"rpm": 600, "tpm": 1000000}})
+        self.reserved = []
+        self.settled = []
+
+    def reserve(self, model, tokens=0):
+        self.reserved.append(tokens)
+        return super().reserve(model, tokens)
+
+    def settle(self, model, estimated, usage):
+        self.settled.append((estimated, usage))
+        super().settle(model, estimated, usage)
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RecordingLimiter()
+    monkeypatch.setattr(AITEP, "rate_limiter", limiter)
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    monkeypatch.setattr(AITEP, "_response_format_unsupported", set())
+    return limiter
+
+
+def _net_tokens(limiter):
+    # 预留的token数加上请求结束后的修正，等于计入速率限制的token数
+    estimated, usage = limiter.settled[0]
+    return sum(limiter.reserved) + usage["total_tokens"] - estimated
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_response_format_fallback_charges_tokens_once(backend, limiter, monkeypatch, stream):
+    monkeypatch.setattr(AITEP, "stream", stream)
+    backend.config.response_format = False
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT, schema=SCHEMA)
+    assert response["data"] == {"value": 5}
+    # 被拒绝的请求和重新发送的请求各计一次请求，token只预留一次并修正一次
+    assert len(limiter.reserved) == 2 and limiter.reserved[1] == 0
+    assert len(limiter.settled) == 1
+    assert _net_tokens(limiter) == response["usage"]["total_tokens"]
+    assert "qwen-plus" in AITEP._response_format_unsupported
+
+
+def test_async_response_format_fallback_charges_tokens_once(backend, limiter):
+    backend.config.response_format = False
+    response = asyncio.run(AITEP().arun_llm(llm_model="qwen-plus", prompt=PROMPT, schema=SCHEMA))
+    assert response["data"] == {"value": 5}
+    assert len(limiter.reserved) == 2 and limiter.reserved[1] == 0
+    assert _net_tokens(limiter) == response["usage"]["total_tokens"]
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from main_pipe import AsyncInfoProvider, DrugProcessor
+from utils.result_sink import JsonlResultSink
+
+
+class FlakyProvider(AsyncInfoProvider):
+    """测试用的处理器：记录处理过的药物，failing中的药物记录错误"""
+    requires = ()
+    provides = ('chemical_info',)
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.seen = []
+
+    async def aprocess(self, drug_info):
+        self.seen.append(drug_info.drug_name)
+        if drug_info.drug_name in self.failing:
+            drug_info.data['errors'] = [f"{drug_info.drug_name} failed"]
+        else:
+            drug_info.data['chemical_info'] = {"name": drug_info.drug_name}
+        return drug_info
+
+
+def make_processor(failing=()):
+    processor = DrugProcessor(log_errors=False)
+    provider = FlakyProvider(failing)
+    processor.pipeline.steps = [provider]
+    return processor, provider
+
+
+ROWS = [(f"Drug-{i}", "Oral", f"AP{i}", i) for i in range(6)]
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_scan_skips_partial_lines_and_failed_rows(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(
+        json.dumps({"APID": "AP1", "api_id": 1, "status": "success"}) + "\n"
+        + json.dumps({"APID": "AP2", "api_id": 2, "status": "partial_success"}) + "\n"
+        + '{"APID": "AP3", "api_id": 3, "sta', encoding='utf-8')
+    with JsonlResultSink(str(path)) as sink:
+        # Excel读出的id可能是数字或字符串，按字符串比较
+        assert sink.is_done("AP1", "1")
+        assert not sink.is_done("AP2", 2)
+        assert not sink.is_done("AP3", 3)
+        sink.write({"APID": "AP3", "api_id": 3, "status": "success"})
+        assert sink.is_done("AP3", 3)
+    # 写了一半的行被补上换行，新记录从新的一行开始
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert lines[-1] == json.dumps({"APID": "AP3", "api_id": 3, "status": "success"})
+    assert lines[-2] == '{"APID": "AP3", "api_id": 3, "sta'
+
+
+def test_process_batch_resumes_from_sink(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    processor, provider = make_processor(failing={"Drug-2"})
+    with JsonlResultSink(path) as sink:
+        # 只取前三个结果，模拟中途中断
+        results = processor.process_batch(ROWS, concurrency=1, ordered=True, sink=sink)
+        for _ in range(3):
+            next(results)
+        results.close()
+    assert [r["drug_name"] for r in read_lines(path)] == ["Drug-0", "Drug-1", "Drug-2"]
+
+    processor, provider = make_processor()
+    with JsonlResultSink(path) as sink:
+        results = list(processor.process_batch(ROWS, concurrency=2, ordered=True, sink=sink))
+    # 已成功的行被跳过，失败和未处理的行重新处理
+    assert sorted(provider.seen) == ["Drug-2", "Drug-3", "Drug-4", "Drug-5"]
+    assert [r["drug_name"] for r in results] == ["Drug-2", "Drug-3", "Drug-4", "Drug-5"]
+    latest = {}
+    for result in read_lines(path):
+        latest[result["drug_name"]] = result["status"]
+    assert latest == {row[0]: "success" for row in ROWS}
+
+
+def test_aprocess_batch_skips_completed_rows(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with JsonlResultSink(path) as sink:
+        sink.write({"APID": "AP0", "api_id": 0, "status": "success", "drug_name": "Drug-0"})
+        sink.write({"APID": "AP1", "api_id": 1, "status": "partial_success", "drug_name": "Drug-1"})
+    processor, provider = make_processor()
+
+    async def main():
+        with JsonlResultSink(path) as sink:
+            return [r async for r in processor.aprocess_batch(ROWS[:3], concurrency=2, sink=sink)]
+
+    results = asyncio.run(main())
+    assert sorted(provider.seen) == ["Drug-1", "Drug-2"]
+    assert sorted(r["drug_name"] for r in results) == ["Drug-1", "Drug-2"]
+    assert sorted(r["drug_name"] for r in read_lines(path)[2:]) == ["Drug-1", "Drug-2"]
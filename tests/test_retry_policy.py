@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from utils.llm_utils import AITEP
+from utils.retry_policy import (CLIENT_ERROR, CONNECTION, JSON_EXTRACTION, RATE_LIMIT, SERVER_ERROR, TIMEOUT, UNKNOWN,
+                                JSONExtractionError, RetryPolicy, classify)
+
+PROMPT = 'Return the value.\n```json\n{"value": 5}\n```'
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class APIStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.response = _Response(status_code)
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+class ReadError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error, kind", [
+    (TimeoutError(), TIMEOUT),
+    (asyncio.TimeoutError(), TIMEOUT),
+    (APITimeoutError(), TIMEOUT),
+    (ReadError(), CONNECTION),
+    (ConnectionResetError(), CONNECTION),
+    (APIStatusError(429), RATE_LIMIT),
+    (APIStatusError(503), SERVER_ERROR),
+    (APIStatusError(400), CLIENT_ERROR),
+    (JSONExtractionError(), JSON_EXTRACTION),
+    (ValueError(), UNKNOWN),
+])
+def test_classify(error, kind):
+    assert classify(error) == kind
+
+
+def test_should_retry_limits_by_type():
+    policy = RetryPolicy(max_retries=2)
+    assert policy.should_retry(SERVER_ERROR, 1)
+    assert not policy.should_retry(SERVER_ERROR, 2)
+    # 429默认最多重试5次
+    assert policy.should_retry(RATE_LIMIT, 4)
+    assert not policy.should_retry(RATE_LIMIT, 5)
+    assert not policy.should_retry(CLIENT_ERROR, 0)
+    assert not policy.should_retry(UNKNOWN, 0)
+    assert not RetryPolicy(retry_on=(TIMEOUT,)).should_retry(SERVER_ERROR, 0)
+
+
+def test_delay_is_jittered_exponential_backoff():
+    policy = RetryPolicy(base=1.0, cap=5.0)
+    for attempt, full in [(0, 1.0), (1, 2.0), (2, 4.0), (3, 5.0), (10, 5.0)]:
+        for _ in range(20):
+            assert full / 2 <= policy.delay(attempt) <= full
+
+
+class RecoveringPolicy(RetryPolicy):
+    """测试用的重试策略：不等待，第recover_after次重试前让模拟后端恢复正常"""
+
+    def __init__(self, backend, recover_after=1, **kwargs):
+        super().__init__(**kwargs)
+        self.backend = backend
+        self.recover_after = recover_after
+
+    def delay(self, attempt):
+        if attempt + 1 >= self.recover_after:
+            self.backend.config.services["llm"].error_rate = 0.0
+        return 0
+
+
+@pytest.fixture
+def failing_llm(backend, monkeypatch):
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    # 429由rate_limiter统一暂停，这里只测试重试本身
+    monkeypatch.setattr(AITEP, "rate_limiter", None)
+    backend.config.services["llm"].error_rate = 1.0
+    return backend
+
+
+def test_run_llm_retries_until_backend_recovers(failing_llm, monkeypatch):
+    monkeypatch.setattr(AITEP, "retry_policy", RecoveringPolicy(failing_llm, recover_after=2))
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    assert response["data"] == {"value": 5}
+    assert response["retries"] == 2
+    assert response["error"] is None
+
+
+def test_arun_llm_reports_error_after_retries_exhausted(failing_llm, monkeypatch):
+    monkeypatch.setattr(AITEP, "retry_policy", RecoveringPolicy(failing_llm, recover_after=10, max_retries=2,
+                                                                 max_retries_by_type={}))
+    response = asyncio.run(AITEP().arun_llm(llm_model="qwen-plus", prompt=PROMPT))
+    assert response["data"] == []
+    assert response["retries"] == 2
+    assert response["error"]["type"] in (SERVER_ERROR, RATE_LIMIT)
+
+
+def test_chat_with_llm_retries(failing_llm, monkeypatch):
+    monkeypatch.setattr(AITEP, "retry_policy", RecoveringPolicy(failing_llm, recover_after=1))
+    ai = AITEP()
+    assert ai.chat_with_llm(llm_model="qwen-plus", prompt=PROMPT)
+    assert ai.retries == 1 and ai.last_error is None
+
+
+def test_no_retry_without_policy(failing_llm, monkeypatch):
+    monkeypatch.setattr(AITEP, "retry_policy", None)
+    before = failing_llm.requests["llm"]
+    response = AITEP().run_llm(llm_model="qwen-plus", prompt=PROMPT)
+    assert failing_llm.requests["llm"] - before == 1
+    assert response["retries"] == 0 and response["error"] is not None
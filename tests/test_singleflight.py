@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fake_backends import LatencyModel
+from utils import search_utils
+from utils.llm_utils import AITEP
+from utils.singleflight import SingleFlight
+
+PROMPT = 'Return the value.\n```json\n{"value": 5}\n```'
+
+
+def run_threads(count, target):
+    results = [None] * count
+
+    def run(i):
+        results[i] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_do_runs_once_for_concurrent_callers():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"items": [1]}
+
+    results = run_threads(4, lambda: flight.do("key", fetch))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    # 等待者拿到深拷贝，修改返回值不影响其他调用方
+    values = [value for value, _ in results]
+    values[0]["items"].append(2)
+    assert all(value == {"items": [1]} for value in values[1:])
+    assert flight.in_flight() == 0
+
+
+def test_do_shares_errors_and_releases_key():
+    flight = SingleFlight()
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ValueError as e:
+            return str(e)
+
+    assert run_threads(3, call) == ["boom"] * 3
+    assert flight.do("key", lambda: 1) == (1, False)
+
+
+def test_ado_runs_once_and_waiters_share_result():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [1]
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("key", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [shared for _, shared in results].count(False) == 1
+    assert all(value == [1] for value, _ in results)
+
+
+def test_ado_waiter_retries_when_leader_is_cancelled():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(flight.ado("key", fetch))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flight.ado("key", fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    # 发起请求的任务被取消后，等待者自己重新发起请求
+    assert asyncio.run(main()) == (2, False)
+    assert len(calls) == 2
+
+
+def test_sync_caller_waits_for_async_leader():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    async def fetch():
+        calls.append("async")
+        started.set()
+        await asyncio.sleep(0.1)
+        return "value"
+
+    def sync_call():
+        started.wait(5)
+        return flight.do("key", lambda: calls.append("sync") or "other")
+
+    thread_result = []
+    thread = threading.Thread(target=lambda: thread_result.append(sync_call()))
+    thread.start()
+    assert asyncio.run(flight.ado("key", fetch)) == ("value", False)
+    thread.join()
+    assert thread_result == [("value", True)]
+    assert calls == ["async"]
+
+
+def test_concurrent_identical_llm_requests_are_sent_once(backend, monkeypatch):
+    monkeypatch.setattr(AITEP, "cache_path", None)
+    backend.config.services["llm"].latency = LatencyModel(0.2, 0)
+    before = backend.requests["llm"]
+
+    async def main():
+        return await asyncio.gather(*(AITEP().arun_llm(llm_model="qwen-plus", prompt=PROMPT) for _ in range(3)))
+
+    responses = asyncio.run(main())
+    assert backend.requests["llm"] - before == 1
+    assert all(response["data"] == {"value": 5} for response in responses)
+    assert sorted(bool(response.get("coalesced")) for response in responses) == [False, True, True]
+
+
+def test_concurrent_identical_searches_are_sent_once(backend):
+    backend.config.services["perplexity"].latency = LatencyModel(0.2, 0)
+    before = backend.requests["perplexity"]
+
+    async def main():
+        results = await asyncio.gather(*(search_utils.perform_search_async("aspirin dose", "perplexity")
+                                         for _ in range(3)))
+        await search_utils.aclose_async_clients()
+        return results
+
+    results = asyncio.run(main())
+    assert backend.requests["perplexity"] - before == 1
+    assert results[0] == results[1] == results[2]
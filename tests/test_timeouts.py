@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from fake_backends import LatencyModel
+from main_pipe import AsyncInfoProvider, DrugInfo, HazardInfoProvider, InfoProvider, Pipeline
+from utils import PubChem
+
+
+class SleepProvider(AsyncInfoProvider):
+    """测试用的异步处理器：先写入一半数据，等待delay秒后写入provides"""
+
+    def __init__(self, name, requires, provides, delay):
+        self.name = name
+        self.requires = requires
+        self.provides = provides
+        self.delay = delay
+
+    @property
+    def provider_name(self):
+        return self.name
+
+    async def aprocess(self, drug_info):
+        drug_info.data[f"{self.name}_partial"] = True
+        await asyncio.sleep(self.delay)
+        for key in self.provides:
+            drug_info.data[key] = self.name
+        return drug_info
+
+
+class BlockingProvider(InfoProvider):
+    """同步处理器，阻塞delay秒"""
+    requires = ()
+    provides = ('blocking',)
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def process(self, drug_info):
+        time.sleep(self.delay)
+        drug_info.data['blocking'] = True
+        return drug_info
+
+
+def make_pipeline(steps, **kwargs):
+    pipeline = Pipeline(**kwargs)
+    for step in steps:
+        pipeline.add_step(step)
+    return pipeline
+
+
+def test_step_timeout_discards_partial_data_and_keeps_other_steps():
+    steps = [SleepProvider("Slow", (), ("slow",), 1.0), SleepProvider("Fast", (), ("fast",), 0.01)]
+    pipeline = make_pipeline(steps, step_timeout=0.1)
+    errors = []
+    pipeline.event_bus.subscribe("pipeline_error", errors.append)
+    start = time.perf_counter()
+    result = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert time.perf_counter() - start < 0.5
+    assert result.data["fast"] == "Fast"
+    assert "slow" not in result.data and "Slow_partial" not in result.data
+    assert result.data["errors"] == ["Timeout in pipeline step Slow: exceeded 0.1s"]
+    assert errors == [{"step": "Slow", "error": "timeout after 0.1s"}]
+
+
+def test_step_timeouts_override_default_by_name():
+    steps = [SleepProvider("Slow", (), ("slow",), 0.2), SleepProvider("Fast", (), ("fast",), 0.2)]
+    pipeline = make_pipeline(steps, step_timeout=0.05, step_timeouts={"Slow": 1.0})
+    result = pipeline.process(DrugInfo("Aspirin", "oral"))
+    assert result.data["slow"] == "Slow"
+    assert result.data["errors"] == ["Timeout in pipeline step Fast: exceeded 0.1s"]
+
+
+def test_deadline_skips_steps_that_have_not_started():
+    steps = [SleepProvider("First", (), ("first",), 0.05),
+             SleepProvider("Second", ("first",), ("second",), 1.0),
+             SleepProvider("Third", ("second",), ("third",), 0.01)]
+    start = time.perf_counter()
+    result = make_pipeline(steps, deadline=0.3).process(DrugInfo("Aspirin", "oral"))
+    assert time.perf_counter() - start < 0.8
+    # 完成的步骤保留结果，运行中的步骤在剩余时间内超时，之后的步骤被跳过
+    assert result.data["first"] == "First"
+    assert "second" not in result.data and "third" not in result.data
+    assert result.data["errors"][0].startswith("Timeout in pipeline step Second")
+    assert result.data["errors"][1] == "Skipped pipeline step Third: deadline of 0.3s exceeded"
+
+
+def test_process_deadline_overrides_pipeline_default():
+    steps = [SleepProvider("Slow", (), ("slow",), 0.3)]
+    pipeline = make_pipeline(steps, deadline=0.05)
+    assert pipeline.process(DrugInfo("Aspirin", "oral"), deadline=1.0).data["slow"] == "Slow"
+    assert "slow" not in pipeline.process(DrugInfo("Aspirin", "oral")).data
+
+
+def test_abandoned_sync_step_does_not_delay_return():
+    start = time.perf_counter()
+    result = make_pipeline([BlockingProvider(1.0)], step_timeout=0.1).process(DrugInfo("Aspirin", "oral"))
+    # 被放弃的线程仍在运行，但process不等待它结束
+    assert time.perf_counter() - start < 0.5
+    assert "blocking" not in result.data
+    assert result.data["errors"] == ["Timeout in pipeline step BlockingProvider: exceeded 0.1s"]
+
+
+def test_slow_search_backend_times_out_hazard_step(backend):
+    backend.config.services["perplexity"].latency = LatencyModel(2.0, 0)
+    pipeline = make_pipeline([HazardInfoProvider()], step_timeouts={"HazardInfoProvider": 0.3})
+    start = time.perf_counter()
+    result = pipeline.process(DrugInfo("Aspirin", "Oral"))
+    assert time.perf_counter() - start < 1.5
+    assert "hazard_info" not in result.data
+    assert result.data["errors"] == ["Timeout in pipeline step HazardInfoProvider: exceeded 0.3s"]
+
+
+def test_pubchem_request_timeout(backend, monkeypatch):
+    backend.config.services["pubchem"].latency = LatencyModel(1.0, 0)
+    monkeypatch.setattr(PubChem, "REQUEST_TIMEOUT", 0.2)
+    start = time.perf_counter()
+    assert PubChem.get_cid_by_keyword("Aspirin") is None
+    assert time.perf_counter() - start < 0.8
@@ -1,7 +1,13 @@
+import os
 import requests
 import pandas as pd
 import time
 import json
+
+# 环境变量可覆盖PubChem地址（例如离线压测时指向本地模拟服务）
+PUBCHEM_BASE_URL = os.environ.get("PUBCHEM_BASE_URL", "https://pubchem.ncbi.nlm.nih.gov")
+# 网络超时(秒)
+REQUEST_TIMEOUT = 30
 # API请求函数
 def get_cid_by_keyword(keyword):
     """
@@ -9,12 +15,12 @@ def get_cid_by_keyword(keyword):
     :param keyword: 化学物质的名称或关键词
     :return: 返回CID列表（如果有多个匹配结果），否则返回None
     """
-    base_url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+    base_url = f"{PUBCHEM_BASE_URL}/rest/pug"
     endpoint = f"/compound/name/{keyword}/cids/JSON"
     url = base_url + endpoint
 
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         return data.get("IdentifierList", {}).get("CID", None)
@@ -27,12 +33,12 @@ def get_sid_by_keyword(keyword):
     :param keyword: 化学物质的名称或关键词
     :return: 返回SID列表
     """
-    base_url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+    base_url = f"{PUBCHEM_BASE_URL}/rest/pug"
     endpoint = f"/substance/name/{keyword}/sids/JSON"
     url = base_url + endpoint
 
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         return data.get("IdentifierList", {}).get("SID", None)
@@ -45,12 +51,12 @@ def get_compound_data_by_cid(cid):
     :param cid: 化学物质的CID
     :return: 返回化学物质的详细信息（JSON格式）
     """
-    base_url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound"
+    base_url = f"{PUBCHEM_BASE_URL}/rest/pug_view/data/compound"
     endpoint = f"/{cid}/JSON"
     url = base_url + endpoint
 
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         return data
@@ -63,12 +69,12 @@ def get_substance_data_by_sid(sid):
     :param sid: 物质的SID
     :return: 返回物质的详细信息（JSON格式）
     """
-    base_url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/substance"
+    base_url = f"{PUBCHEM_BASE_URL}/rest/pug_view/data/substance"
     endpoint = f"/{sid}/JSON"
     url = base_url + endpoint
 
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         return data
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+
+class StepCheckpointStore:
+    """按 (drug_name, route, step) 保存每个处理步骤完成后的DrugInfo.data快照"""
+
+    def __init__(self, cache_path='./checkpoint_cached'):
+        """
+        初始化检查点存储
+        :param cache_path: 检查点文件目录
+        """
+        self.cache_path = cache_path
+
+    def _drug_dir(self, drug_name, route):
+        """每个 (drug_name, route) 一个目录"""
+        key = hashlib.md5(f"{drug_name}|{route}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_path, key)
+
+    def _step_file(self, drug_name, route, step):
+        return os.path.join(self._drug_dir(drug_name, route), f"{step}.json")
+
+    def save(self, drug_name, route, step, data, fingerprint=None):
+        """
+        保存步骤完成后的快照，先写临时文件再替换，避免中断时留下不完整的文件
+        :param data: DrugInfo.data
+        :param fingerprint: 步骤版本和输入的指纹，恢复时不一致的快照会被忽略
+        """
+        file = self._step_file(drug_name, route, step)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        checkpoint = {
+            "drug_name": drug_name,
+            "route": route,
+            "step": step,
+            "fingerprint": fingerprint,
+            "saved_at": time.time(),
+            "data": {k: v for k, v in data.items() if k != 'errors'},
+        }
+        # 每次写入使用唯一的临时文件，同一进程中多个线程保存同一个检查点时不会写到同一个文件
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file), prefix=f"{step}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, ensure_ascii=False, default=str)
+            os.replace(tmp_file, file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def load(self, drug_name, route, step):
+        """读取步骤的快照，不存在或已损坏时返回None"""
+        file = self._step_file(drug_name, route, step)
+        if not os.path.exists(file):
+            return None
+        try:
+            with open(file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def clear(self, drug_name, route):
+        """删除该药物的所有检查点"""
+        shutil.rmtree(self._drug_dir(drug_name, route), ignore_errors=True)
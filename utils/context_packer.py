@@ -0,0 +1,138 @@
+import re
+import logging
+try:
+    from utils import metrics
+    from utils.rate_limiter import estimate_tokens
+except ImportError:
+    # 在utils目录内直接运行脚本时
+    import metrics
+    from rate_limiter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 各提示词需要的临床报告章节（按优先级，标题不区分大小写、按前缀匹配）和token预算
+# 预算内优先放入排在前面的章节，放不下的章节按行截断；budget为None时只按章节筛选
+PROFILES = {
+    "PoD": {"sections": ["Clinical Therapeutic Doses"], "budget": 1500},
+    "F3": {"sections": ["Clinical Therapeutic Doses", "Clinical Critical Effects"], "budget": 1500},
+    "F4": {"sections": ["Box warning", "Clinical Critical Effects", "Warning"], "budget": 1200},
+    "F5": {"sections": ["Clinical Therapeutic Doses", "Clinical Critical Effects", "Adverse Effects"], "budget": 1500},
+    "F345": {"sections": ["Clinical Therapeutic Doses", "Box warning", "Clinical Critical Effects", "Warning",
+                          "Adverse Effects"], "budget": 2500},
+}
+# F4中每条危害识别详情(detail_info)的token上限
+HAZARD_DETAIL_BUDGET = 300
+# 设为False时各提示词使用完整的临床报告和危害详情
+ENABLED = True
+
+_HEADING = re.compile(r'^#{2,4}[ \t]+(.+?)[ \t]*#*[ \t]*$', re.MULTILINE)
+_SEPARATOR = re.compile(r'(\s*<br\s*/?>\s*)+$', re.IGNORECASE)
+
+
+def count_tokens(text):
+    """估算文本的token数（与速率限制使用相同的估算方法）"""
+    return estimate_tokens([{'content': text}]) - 4 if text else 0
+
+
+def parse_sections(markdown):
+    """
+    按 ##/###/#### 标题拆分markdown，返回 [(标题, 章节文本)]，章节文本包含标题行
+    第一个标题之前的内容标题为""
+    """
+    sections = []
+    matches = list(_HEADING.finditer(markdown))
+    if not matches or matches[0].start() > 0:
+        end = matches[0].start() if matches else len(markdown)
+        if markdown[:end].strip():
+            sections.append(("", markdown[:end]))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown)
+        # 去掉章节之间的<br>分隔
+        sections.append((match.group(1).strip(), _SEPARATOR.sub("", markdown[match.start():end].rstrip())))
+    return sections
+
+
+def truncate_tokens(text, budget):
+    """按行截断到budget个token以内，放不下的那一行按比例截取字符，返回截断后的文本"""
+    if count_tokens(text) <= budget:
+        return text
+    kept, used = [], 0
+    for line in text.splitlines():
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            kept.append(line[:int(len(line) * (budget - used) / tokens)])
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept).rstrip() + " ..."
+
+
+def _select(sections, wanted):
+    # 按wanted的优先级返回匹配的章节下标
+    selected = []
+    for name in wanted:
+        name = name.lower()
+        for i, (title, _) in enumerate(sections):
+            if i not in selected and title.lower().startswith(name):
+                selected.append(i)
+                break
+    return selected
+
+
+def pack_sections(markdown, wanted, budget=None):
+    """
+    从markdown中只保留wanted中的章节，总量不超过budget个token
+    返回 (压缩后的文本, 统计{"original_tokens", "packed_tokens", "saved_tokens", "sections"})
+    没有识别到任何需要的章节时原样返回，避免丢失格式不规范的报告内容
+    """
+    original_tokens = count_tokens(markdown)
+    sections = parse_sections(markdown)
+    selected = _select(sections, wanted)
+    if not selected:
+        return markdown, {"original_tokens": original_tokens, "packed_tokens": original_tokens,
+                          "saved_tokens": 0, "sections": []}
+    texts, remaining = {}, budget
+    for i in selected:
+        text = sections[i][1]
+        if remaining is not None:
+            if remaining <= 0:
+                break
+            text = truncate_tokens(text, remaining)
+            remaining -= count_tokens(text)
+        texts[i] = text
+    # 按原文顺序输出
+    packed = "\n\n".join(texts[i] for i in sorted(texts))
+    packed_tokens = count_tokens(packed)
+    return packed, {"original_tokens": original_tokens, "packed_tokens": packed_tokens,
+                    "saved_tokens": max(0, original_tokens - packed_tokens),
+                    "sections": [sections[i][0] for i in sorted(texts)]}
+
+
+def fingerprint_params(profile):
+    """参与提示词版本指纹的压缩配置，修改配置后已保存的步骤结果失效"""
+    return {"enabled": ENABLED, "hazard_detail_budget": HAZARD_DETAIL_BUDGET, **PROFILES[profile]}
+
+
+def pack(markdown, profile):
+    """
+    按PROFILES中的配置压缩临床报告，节省的token数计入步骤指标(context_tokens_saved)
+    :param markdown: 临床报告（Clinical步骤的new_generate_content），不是字符串时原样返回
+    :param profile: PROFILES的键，例如 "PoD"、"F4"
+    """
+    if not ENABLED or not isinstance(markdown, str) or not markdown:
+        return markdown
+    config = PROFILES[profile]
+    packed, stats = pack_sections(markdown, config["sections"], config.get("budget"))
+    metrics.record_context_saved(stats["saved_tokens"])
+    logger.debug("context_pack profile=%s original_tokens=%d packed_tokens=%d sections=%s",
+                 profile, stats["original_tokens"], stats["packed_tokens"], stats["sections"])
+    return packed
+
+
+def pack_detail(text, budget=None):
+    """截断单条危害识别详情，节省的token数计入步骤指标"""
+    if not ENABLED or not isinstance(text, str) or not text:
+        return text
+    packed = truncate_tokens(text, HAZARD_DETAIL_BUDGET if budget is None else budget)
+    metrics.record_context_saved(max(0, count_tokens(text) - count_tokens(packed)))
+    return packed
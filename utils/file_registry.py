@@ -0,0 +1,154 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class FileRegistry:
+    """
+    下载文件和已上传file_id的持久化登记，保存在一个目录中：registry.sqlite3 和 files/（按内容sha256保存的下载文件）
+    - downloads: URL -> 本地文件、sha256、ETag/Last-Modified，再次下载时用于条件GET
+    - uploads: (文件sha256, 账号) -> file_id，超过有效期的file_id视为过期
+    """
+
+    def __init__(self, path='./aitep_files'):
+        """
+        初始化登记
+        :param path: 保存目录
+        """
+        self.path = os.path.abspath(path)
+        self.files_dir = os.path.join(self.path, "files")
+        self._local = threading.local()
+        os.makedirs(self.files_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    url TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    size INTEGER NOT NULL,
+                    checked REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    sha256 TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    path TEXT,
+                    uploaded REAL NOT NULL,
+                    PRIMARY KEY (sha256, account)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_file_id ON uploads (file_id)")
+
+    def _connect(self):
+        """每个线程使用自己的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "registry.sqlite3"), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def hash_file(path, chunk_size=1024 * 1024):
+        """分块计算文件的sha256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def blob_path(self, sha256, suffix=""):
+        """按内容保存下载文件的路径"""
+        return os.path.join(self.files_dir, sha256 + suffix)
+
+    def get_download(self, url):
+        """返回URL登记的下载 {"path", "sha256", "etag", "last_modified", "size"}，没有登记或文件已被删除时返回None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT path, sha256, etag, last_modified, size FROM downloads WHERE url = ?",
+                               (url,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                conn.execute("DELETE FROM downloads WHERE url = ?", (url,))
+                return None
+        return dict(zip(("path", "sha256", "etag", "last_modified", "size"), row))
+
+    def set_download(self, url, path, sha256, etag=None, last_modified=None, size=0):
+        """登记URL下载到的文件"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO downloads (url, path, sha256, etag, last_modified, size, checked) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, path, sha256, etag, last_modified, size, time.time()))
+
+    def touch_download(self, url):
+        """服务器确认文件未修改(304)时更新检查时间"""
+        with self._connect() as conn:
+            conn.execute("UPDATE downloads SET checked = ? WHERE url = ?", (time.time(), url))
+
+    def get_upload(self, sha256, account, ttl=None):
+        """
+        返回该内容在账号下登记的file_id，不存在或已过期时返回None（过期的登记同时删除）
+        :param ttl: file_id的有效期(秒)，None 表示不过期
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT file_id, uploaded FROM uploads WHERE sha256 = ? AND account = ?",
+                               (sha256, account)).fetchone()
+            if row is None:
+                return None
+            file_id, uploaded = row
+            if ttl is not None and uploaded + ttl < time.time():
+                conn.execute("DELETE FROM uploads WHERE sha256 = ? AND account = ?", (sha256, account))
+                return None
+        return file_id
+
+    def set_upload(self, sha256, account, file_id, path=None):
+        """登记上传得到的file_id，path为可用于重新上传的本地文件"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (sha256, account, file_id, path, uploaded) VALUES (?, ?, ?, ?, ?)",
+                (sha256, account, file_id, path, time.time()))
+
+    def find_upload(self, file_id, account):
+        """按file_id查找登记 {"sha256", "path"}，不是登记中的file_id时返回None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT sha256, path FROM uploads WHERE file_id = ? AND account = ?",
+                               (file_id, account)).fetchone()
+        return None if row is None else {"sha256": row[0], "path": row[1]}
+
+    def remove_upload(self, file_id):
+        """删除服务端已不再接受的file_id"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,))
+
+    def local_file(self, sha256):
+        """返回内容为sha256的本地文件（下载登记或上传时的路径），都不存在时返回None"""
+        with self._connect() as conn:
+            paths = [row[0] for row in conn.execute("SELECT path FROM downloads WHERE sha256 = ?", (sha256,))]
+            paths += [row[0] for row in conn.execute("SELECT path FROM uploads WHERE sha256 = ?", (sha256,))]
+        for path in paths:
+            if path and os.path.exists(path):
+                return path
+        return None
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path):
+    """按目录返回进程内共享的登记实例"""
+    path = os.path.abspath(path)
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            registry = FileRegistry(path)
+            _registries[path] = registry
+    return registry
@@ -0,0 +1,312 @@
+import re
+import json
+
+FENCE = "```json"
+# JSON字符串中合法的转义字符
+VALID_ESCAPES = set('"\\/bfnrtu')
+_VALUE_START = re.compile(r'[\[{]')
+_SPECIAL = re.compile(r'["\\\[\]{}]')
+
+
+class _ValueScanner:
+    """跟踪JSON值的括号层级和字符串状态，文本可以分段输入"""
+
+    def __init__(self):
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+
+    def scan(self, text, start=0):
+        """从start开始扫描，返回顶层值结束后的位置，值尚未结束时返回None"""
+        stack = self.stack
+        if self.escape:
+            # 上一段以反斜杠结尾，跳过被转义的字符
+            if start >= len(text):
+                return None
+            self.escape = False
+            start += 1
+        skip = start
+        # 只在引号、反斜杠和括号处停下，普通字符由正则跳过
+        for match in _SPECIAL.finditer(text, start):
+            pos = match.start()
+            if pos < skip:
+                continue
+            char = text[pos]
+            if self.in_string:
+                if char == "\\":
+                    if pos + 1 >= len(text):
+                        self.escape = True
+                        return None
+                    skip = pos + 2
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                stack.append(char)
+            elif char in "}]":
+                if stack:
+                    stack.pop()
+                if not stack:
+                    return pos + 1
+        return None
+
+
+def _skip_whitespace(text, pos):
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+class FencedJSONDetector:
+    """
+    增量检测LLM输出中第一个```json代码块里的JSON值是否已经完整
+    用法:
+        detector = FencedJSONDetector()
+        for text in chunks:
+            if detector.feed(text):
+                break                # 顶层的 {} 或 [] 已经闭合，可以提前结束流式输出
+        output = detector.block()    # 截止到JSON值结束的输出，补上结尾的```
+    """
+
+    def __init__(self):
+        self.text = ""
+        # 已扫描到的位置
+        self._pos = 0
+        # JSON值的开始和结束位置
+        self.start = None
+        self.end = None
+        self._fence_found = False
+        self._scanner = _ValueScanner()
+        # 代码块中不是对象或数组时不再检测
+        self._unsupported = False
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def feed(self, text):
+        """追加一段输出，返回JSON值是否已经完整"""
+        if self.complete:
+            return True
+        self.text += text
+        if self._unsupported:
+            return False
+        if self.start is None and not self._find_start():
+            return False
+        self.end = self._scanner.scan(self.text, self._pos)
+        self._pos = len(self.text) if self.end is None else self.end
+        return self.complete
+
+    def _find_start(self):
+        if not self._fence_found:
+            index = self.text.find(FENCE, self._pos)
+            if index < 0:
+                # 代码块标记可能被拆在两个chunk中，下次从末尾几个字符开始找
+                self._pos = max(0, len(self.text) - len(FENCE) + 1)
+                return False
+            self._fence_found = True
+            self._pos = index + len(FENCE)
+        # 跳过空白，第一个字符必须是 { 或 [
+        self._pos = _skip_whitespace(self.text, self._pos)
+        if self._pos >= len(self.text):
+            return False
+        if self.text[self._pos] not in "{[":
+            self._unsupported = True
+            return False
+        self.start = self._pos
+        return True
+
+    def block(self):
+        """JSON值完整时返回截止到JSON值结束的输出（补上结尾的```），否则返回全部输出"""
+        if not self.complete:
+            return self.text
+        return self.text[:self.end] + "\n```"
+
+
+def find_json_blocks(text):
+    """
+    单遍扫描文本，按出现顺序返回其中的JSON片段
+    优先返回```json（或不带语言标记的```）代码块中的 {...}/[...]，扫描时跳过字符串内容，嵌套结构不会被截断；
+    没有代码块时返回正文中的顶层对象和对象数组。没有闭合的片段（输出被截断）延伸到文本末尾
+    """
+    blocks = []
+    pos = 0
+    while True:
+        fence = text.find("```", pos)
+        if fence < 0:
+            break
+        line_end = text.find("\n", fence)
+        if line_end < 0:
+            break
+        language = text[fence + 3:line_end].strip().lower()
+        start = _skip_whitespace(text, line_end + 1)
+        end = None
+        if language in ("", "json") and start < len(text) and text[start] in "{[":
+            end = _ValueScanner().scan(text, start)
+            blocks.append(text[start:] if end is None else text[start:end])
+            if end is None:
+                break
+        close = text.find("```", line_end + 1 if end is None else end)
+        if close < 0:
+            break
+        pos = close + 3
+    if blocks:
+        return blocks
+
+    pos = 0
+    while True:
+        match = _VALUE_START.search(text, pos)
+        if match is None:
+            break
+        start = match.start()
+        # 正文中的 [1] 之类的引用标记不是JSON，只接受对象和对象数组
+        inner = _skip_whitespace(text, start + 1)
+        if text[start] == "[" and (inner >= len(text) or text[inner] != "{"):
+            pos = start + 1
+            continue
+        end = _ValueScanner().scan(text, start)
+        blocks.append(text[start:] if end is None else text[start:end])
+        if end is None:
+            break
+        pos = end
+    return blocks
+
+
+def _drop_trailing_comma(out):
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index]
+
+
+def _close(text, stack):
+    text = text.rstrip()
+    while text.endswith((",", ":")):
+        text = text[:-1].rstrip()
+    return text + "".join(reversed(stack))
+
+
+def repair_json(fragment):
+    """
+    修复LLM输出的JSON中的常见问题后解析，无法修复时抛出ValueError
+    - 尾随逗号: [1, 2,]、{"a": 1,}
+    - 字符串中非法的反斜杠转义（如 \\*）和未转义的换行、制表符
+    - 截断的输出：丢弃最后一个不完整的元素（截断的字符串、数字或键）后闭合数组和对象
+    """
+    out = []
+    stack = []
+    in_string = False
+    # 最后一个完整元素之后的位置：(输出长度, 括号栈)
+    safe = None
+    i, length = 0, len(fragment)
+    while i < length:
+        char = fragment[i]
+        if in_string:
+            if char == "\\":
+                following = fragment[i + 1] if i + 1 < length else ""
+                if following in VALID_ESCAPES and following:
+                    out.append(char + following)
+                    i += 2
+                    continue
+                # 非法的转义，去掉反斜杠
+            elif char == '"':
+                in_string = False
+                out.append(char)
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\r":
+                out.append("\\r")
+            elif char == "\t":
+                out.append("\\t")
+            else:
+                out.append(char)
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                char = stack.pop()
+            out.append(char)
+            safe = (len(out), list(stack))
+            if not stack:
+                break
+        elif char == ",":
+            safe = (len(out), list(stack))
+            out.append(char)
+        else:
+            out.append(char)
+        i += 1
+
+    text = "".join(out)
+    if not in_string and not stack:
+        candidates = [text]
+    else:
+        # 截断的输出优先丢弃最后一个不完整的元素，没有完整元素时补全未闭合的字符串和括号
+        candidates = [_close(text + ('"' if in_string else ""), stack)]
+        if safe is not None:
+            candidates.insert(0, _close(text[:safe[0]], safe[1]))
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    raise ValueError("Unable to repair JSON")
+
+
+def valid_objects(fragment):
+    """数组中部分元素损坏时，返回其中能解析（或修复）的顶层对象"""
+    objects = []
+    pos = _skip_whitespace(fragment, 0)
+    if pos >= len(fragment) or fragment[pos] != "[":
+        return objects
+    pos += 1
+    while True:
+        start = fragment.find("{", pos)
+        if start < 0:
+            break
+        end = _ValueScanner().scan(fragment, start)
+        try:
+            objects.append(_loads(fragment[start:] if end is None else fragment[start:end]))
+        except ValueError:
+            pass
+        if end is None:
+            break
+        pos = end
+    return objects
+
+
+def _loads(fragment):
+    try:
+        return json.loads(fragment)
+    except ValueError:
+        return repair_json(fragment)
+
+
+def extract_json(text, prefer="last"):
+    """
+    从LLM输出中提取JSON
+    :param text: LLM输出
+    :param prefer: 有多个JSON片段时优先使用最后一个("last")还是第一个("first")，优先的片段无法解析时依次尝试其他片段
+    :return: 解析后的数据，没有可用的JSON时返回None
+    """
+    if not text:
+        return None
+    blocks = find_json_blocks(text)
+    if prefer == "last":
+        blocks.reverse()
+    for block in blocks:
+        try:
+            return _loads(block)
+        except ValueError:
+            continue
+    for block in blocks:
+        objects = valid_objects(block)
+        if objects:
+            return objects
+    return None
@@ -0,0 +1,63 @@
+import json
+
+# 支持的JSON Schema关键字：type、enum、properties、required、additionalProperties、items、minimum、maximum
+_TYPES = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _in_enum(value, enum):
+    # True == 1 在Python中成立，布尔值和数字分开比较
+    return any(value == item and isinstance(value, bool) == isinstance(item, bool) for item in enum)
+
+
+def validate(data, schema, path="$"):
+    """
+    按schema校验数据，返回错误列表（每条为 "路径: 原因"），符合时返回空列表
+    只实现提示词输出用到的关键字，不依赖jsonschema库
+    """
+    errors = []
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        if not any(_TYPES[name](data) for name in types):
+            return [f"{path}: expected {' or '.join(types)}, got {json.dumps(data, ensure_ascii=False)[:80]}"]
+    if "enum" in schema and not _in_enum(data, schema["enum"]):
+        errors.append(f"{path}: {json.dumps(data, ensure_ascii=False)[:80]} is not one of {json.dumps(schema['enum'], ensure_ascii=False)}")
+    if _TYPES["number"](data):
+        if "minimum" in schema and data < schema["minimum"]:
+            errors.append(f"{path}: {data} is less than {schema['minimum']}")
+        if "maximum" in schema and data > schema["maximum"]:
+            errors.append(f"{path}: {data} is greater than {schema['maximum']}")
+    if isinstance(data, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: missing required property '{key}'")
+        for key, value in data.items():
+            if key in properties:
+                errors.extend(validate(value, properties[key], f"{path}.{key}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected property '{key}'")
+    if isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def response_format(schema, mode="json_object", name="result"):
+    """
+    OpenAI兼容接口的response_format参数
+    :param mode: "json_schema" 按schema约束输出；"json_object" 只保证输出合法的JSON；None 不设置
+    """
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
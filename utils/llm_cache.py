@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class LLMResponseCache:
+    """
+    LLM响应的持久化缓存，单个SQLite文件，按内容(模型、消息、参数)寻址
+    超过max_entries/max_bytes时按最近访问时间淘汰(LRU)，ttl(秒)为None时不过期
+    """
+
+    def __init__(self, path='./llm_cached.sqlite3', max_entries=None, max_bytes=512 * 1024 * 1024, ttl=None):
+        """
+        初始化缓存
+        :param path: SQLite文件路径
+        :param max_entries: 最多保存的条数，None 表示不限
+        :param max_bytes: 保存内容的总字节数上限，None 表示不限
+        :param ttl: 过期时间(秒)，None 表示不过期
+        """
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed)")
+
+    def _connect(self):
+        """每个线程使用自己的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(request):
+        """由请求内容生成缓存键，request为可JSON序列化的字典"""
+        content = json.dumps(request, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存，不存在或已过期时返回None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and created + self.ttl < now:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        """写入缓存并按需淘汰最久未访问的条目"""
+        now = time.time()
+        text = json.dumps(value, ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, text, len(text.encode('utf-8')), now, now))
+        self._evict()
+
+    def _evict(self):
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        with self._lock, self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            if self.max_entries is not None and count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,))
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if self.max_bytes is not None and total > self.max_bytes:
+                # 从最久未访问的条目开始删除，直到总大小不超过上限
+                excess = total - self.max_bytes
+                removed = 0
+                keys = []
+                for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed"):
+                    keys.append((key,))
+                    removed += size
+                    if removed >= excess:
+                        break
+                conn.executemany("DELETE FROM llm_cache WHERE key = ?", keys)
+
+    def clear(self):
+        """清空缓存"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path, **kwargs):
+    """
+    按文件路径返回进程内共享的缓存实例
+    :param kwargs: max_entries/max_bytes/ttl，实例已存在时用传入的值更新其设置
+    """
+    path = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = LLMResponseCache(path, **kwargs)
+            _caches[path] = cache
+        else:
+            for name, value in kwargs.items():
+                setattr(cache, name, value)
+    return cache
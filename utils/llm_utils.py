@@ -7,15 +7,333 @@ import requests
 import time
 import random
 import string
+import copy
 import shutil
+import hashlib
+import asyncio
+import weakref
+import threading
+import functools
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import urlparse
 from argparse import ArgumentParser
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import configparser
+try:
+    from utils import metrics
+    from utils import llm_cache
+    from utils import file_registry
+    from utils.singleflight import SingleFlight
+    from utils.rate_limiter import RateLimiter, estimate_tokens, retry_after
+    from utils.retry_policy import RetryPolicy, JSONExtractionError, classify, RATE_LIMIT, CLIENT_ERROR
+    from utils.json_extract import FencedJSONDetector, extract_json, valid_objects
+    from utils.json_schema import validate as validate_schema, response_format
+except ImportError:
+    # 在utils目录内直接运行脚本时
+    import metrics
+    import llm_cache
+    import file_registry
+    from singleflight import SingleFlight
+    from rate_limiter import RateLimiter, estimate_tokens, retry_after
+    from retry_policy import RetryPolicy, JSONExtractionError, classify, RATE_LIMIT, CLIENT_ERROR
+    from json_extract import FencedJSONDetector, extract_json, valid_objects
+    from json_schema import validate as validate_schema, response_format
+
+
+logger = logging.getLogger(__name__)
+
+TMP_DIR = "/tmp/aitep"
+_tmp_lock = threading.Lock()
+_tmp_cleaned = False
+
+
+@functools.lru_cache(maxsize=None)
+def _load_config():
+    """读取utils/api.ini，进程内只读一次"""
+    config = configparser.ConfigParser()
+    # 获取当前文件所在目录的路径
+    config.read(os.path.join(os.path.dirname(__file__), 'api.ini'))
+    return config
+
+
+@functools.lru_cache(maxsize=None)
+def _cli_data():
+    """解析命令行的 -d/--data 参数，忽略调用脚本自己的其他参数"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("-d", "--data", dest="data")
+    if "ipykernel" in sys.modules:
+        args, _ = parser.parse_known_args(args=[])  # Avoid parsing notebook arguments
+    else:
+        args, _ = parser.parse_known_args()  # Standard behavior for scripts
+    return args.data
+
+
+def _new_output_dir():
+    """创建本实例的临时目录；上次运行遗留的 /tmp/aitep 在进程内第一次创建时清理"""
+    global _tmp_cleaned
+    with _tmp_lock:
+        if not _tmp_cleaned:
+            if os.path.isdir(TMP_DIR):
+                shutil.rmtree(TMP_DIR, ignore_errors=True)
+            _tmp_cleaned = True
+    output_dir = "{}/{}_{}".format(TMP_DIR, int(time.time() * 1000), AITEP.rand_string())
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+class LLMClientPool:
+    """
+    进程内共享的OpenAI客户端，按 (base_url, api_key, timeout) 复用，同一个连接池在所有模块和线程间共用
+    AsyncOpenAI 的连接绑定事件循环，异步客户端按事件循环分别缓存，事件循环被回收后自动释放
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def get(self, api_key, base_url, timeout=None):
+        key = (base_url, api_key, timeout)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # 重试由 AITEP.retry_policy 负责，关闭SDK自带的重试
+                client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+                self._clients[key] = client
+        return client
+
+    def get_async(self, api_key, base_url, timeout=None):
+        key = (base_url, api_key, timeout)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+                clients[key] = client
+        return client
+
+    async def aclose_loop(self):
+        """关闭当前事件循环中的异步客户端，在事件循环结束前调用；之后的请求会重新创建客户端"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.pop(loop, {})
+        for client in clients.values():
+            await client.close()
+
+
+client_pool = LLMClientPool()
+# 合并并发的相同LLM请求（同一成分在多行中同时处理时只请求一次）
+llm_flight = SingleFlight()
+# 合并对同一个失效file_id的重新上传（并发的多组请求同时被拒绝时只上传一次）
+upload_flight = SingleFlight()
+
+
+class LLMBatchJob:
+    """
+    OpenAI兼容的批处理任务：把多个请求写成JSONL输入文件上传，创建batch后轮询直到结束，按custom_id取回结果
+    用法:
+        job = LLMBatchJob(client)
+        job.add("PoD-1", {"model": "qwen-plus", "messages": [...]})
+        results = job.run()
+    """
+    endpoint = "/v1/chat/completions"
+    FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, client, completion_window="24h", poll_interval=30, timeout=None):
+        """
+        :param client: OpenAI客户端
+        :param completion_window: 批处理的完成时限，由服务端执行
+        :param poll_interval: 轮询间隔(秒)
+        :param timeout: 本地最长等待时间(秒)，超时后取消任务，None 表示一直等待
+        """
+        self.client = client
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.requests = {}
+        self.batch = None
+
+    def add(self, custom_id, body):
+        """添加一个请求，body为chat.completions的请求体（不含stream）"""
+        if custom_id in self.requests:
+            raise ValueError(f"重复的custom_id: {custom_id}")
+        self.requests[custom_id] = body
+
+    def to_jsonl(self):
+        """生成批处理输入文件的内容"""
+        return "\n".join(
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": self.endpoint, "body": body}, ensure_ascii=False)
+            for custom_id, body in self.requests.items()) + "\n"
+
+    def submit(self):
+        """上传输入文件并创建batch，返回batch id"""
+        input_file = self.client.files.create(
+            file=("batch_input.jsonl", self.to_jsonl().encode('utf-8')), purpose="batch")
+        self.batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=self.endpoint, completion_window=self.completion_window)
+        logger.info("Batch submitted: %s (%d requests)", self.batch.id, len(self.requests))
+        return self.batch.id
+
+    def wait(self):
+        """轮询直到batch结束，返回最终的batch对象"""
+        start = time.monotonic()
+        while self.batch.status not in self.FINAL_STATUSES:
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                self.client.batches.cancel(self.batch.id)
+                raise TimeoutError(f"Batch {self.batch.id} not finished in {self.timeout}s (status: {self.batch.status})")
+            time.sleep(self.poll_interval)
+            self.batch = self.client.batches.retrieve(self.batch.id)
+        return self.batch
+
+    def results(self):
+        """
+        读取输出文件和错误文件
+        返回:
+            dict: custom_id -> {"body": chat.completion响应, "error": 错误信息}，失败的请求body为None
+        """
+        results = {}
+        for file_id in (self.batch.output_file_id, self.batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get('response') or {}
+                body = response.get('body')
+                error = item.get('error')
+                if not error and response.get('status_code', 200) != 200:
+                    error = (body or {}).get('error') or f"status code {response.get('status_code')}"
+                results[item['custom_id']] = {"body": None if error else body, "error": error}
+        for custom_id in self.requests:
+            results.setdefault(custom_id, {"body": None, "error": f"Batch {self.batch.status}: no output"})
+        return results
+
+    def run(self):
+        """提交、等待并返回结果"""
+        self.submit()
+        self.wait()
+        return self.results()
+
+
+class LLMBatchCollector:
+    """
+    收集多个药物同时发出的 run_llm/arun_llm(batch=True) 请求，合并为一个批处理任务提交
+    第一个请求到达后等待window秒，或累计max_size个请求时提交，结果返回给各自的调用方
+    设置 AITEP.batch_collector = LLMBatchCollector() 后生效，未设置时batch=True的请求按普通请求发送
+    """
+
+    def __init__(self, window=60, max_size=1000, completion_window="24h", poll_interval=30, timeout=None):
+        self.window = window
+        self.max_size = max_size
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    def submit(self, client, body):
+        """加入一个请求，返回concurrent.futures.Future，结果为 {"body": ..., "error": ...}"""
+        future = Future()
+        # 不同客户端（api_key/base_url）的请求分别提交
+        future.client = client
+        with self._lock:
+            self._pending.append((body, future))
+            if len(self._pending) >= self.max_size:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self):
+        """立即提交已收集的请求"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            threading.Thread(target=self._run, args=(pending,), daemon=True).start()
+
+    def _run(self, pending):
+        groups = {}
+        for body, future in pending:
+            groups.setdefault(id(future.client), []).append((body, future))
+        for entries in groups.values():
+            job = LLMBatchJob(entries[0][1].client, self.completion_window, self.poll_interval, self.timeout)
+            for i, (body, _) in enumerate(entries):
+                job.add(f"request-{i}", body)
+            try:
+                results = job.run()
+            except Exception as e:
+                results = {f"request-{i}": {"body": None, "error": f"Batch error: {str(e)}"} for i in range(len(entries))}
+            for i, (_, future) in enumerate(entries):
+                future.set_result(results[f"request-{i}"])
 
 
 # 返回数据类型为dict
 class AITEP:
+    # 请求参数，修改后会改变各模块的版本指纹
+    max_tokens = 6000
+    enable_search = True
+    # 网络超时(秒)：单次HTTP请求，流式输出时为两次读取之间的最长等待
+    request_timeout = 180
+    # LLM响应缓存文件，设为None关闭缓存
+    cache_path = os.environ.get("AITEP_LLM_CACHE", "./llm_cached.sqlite3")
+    # 缓存容量和过期时间：最多保存的条数、内容总字节数（超出时淘汰最久未访问的条目）、过期时间(秒)，None 表示不限
+    cache_max_entries = None
+    cache_max_bytes = 512 * 1024 * 1024
+    cache_ttl = None
+    # 批处理收集器(LLMBatchCollector)，为None时batch=True的请求也按普通流式请求发送
+    batch_collector = None
+    # 按模型限制每分钟请求数和token数（配额见 utils.rate_limiter.DEFAULT_LIMITS），设为None关闭
+    rate_limiter = RateLimiter()
+    # 安静模式：不逐块输出到终端，直接读取chunk属性并用列表拼接，每次调用只通过logging输出一行摘要
+    # 环境变量 AITEP_QUIET=1 开启，适合大量药物并发的批量运行
+    quiet = os.environ.get("AITEP_QUIET", "") not in ("", "0")
+    # 是否使用流式输出；不需要逐步输出时可设为False（request_timeout 需要覆盖整个生成时间）
+    stream = True
+    # 流式输出中第一个```json代码块的JSON值闭合后立即结束请求，不再等待后面的解释文字
+    stop_after_json = True
+    # 超时、连接错误、5xx、429和JSON提取失败的重试策略（utils.retry_policy），设为None不重试
+    retry_policy = RetryPolicy()
+    # run_llm传入schema时请求的结构化输出：json_schema（按schema约束）、json_object（JSON模式）或None（只靠提示词）
+    # 接口不支持response_format时去掉该参数重新请求，之后同一模型不再发送
+    structured_output = "json_object"
+    _response_format_unsupported = set()
+    # 下载文件和上传file_id的登记目录（utils.file_registry），设为None时每次重新下载和上传
+    # 同一URL再次下载时使用条件GET，相同内容的文件复用未过期的file_id
+    file_registry_path = os.environ.get("AITEP_FILE_REGISTRY", "./aitep_files")
+    # 登记的file_id有效期(秒)，None 表示不过期；verify_file_id为True时复用前先向服务端确认文件仍然存在
+    file_id_ttl = 30 * 24 * 3600
+    verify_file_id = True
+    # 进程内已重新上传的file_id -> 新的file_id，仍使用旧file_id的调用直接换用新的
+    _replaced_file_ids = {}
+    # 请求前估算附件(fileid://)内容的token数：收到过实际用量的file_id按实际值，否则按登记的本地文件大小估算
+    file_bytes_per_token = 4
+    _file_tokens = {}
+    # run_llm_with_multiple_sections(parallel=True)分组时每个section预计的输出token数，内容较长的section可按标题单独设置
+    section_output_tokens = {'default': 1500}
+
+    @classmethod
+    def fingerprint(cls, prompt_template, llm_model, schema=None):
+        """
+        LLM调用的版本指纹，由提示词模板、模型名、输出schema和请求参数决定
+        用于判断已保存的步骤结果是否仍然有效
+        """
+        params = [prompt_template, llm_model, cls.max_tokens, cls.enable_search]
+        if schema is not None:
+            params += [schema, cls.structured_output]
+        content = json.dumps(params, ensure_ascii=False)
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
 
     def __init__(self, api_key=None, base_url=None, debug=True):
         """
@@ -23,14 +341,13 @@ class AITEP:
         :param api_key: OpenAI API Key
         :param base_url: OpenAI Base URL
         :param debug: 是否开启调试模式
+        环境变量 AITEP_API_KEY / AITEP_BASE_URL 可覆盖api.ini和默认地址（例如离线压测时指向本地模拟服务）
         """
         if not api_key:
-            config = configparser.ConfigParser()
-            # 获取当前文件所在目录的路径
-            config_path = os.path.join(os.path.dirname(__file__), 'api.ini')
-            config.read(config_path)
-            # print(f"Config file path: {config_path}")
-            # print(f"Config sections: {config.sections()}")
+            api_key = os.environ.get("AITEP_API_KEY")
+        if not api_key:
+            # api.ini 只在进程内第一次使用时读取
+            config = _load_config()
             try:
                 api_key = config['TongYiQianWen']['ACCESS_TOKEN']
             except KeyError as e:
@@ -39,25 +356,16 @@ class AITEP:
                 raise
         self.api_key = api_key
         if not base_url:
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            base_url=os.environ.get("AITEP_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
         self.base_url = base_url
         self.debug = debug
         self.msg = None
-        epoch_time_ms = int(time.time() * 1000)
-        self.tmp_dir = "/tmp/aitep"
-        if os.path.exists(self.tmp_dir) and os.path.isdir(self.tmp_dir):
-            shutil.rmtree(self.tmp_dir)
-        self.output_dir = "{}/{}".format(self.tmp_dir, epoch_time_ms)
-        os.makedirs(self.output_dir, exist_ok=True)
-        self.max_tokens=6000
-
-        # 读取传过来的参数data
-        parser = ArgumentParser()
-        parser.add_argument("-d", "--data", dest="data")
-        if "ipykernel" in sys.modules:
-            args = parser.parse_args(args=[])  # Avoid parsing notebook arguments
-        else:
-            args = parser.parse_args()  # Standard behavior for scripts
+        self.tmp_dir = TMP_DIR
+        # 临时目录在第一次用到时才创建
+        self._output_dir = None
+
+        # 读取传过来的参数data（命令行只在进程内解析一次）
+        data = _cli_data()
 
         # 默认的命令行输入参数
         self.params = {
@@ -65,20 +373,36 @@ class AITEP:
             "data": {"APID": "A00174", "drug_name": "Gentamicin", "route": "Topical", "id": 4},
         }
     
-        if args and args.data:
-            self.params = json.loads(args.data)
+        if data:
+            self.params = json.loads(data)
 
         self.file_name = "downloaded_file.pdf"
-        self.pdf_file = os.path.join(self.output_dir, self.file_name)  # 本地保存的文件名
-        self.output_file = os.path.join(self.output_dir, f"{os.path.splitext(self.file_name)[0]}.json") # 输出的JSON文件名
         self.file_id=None
 
+    @property
+    def output_dir(self):
+        if self._output_dir is None:
+            self._output_dir = _new_output_dir()
+        return self._output_dir
+
+    @property
+    def pdf_file(self):
+        # 本地保存的文件名
+        return os.path.join(self.output_dir, self.file_name)
+
+    @property
+    def output_file(self):
+        # 输出的JSON文件名
+        return os.path.join(self.output_dir, f"{os.path.splitext(self.file_name)[0]}.json")
+
     def init_llm(self):
-        # 根据模型的名称进行初始化
-        self.client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.base_url)
-       
+        # 使用进程内共享的客户端，复用同一个连接池
+        self.client = client_pool.get(self.api_key, self.base_url, self.request_timeout)
+
+    def init_async_llm(self):
+        # 异步客户端，供arun_llm使用；按事件循环共享，返回客户端，避免共享实例在多个事件循环间互相覆盖
+        self.async_client = client_pool.get_async(self.api_key, self.base_url, self.request_timeout)
+        return self.async_client
 
     def output(self, data={}):
         # 输出结果到Stdout
@@ -102,22 +426,17 @@ class AITEP:
 
     @staticmethod
     def combine_results(r1,r2):
-        d1=r1.get('data')
-        d2=r2.get('data')
-        d=d1+d2
-        u1=r1.get('usage')
-        u2=r2.get('usage')
-        u={
-            'completion_tokens':u1['completion_tokens']+u2['completion_tokens'],
-            'prompt_tokens':u1['prompt_tokens']+u2['prompt_tokens'],
-            'total_tokens':u1['total_tokens']+u2['total_tokens']
-        }
+        # 合并两次提取的结果：data按顺序拼接，usage累加（任意一方请求失败、usage为None时取另一方）
+        d1=r1.get('data') or []
+        d2=r2.get('data') or []
+        d=(d1 if isinstance(d1, list) else [d1])+(d2 if isinstance(d2, list) else [d2])
+        u=AITEP._add_usage(r1.get('usage'),r2.get('usage'))
         return {'data':d,'usage':u}
     
     def post_json(self, url, data={}):
         # POST数据到url
         try:
-            response = requests.post(url, json=data)
+            response = requests.post(url, json=data, timeout=self.request_timeout)
             response.raise_for_status()
             content_type = response.headers.get('Content-Type')
             if "json" in content_type:
@@ -135,7 +454,7 @@ class AITEP:
     def get_json(self, url):
         # GET json格式的数据
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=self.request_timeout)
             response.raise_for_status()
 
             content_type = response.headers.get('Content-Type')
@@ -154,28 +473,41 @@ class AITEP:
             return None
 
     def get_file(self, url, outfile=None, retries=3):
-        # GET下载文件, outfile 设定值将文件保存到这个路径，否则返回文件的binary
+        # GET下载文件, outfile 设定值将文件保存到这个路径，否则保存到pdf_file，返回保存的路径
+        # 以流式分块写入磁盘，不把整个文件读入内存
+        # 设置了file_registry_path时文件按内容保存在登记目录中：同一URL再次下载时带If-None-Match/If-Modified-Since，
+        # 服务器返回304时直接复制已保存的文件
         if (not outfile) and self.pdf_file:
             outfile=self.pdf_file
         if not outfile:
             parsed_url = urlparse(url)
             file_name = os.path.basename(parsed_url.path)
             outfile = "{}/{}".format(self.output_dir, file_name)
+        registry = self._file_registry()
         attempt = 0
         while attempt < retries:
             try:
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-                response = requests.get(url, headers=headers, stream=False)
-                response.raise_for_status()
-                content = response.content
-                if outfile:
-                    with open(outfile, 'wb') as f:
-                        f.write(content)
-                    return outfile
-                else:
-                    return content
-            except requests.exceptions.RequestException as e:
+                known = registry.get_download(url) if registry else None
+                if known:
+                    if known['etag']:
+                        headers['If-None-Match'] = known['etag']
+                    if known['last_modified']:
+                        headers['If-Modified-Since'] = known['last_modified']
+                with requests.get(url, headers=headers, stream=True, timeout=self.request_timeout) as response:
+                    if known and response.status_code == 304:
+                        registry.touch_download(url)
+                        if self.debug:
+                            print(f"File not modified, using downloaded copy: {known['path']}")
+                        path = known['path']
+                    else:
+                        response.raise_for_status()
+                        path = self._save_download(url, response, outfile, registry)
+                if path != outfile:
+                    shutil.copyfile(path, outfile)
+                return outfile
+            except (requests.exceptions.RequestException, OSError) as e:
                 if self.debug:
                     print(f"Error downloading file (attempt {attempt + 1}): {str(e)}")
                 attempt += 1
@@ -188,6 +520,32 @@ class AITEP:
             os.remove(outfile)
         return None
 
+    def _save_download(self, url, response, outfile, registry=None, chunk_size=1024 * 1024):
+        # 分块写入临时文件并计算sha256，完成后移动到目标位置；有登记时保存到登记目录并记录ETag/Last-Modified
+        target = outfile if registry is None else registry.blob_path("download")
+        part = f"{target}.{os.getpid()}.{threading.get_ident()}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(part, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            if registry is None:
+                os.replace(part, outfile)
+                return outfile
+            sha256 = digest.hexdigest()
+            path = registry.blob_path(sha256, os.path.splitext(urlparse(url).path)[1])
+            os.replace(part, path)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        registry.set_download(url, path, sha256, response.headers.get('ETag'),
+                              response.headers.get('Last-Modified'), size)
+        return path
+
     def save_json_to_local(self,json_data,outfile):
         print("Output JSON:\n\n",json.dumps(json_data,indent=4),"\n")
         with open(outfile, 'w') as f:
@@ -198,24 +556,49 @@ class AITEP:
             print("Outfile ({}) not exist".format(outfile))
             return False
 
-    def chat_with_llm(self, llm_model='qwen-long', prompt="你是谁"):
+    def chat_with_llm(self, llm_model='qwen-long', prompt="你是谁", force_refresh=False):
+        # 相同请求的回答从缓存读取，self.cache_hit 标记最近一次调用是否命中缓存
+        # 可重试的错误按 retry_policy 重试，self.retries / self.last_error 为重试次数和最终的错误
+        self.cache_hit = False
+        self._set_retry_info(None, 0)
         try:
             messages = [
                 {'role': 'system', 'content': 'You are a helpful assistant.'},
                 {'role': 'user', 'content': prompt}
             ]
+            cache_key = self._llm_cache_key({"model": llm_model, "messages": messages, "stream": False})
+            cached = self._load_llm_cache(cache_key, force_refresh)
+            if cached is not None:
+                self.cache_hit = True
+                return cached['data']
 
             # Use non-streaming version of chat completion to simplify handling
-            completion = self.client.chat.completions.create(
-                model=llm_model,
-                messages=messages,
-                stream=False
-            )
+            self.init_llm()
+            attempt = 0
+            while True:
+                try:
+                    completion, estimated = self._create_completion(dict(
+                        model=llm_model,
+                        messages=messages,
+                        stream=False
+                    ))
+                    break
+                except Exception as e:
+                    kind, wait = self._retry_delay(llm_model, e, attempt)
+                    if wait is None:
+                        self._set_retry_info(None, attempt, kind, e)
+                        raise
+                    time.sleep(wait)
+                    attempt += 1
+            self._set_retry_info(None, attempt)
             res = completion.model_dump_json()
             res = json.loads(res)
+            self._settle_rate_limit(llm_model, estimated, res.get('usage'))
 
             if res and 'choices' in res:
                 result = res['choices'][0]['message']['content']
+                metrics.record_llm(res.get('usage'))
+                self._save_llm_cache(cache_key, {'data': result, 'usage': res.get('usage')})
                 return result
             else:
                 print(res)
@@ -227,43 +610,18 @@ class AITEP:
         return None
 
     def extract_json_from_llm_output(self, res):
-        # 提取最后输出的json
-        pattern = r'```json(.+?)```'
-        matches = re.findall(pattern, res, re.DOTALL)
-        count=len(matches)
-        data = []
-        if count>0:
-            json_data = matches[-1].strip()
-            #print('json_data',json_data)
-            if self.is_json(json_data):
-                data=json.loads(json_data)
-            else:
-                # 提取数组中前面几个完整的结构{}
-                data=self.extract_valid_sections(json_data)
-        else:
+        # 提取最后输出的json，单遍扫描并修复尾随逗号、非法转义和截断的数组，无法修复时保留数组中完整的结构{}
+        data = extract_json(res, prefer="last")
+        if data is None:
             self.msg = "\nNo JSON found in LLM_output\n"
-            print(self.msg)
+            if not self.quiet:
+                print(self.msg)
+            data = []
         return data
 
     def extract_valid_sections(self,output):
-        newOutput=[]
-        pattern=r'({.+?})'
-        match=re.findall(pattern,output,re.DOTALL)
-        #print('extract_valid_sections',match,output)
-        for row in match:
-            try:
-                row1=self.format_json(row)
-                if not self.is_json(row1):
-                    if r'\*' in row1:
-                        row1=row1.replace(r'\*','*')
-                row2=json.loads(row1)
-                newOutput.append(row2)
-                #print(json.dumps(row2,indent=4))
-            except json.JSONDecodeError:
-                self.msg = "JSON parse error: " + row
-                print("\n\n")
-                print(self.msg)
-        return newOutput
+        # 提取数组中能解析的结构{}
+        return valid_objects(output)
 
     def is_json(self,myjson):
         try:
@@ -271,54 +629,103 @@ class AITEP:
         except ValueError:
             return False
         return True
-    
-    def format_json(self,s):
-        rows=s.splitlines()
-        newS=''
-        pattern1=r'.+"$|.+",$'
-        pattern2=r'"references":.+]$'
-        for row in rows:
-            line=row.strip()
-            # 替换错误的反转义
-            #line=line.replace(r'\*','*')
-            match1=re.search(pattern1,line)
-            match2=re.search(pattern2,line)
-            if line=='{' or line=='}' or match1 or match2:
-                newS+=line
-            else:
-                newS+=line
-        return newS
 
-    def run_llm_with_multiple_sections(self, file_id=None, prompt=None,section_titles=[]):
+    def run_llm_with_multiple_sections(self, file_id=None, prompt=None,section_titles=[],parallel=False,group_tokens=None):
         # 按固定格式提取PDF文档中的多个sections, 当completion_tokens超过6000时，自动将sections拆分，重新提取没有完成的sections
         # prompt 中必须包含 {{SECTIONTITLES}}
         # section_titles 为要提取的section的数组，每个元素是一个要提取的section标题
         # 为了防止陷入无限循环，section_titles会最多被拆分为3次
+        # parallel=True 时先按输出token预算把section_titles分组（见group_section_titles），各组并发请求同一个file_id，
+        # 结果按原顺序用combine_results合并，总耗时约为一次请求；某一组输出仍不完整时只对该组重新提取
         """
         Extract sections from the uploaded PDF using OpenAI
         """
 
         if file_id is None and self.file_id:
             file_id=self.file_id
-         
+
+        groups=self.group_section_titles(section_titles, group_tokens) if parallel else [section_titles]
+        if len(groups)<=1:
+            return self._run_sections(file_id, prompt, section_titles)
+
+        message="Extracting {} sections in {} parallel groups".format(len(section_titles),len(groups))
+        if self.quiet:
+            logger.info(message)
+        else:
+            print(message)
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            results=list(executor.map(lambda titles: self._run_sections(file_id, prompt, titles), groups))
+        return functools.reduce(self.combine_results, results)
+
+    async def arun_llm_with_multiple_sections(self, file_id=None, prompt=None,section_titles=[],parallel=False,group_tokens=None):
+        # run_llm_with_multiple_sections 的异步版本，各组在同一个事件循环中并发请求
+        if file_id is None and self.file_id:
+            file_id=self.file_id
+
+        groups=self.group_section_titles(section_titles, group_tokens) if parallel else [section_titles]
+        results=await asyncio.gather(*(self._arun_sections(file_id, prompt, titles) for titles in groups))
+        return functools.reduce(self.combine_results, results)
+
+    def group_section_titles(self, section_titles, group_tokens=None):
+        # 按顺序把section_titles分组，每组预计的输出token数不超过group_tokens（默认max_tokens），保证一次请求能输出完整
+        # 每个section预计的输出token数取section_output_tokens中该标题的值，没有时取section_output_tokens['default']
+        budget=group_tokens or self.max_tokens
+        groups=[]
+        group,used=[],0
+        for title in section_titles:
+            tokens=self.section_output_tokens.get(title, self.section_output_tokens['default'])
+            if group and used+tokens>budget:
+                groups.append(group)
+                group,used=[],0
+            group.append(title)
+            used+=tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    def _section_prompt(self, prompt, section_titles):
         newPrompt=prompt.replace('{{SECTIONTITLES}}',"\n".join(section_titles))
+        if not self.quiet:
+            print("\n\n======newPrompt======\n{}".format(newPrompt))
+        return newPrompt
 
-        print("\n\n======newPrompt======\n{}".format(newPrompt))
-        
-        r = self.run_llm(file_id, llm_model="qwen-long", prompt=newPrompt)
+    def _log_incomplete_sections(self, data_len, section_len, runTimes):
+        message="Only {}/{} sections been extracted successfully after RUN {}".format(data_len,section_len,runTimes)
+        if self.quiet:
+            logger.info(message)
+        else:
+            print(message)
+
+    def _run_sections(self, file_id, prompt, section_titles):
+        # 一次请求提取section_titles，输出不完整时重新提取没有完成的sections，最多3次
+        r = self.run_llm(file_id, llm_model="qwen-long", prompt=self._section_prompt(prompt, section_titles))
         section_len=len(section_titles)
 
-        #print(r)
+        runTimes=1
+        while runTimes<4:
+            data_len=len(r.get('data') or [])
+            if data_len<section_len:
+                self._log_incomplete_sections(data_len,section_len,runTimes)
+                subsection_titles=section_titles[data_len:]
+                r1 = self.run_llm(file_id, llm_model="qwen-long", prompt=self._section_prompt(prompt, subsection_titles))
+                r=self.combine_results(r,r1)
+                runTimes+=1
+            else:
+                break
+        return r
+
+    async def _arun_sections(self, file_id, prompt, section_titles):
+        # _run_sections 的异步版本
+        r = await self.arun_llm(file_id, llm_model="qwen-long", prompt=self._section_prompt(prompt, section_titles))
+        section_len=len(section_titles)
 
         runTimes=1
         while runTimes<4:
-            data_len=len(r.get('data'))
+            data_len=len(r.get('data') or [])
             if data_len<section_len:
-                print("Only {}/{} sections been extracted successfully after RUN {}".format(data_len,section_len,runTimes))
+                self._log_incomplete_sections(data_len,section_len,runTimes)
                 subsection_titles=section_titles[data_len:]
-                newPrompt=prompt.replace('{{SECTIONTITLES}}',"\n".join(subsection_titles))
-                print("\n\n======newPrompt======\n{}".format(newPrompt))
-                r1 = self.run_llm(file_id, llm_model="qwen-long", prompt=newPrompt)
+                r1 = await self.arun_llm(file_id, llm_model="qwen-long", prompt=self._section_prompt(prompt, subsection_titles))
                 r=self.combine_results(r,r1)
                 runTimes+=1
             else:
@@ -330,104 +737,688 @@ class AITEP:
         random_string = ''.join(random.choices(string.ascii_uppercase, k=5))
         return random_string
         
-    def run_llm(self, file_id=None, llm_model='qwen-long', prompt=None,keywords=[]):
+    def _build_llm_messages(self, prompt, file_id=None, keywords=[]):
+        # 替换敏感词，返回messages和 关键词->随机串 的映射
+        mapping={}
+        for keyword in keywords:
+            rstring=self.rand_string()
+            mapping[keyword]=rstring
+            prompt = re.sub(keyword, rstring, prompt, flags=re.IGNORECASE)
+
+        messages = [
+            {'role': 'system', 'content': 'You are an expert at extracting structured information from PDE reports.'}
+        ]
+        if file_id:
+            messages.append({'role': 'system', 'content': f'fileid://{file_id}'})
+        messages.append({'role': 'user', 'content': prompt})
+        return messages, mapping
+
+    def _llm_request_kwargs(self, llm_model, messages, schema=None):
+        kwargs = dict(
+            model=llm_model,
+            extra_body={"enable_search": self.enable_search},  # 控制是否启用互联网搜索
+            messages=messages,
+            stream=self.stream,
+            max_tokens=self.max_tokens,
+        )
+        if self.stream:
+            kwargs['stream_options'] = {"include_usage": True}
+        if schema is not None and llm_model not in self._response_format_unsupported:
+            fmt = response_format(schema, self.structured_output)
+            if fmt is not None:
+                kwargs['response_format'] = fmt
+        return kwargs
+
+    @staticmethod
+    def _handle_llm_chunk(res, state, llm_model):
+        # 处理一个流式chunk，state保存request_id/result/reasoning_content/usage，返回新增的正文
+        if state['request_id'] is None:
+            state['request_id']=res['id']
+            print("request id: {}\n\n==================LLM model ({}) Output Start==================\n".format(state['request_id'],llm_model))
+        choices = res['choices']
+        if len(choices) > 0:
+            output=""
+            if choices[0].get('finish_reason'):
+                state['finish_reason']=choices[0]['finish_reason']
+            # print(choices[0])
+            if choices[0].get('delta').get('reasoning_content'):
+                output=choices[0]['delta']['reasoning_content']
+                if output:
+                    state['reasoning_content'] += output
+            else:
+                output=choices[0]['delta']['content']
+                if output:
+                    state['result'] += output
+                    print(output, end="")
+                    return output
+            if output:
+                print(output, end="")
+        else:
+            state['usage'] = res['usage']
+        return None
+
+    @staticmethod
+    def _read_llm_chunk(chunk, state, parts, reasoning):
+        # 安静模式下处理一个流式chunk：直接读取属性，文本追加到列表中，结束后再拼接；返回新增的正文
+        if state['request_id'] is None:
+            state['request_id'] = chunk.id
+        if getattr(chunk, 'usage', None) is not None:
+            state['usage'] = chunk.usage.model_dump()
+        if chunk.choices:
+            if getattr(chunk.choices[0], 'finish_reason', None):
+                state['finish_reason'] = chunk.choices[0].finish_reason
+            delta = chunk.choices[0].delta
+            text = getattr(delta, 'reasoning_content', None)
+            if text:
+                reasoning.append(text)
+            elif delta.content:
+                parts.append(delta.content)
+                return delta.content
+        return None
+
+    @staticmethod
+    def _read_llm_completion(completion, state):
+        # 非流式请求的响应
+        message = completion.choices[0].message
+        state['request_id'] = completion.id
+        state['finish_reason'] = getattr(completion.choices[0], 'finish_reason', None)
+        state['result'] = message.content or ""
+        state['reasoning_content'] = getattr(message, 'reasoning_content', None) or ""
+        state['usage'] = completion.usage.model_dump() if completion.usage is not None else None
+
+    @staticmethod
+    def _log_llm_call(state, llm_model, start):
+        # 每次请求结束后输出一行摘要
+        usage = state['usage'] or {}
+        logger.info("llm_call model=%s request_id=%s elapsed=%.2fs prompt_tokens=%s completion_tokens=%s chars=%d",
+                    llm_model, state['request_id'], time.perf_counter() - start,
+                    usage.get('prompt_tokens'), usage.get('completion_tokens'), len(state['result']))
+
+    def _finish_llm(self, state, llm_model, mapping, keywords=[]):
+        if self.debug and not self.quiet:
+            print("\n\n==================LLM model ({}) Output End==================".format(llm_model))
+            print("\n==================Token Usage of ({})==================".format(llm_model))
+            print(state['usage'])
+            print("")
+
+        # 替换回敏感词
+        result=state['result']
+        for keyword in keywords:
+            rstring=mapping.get(keyword)
+            result=result.replace(rstring,keyword)
+            result=re.sub(rstring,keyword, result, flags=re.IGNORECASE)
+        state['result']=result
+        return self.extract_json_from_llm_output(result)
+
+    @staticmethod
+    def _message_file_ids(messages):
+        return [m['content'][len('fileid://'):] for m in messages
+                if isinstance(m.get('content'), str) and m['content'].startswith('fileid://')]
+
+    def _file_token_estimate(self, file_id):
+        # 附件内容的token数，没有实际用量时按登记的本地文件大小估算，找不到文件时为0
+        if file_id in self._file_tokens:
+            return self._file_tokens[file_id]
+        registry = self._file_registry()
+        known = registry.find_upload(file_id, self._account()) if registry is not None else None
+        if known and known.get('path') and os.path.exists(known['path']):
+            return os.path.getsize(known['path']) // self.file_bytes_per_token
+        return 0
+
+    def _estimate_prompt_tokens(self, messages):
+        # prompt的预估token数：消息文本加上附件内容
+        return estimate_tokens(messages) + sum(self._file_token_estimate(f) for f in self._message_file_ids(messages))
+
+    def _learn_file_tokens(self, messages, usage):
+        # 只有一个附件时，用接口返回的prompt_tokens减去消息文本的估算值作为该附件的token数
+        file_ids = self._message_file_ids(messages)
+        if len(file_ids) != 1 or not usage or usage.get('estimated') or not usage.get('prompt_tokens'):
+            return
+        self._file_tokens[file_ids[0]] = max(0, usage['prompt_tokens'] - estimate_tokens(messages))
+
+    def _create_completion(self, request):
+        # 按速率限制发送请求，返回 (completion, 预估的token数)
+        model, estimated = request['model'], self._estimate_prompt_tokens(request['messages'])
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(model, estimated)
+        try:
+            return self.client.chat.completions.create(**request), estimated
+        except Exception as e:
+            if not self._drop_response_format(request, e):
+                raise
+        # 去掉response_format重新发送也是一次请求，同样经过速率限制；被拒绝的请求没有生成内容，
+        # token沿用第一次的预留，请求结束后只按实际用量修正一次
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(model)
+        return self.client.chat.completions.create(**request), estimated
+
+    async def _acreate_completion(self, client, request):
+        # _create_completion 的异步版本
+        model, estimated = request['model'], self._estimate_prompt_tokens(request['messages'])
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(model, estimated)
+        try:
+            return await client.chat.completions.create(**request), estimated
+        except Exception as e:
+            if not self._drop_response_format(request, e):
+                raise
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(model)
+        return await client.chat.completions.create(**request), estimated
+
+    def _drop_response_format(self, request, error):
+        # 模型不支持response_format（返回4xx）时从请求中去掉，之后该模型只靠提示词和本地校验
+        if 'response_format' not in request or classify(error) != CLIENT_ERROR:
+            return False
+        self._response_format_unsupported.add(request['model'])
+        del request['response_format']
+        message = f"response_format not accepted by {request['model']}, falling back to prompt-only JSON: {str(error)}"
+        if self.quiet:
+            logger.warning(message)
+        else:
+            print(message)
+        return True
+
+    def _retry_delay(self, model, error, attempt):
+        # 按错误类型判断是否重试，返回 (错误类型, 重试前需要等待的秒数)，不重试时等待秒数为None
+        # 429时该模型的所有请求一起暂停（Retry-After或带抖动的指数退避），由下次请求前的rate_limiter等待
+        kind = classify(error)
+        if self.retry_policy is None or not self.retry_policy.should_retry(kind, attempt):
+            return kind, None
+        if kind == RATE_LIMIT and self.rate_limiter is not None:
+            delay = self.rate_limiter.backoff(model, attempt, retry_after(error))
+            wait = 0
+        else:
+            delay = wait = self.retry_policy.delay(attempt)
+        message = f"LLM error ({kind}, {model}), retry {attempt + 1} in {delay:.1f}s: {str(error)}"
+        if self.quiet:
+            logger.warning(message)
+        else:
+            print(message)
+        return kind, wait
+
+    def _set_retry_info(self, response, retries, kind=None, error=None):
+        # 把重试次数和最终的错误（类型和信息）写入返回值和实例属性
+        self.retries = retries
+        self.last_error = None if error is None else {'type': kind, 'message': str(error)}
+        if response is not None:
+            response['retries'] = retries
+            response['error'] = self.last_error
+        return response
+
+    @staticmethod
+    def _check_extracted(result, data):
+        # 没有提取到JSON时抛出JSONExtractionError，由重试策略决定是否重试；模型明确输出空的[]或{}不算失败
+        if data:
+            return
+        if extract_json(result) is not None:
+            return
+        raise JSONExtractionError("No valid JSON found in LLM output")
+
+    def _stream_llm(self, state, llm_model, messages, mapping, keywords, schema=None):
+        # 发送一次请求并提取JSON，失败时抛出异常
+        request = self._llm_request_kwargs(llm_model, messages, schema)
+        start = time.perf_counter()
+        completion, estimated = self._create_completion(request)
+        if not request['stream']:
+            self._read_llm_completion(completion, state)
+        else:
+            detector = FencedJSONDetector() if self.stop_after_json else None
+            parts, reasoning = [], []
+            for chunk in completion:
+                if self.quiet:
+                    text = self._read_llm_chunk(chunk, state, parts, reasoning)
+                else:
+                    state['last_chunk'] = json.loads(chunk.model_dump_json())
+                    text = self._handle_llm_chunk(state['last_chunk'], state, llm_model)
+                if text and detector is not None and detector.feed(text):
+                    completion.close()
+                    break
+            if self.quiet:
+                state['result'], state['reasoning_content'] = "".join(parts), "".join(reasoning)
+            self._stopped_early(state, detector, estimated)
+        self._learn_file_tokens(messages, state['usage'])
+        return self._complete_llm(state, llm_model, estimated, mapping, keywords, start)
+
+    async def _astream_llm(self, client, state, llm_model, messages, mapping, keywords, schema=None):
+        # _stream_llm 的异步版本
+        request = self._llm_request_kwargs(llm_model, messages, schema)
+        start = time.perf_counter()
+        completion, estimated = await self._acreate_completion(client, request)
+        if not request['stream']:
+            self._read_llm_completion(completion, state)
+        else:
+            detector = FencedJSONDetector() if self.stop_after_json else None
+            parts, reasoning = [], []
+            async for chunk in completion:
+                if self.quiet:
+                    text = self._read_llm_chunk(chunk, state, parts, reasoning)
+                else:
+                    state['last_chunk'] = json.loads(chunk.model_dump_json())
+                    text = self._handle_llm_chunk(state['last_chunk'], state, llm_model)
+                if text and detector is not None and detector.feed(text):
+                    await completion.close()
+                    break
+            if self.quiet:
+                state['result'], state['reasoning_content'] = "".join(parts), "".join(reasoning)
+            self._stopped_early(state, detector, estimated)
+        self._learn_file_tokens(messages, state['usage'])
+        return self._complete_llm(state, llm_model, estimated, mapping, keywords, start)
+
+    @staticmethod
+    def _stopped_early(state, detector, estimated):
+        # JSON值完整后提前结束了流式输出：只保留到JSON结束的输出；最后一个携带usage的chunk没有收到，用估算值代替
+        # estimated为请求前的prompt估算值，包含附件内容（见_estimate_prompt_tokens）
+        if detector is None or not detector.complete:
+            return
+        state['result'] = detector.block()
+        state['stopped_early'] = True
+        if state['usage'] is None:
+            completion_tokens = estimate_tokens([{'content': state['result']}])
+            state['usage'] = {'prompt_tokens': estimated, 'completion_tokens': completion_tokens,
+                              'total_tokens': estimated + completion_tokens, 'estimated': True}
+
+    def _complete_llm(self, state, llm_model, estimated, mapping, keywords, start):
+        # 请求结束：修正速率限制、输出摘要、替换回敏感词并提取JSON
+        self._settle_rate_limit(llm_model, estimated, state['usage'])
+        self._log_llm_call(state, llm_model, start)
+        data = self._finish_llm(state, llm_model, mapping, keywords)
+        self._check_extracted(state['result'], data)
+        return data
+
+    def _llm_failed(self, state, error):
+        # 记录一次失败的请求
+        self.msg = f"Extract error: {str(error)}"
+        if self.quiet:
+            logger.warning("llm_error request_id=%s %s", state['request_id'], self.msg)
+        elif self.debug:
+            print(self.msg)
+            print(state['result'])
+            print(state.get('last_chunk'))
+
+    def _settle_rate_limit(self, model, estimated, usage):
+        # 用实际的token用量修正速率限制的预留
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(model, estimated, usage)
+
+    @staticmethod
+    def _schema_repair_messages(messages, mapping, keywords, data, errors, schema):
+        # 修正请求：原来的对话 + 上次提取到的JSON + 不符合schema的位置，只要求改正这些位置
+        output = json.dumps(data, ensure_ascii=False, indent=4)
+        for keyword in keywords:
+            output = re.sub(keyword, mapping[keyword], output, flags=re.IGNORECASE)
+        instruction = ("The JSON you returned does not match the required schema:\n"
+                       + "\n".join(f"- {error}" for error in errors)
+                       + "\n\nFix only these problems and return the corrected JSON in a ```json code block, "
+                       + "matching this JSON schema:\n```json\n" + json.dumps(schema, ensure_ascii=False) + "\n```")
+        return messages + [
+            {'role': 'assistant', 'content': "```json\n" + output + "\n```"},
+            {'role': 'user', 'content': instruction},
+        ]
+
+    @staticmethod
+    def _add_usage(u1, u2):
+        # 合并两次请求的用量，任意一方为None时返回另一方
+        if not u1 or not u2:
+            return u1 or u2
+        usage = {key: (u1.get(key) or 0) + (u2.get(key) or 0)
+                 for key in ('prompt_tokens', 'completion_tokens', 'total_tokens')}
+        if u1.get('estimated') or u2.get('estimated'):
+            usage['estimated'] = True
+        return usage
+
+    def _schema_errors(self, response, schema):
+        # 需要校验时返回不符合schema的位置；没有schema或请求已经失败时返回空列表
+        if schema is None or response.get('error') is not None:
+            return []
+        return validate_schema(response['data'], schema)
+
+    def _apply_schema_repair(self, response, state, data, errors, schema):
+        # 用修正请求的结果更新返回值：用量累加，错误更少时采用修正后的数据，剩余的错误记录在schema_errors中
+        metrics.record_llm(state['usage'])
+        response['usage'] = self._add_usage(response['usage'], state['usage'])
+        response['repaired'] = True
+        if data is not None:
+            remaining = validate_schema(data, schema)
+            if len(remaining) < len(errors):
+                response['data'], errors = data, remaining
+        if errors:
+            response['schema_errors'] = errors
+            self.msg = f"LLM output does not match schema: {errors}"
+            if self.quiet:
+                logger.warning(self.msg)
+            elif self.debug:
+                print(self.msg)
+        return response
+
+    def _check_schema(self, response, schema, llm_model, messages, mapping, keywords):
+        # 按schema校验提取到的数据，不符合时发送一次修正请求
+        errors = self._schema_errors(response, schema)
+        if not errors:
+            return response
+        repair = self._schema_repair_messages(messages, mapping, keywords, response['data'], errors, schema)
+        state = {'request_id': None, 'result': "", 'reasoning_content': "", 'usage': None}
+        try:
+            data = self._stream_llm(state, llm_model, repair, mapping, keywords, schema)
+        except Exception as e:
+            self._llm_failed(state, e)
+            data = None
+        return self._apply_schema_repair(response, state, data, errors, schema)
+
+    async def _acheck_schema(self, client, response, schema, llm_model, messages, mapping, keywords):
+        # _check_schema 的异步版本
+        errors = self._schema_errors(response, schema)
+        if not errors:
+            return response
+        repair = self._schema_repair_messages(messages, mapping, keywords, response['data'], errors, schema)
+        state = {'request_id': None, 'result': "", 'reasoning_content': "", 'usage': None}
+        try:
+            data = await self._astream_llm(client, state, llm_model, repair, mapping, keywords, schema)
+        except Exception as e:
+            self._llm_failed(state, e)
+            data = None
+        return self._apply_schema_repair(response, state, data, errors, schema)
+
+    def _batch_body(self, llm_model, messages, schema=None):
+        # 批处理输入文件中的请求体：非流式，extra_body中的参数直接放在请求体中
+        kwargs = self._llm_request_kwargs(llm_model, messages, schema)
+        body = {"model": llm_model, "messages": messages, "max_tokens": kwargs["max_tokens"], **kwargs["extra_body"]}
+        if 'response_format' in kwargs:
+            body['response_format'] = kwargs['response_format']
+        return body
+
+    def _batch_response(self, result, llm_model, mapping, keywords=[]):
+        # 批处理的一条输出，转换为与run_llm相同格式的返回值（批处理的请求不重试）
+        state = {'request_id': None, 'result': "", 'reasoning_content': "", 'usage': None}
+        if result['error']:
+            self.msg = f"Batch error: {result['error']}"
+            if self.debug:
+                print(self.msg)
+            return self._set_retry_info(self._llm_response([], state), 0, "batch", self.msg)
+        body = result['body']
+        message = body['choices'][0]['message']
+        state['request_id'] = body.get('id')
+        state['finish_reason'] = body['choices'][0].get('finish_reason')
+        state['result'] = message.get('content') or ""
+        state['reasoning_content'] = message.get('reasoning_content') or ""
+        state['usage'] = body.get('usage')
+        try:
+            data = self._finish_llm(state, llm_model, mapping, keywords)
+            self._check_extracted(state['result'], data)
+        except Exception as e:
+            self._llm_failed(state, e)
+            return self._set_retry_info(self._llm_response([], state), 0, classify(e), e)
+        return self._set_retry_info(self._llm_response(data, state), 0)
+
+    @staticmethod
+    def _llm_response(data, state):
+        metrics.record_llm(state['usage'])
+        r={'data': data, 'usage': state['usage'], 'cache_hit': False}
+        if state['reasoning_content']:
+            r['reasoning_content']=state['reasoning_content']
+        if state.get('stopped_early'):
+            r['stopped_early']=True
+        if state.get('finish_reason') == 'length':
+            # 输出达到max_tokens被截断，data可能只是修复后的部分结果
+            r['truncated']=True
+        return r
+
+    @staticmethod
+    def _llm_cache_key(request):
+        # 按请求内容生成键值，用于响应缓存和合并并发请求
+        return llm_cache.LLMResponseCache.make_key(request)
+
+    def _run_llm_cache_key(self, llm_model, prompt, file_id=None, keywords=[], schema=None):
+        # 用替换敏感词之前的prompt生成键值，替换用的随机串每次不同
+        messages, _ = self._build_llm_messages(prompt, file_id)
+        kwargs = self._llm_request_kwargs(llm_model, messages)
+        request = {
+            "model": llm_model,
+            "messages": messages,
+            "keywords": list(keywords),
+            "file_id": file_id,
+            "extra_body": kwargs["extra_body"],
+            "max_tokens": kwargs["max_tokens"],
+        }
+        if schema is not None:
+            request["schema"] = schema
+            request["structured_output"] = self.structured_output
+        return self._llm_cache_key(request)
+
+    def _llm_cache(self):
+        # 进程内按路径共享的缓存实例，使用当前的容量和过期时间设置
+        return llm_cache.get_cache(self.cache_path, max_entries=self.cache_max_entries,
+                                   max_bytes=self.cache_max_bytes, ttl=self.cache_ttl)
+
+    def _load_llm_cache(self, key, force_refresh=False):
+        # 读取缓存，命中时返回保存的结果并标记cache_hit
+        if not self.cache_path or force_refresh:
+            return None
+        try:
+            cached = self._llm_cache().get(key)
+        except Exception as e:
+            message = f"LLM cache read error: {str(e)}"
+            if self.quiet:
+                logger.warning(message)
+            else:
+                print(message)
+            return None
+        if cached is None:
+            return None
+        if self.debug and not self.quiet:
+            print("LLM Cache Found: {}".format(key))
+        else:
+            logger.debug("LLM Cache Found: %s", key)
+        metrics.record_cache_hit()
+        cached['cache_hit'] = True
+        return self._set_retry_info(cached, 0)
+
+    @staticmethod
+    def _coalesced(response):
+        # 结果来自其他调用方同时发起的相同请求，本次调用没有产生新的用量
+        metrics.record_coalesced()
+        response['coalesced'] = True
+        return response
+
+    def _save_llm_cache(self, key, response):
+        # 只缓存成功提取到完整数据的结果，失败的调用下次仍会重试
+        # 不缓存：修正后仍不符合schema的结果（下次重新请求和修正）、输出被截断的部分结果
+        # 提前结束的流式输出只在JSON代码块完整时发生(stopped_early)，可以缓存
+        if not self.cache_path or not response.get('data'):
+            return
+        if response.get('schema_errors') or response.get('truncated'):
+            return
+        try:
+            self._llm_cache().set(
+                key, {k: v for k, v in response.items() if k not in ('cache_hit', 'coalesced', 'retries', 'error')})
+        except Exception as e:
+            message = f"LLM cache write error: {str(e)}"
+            if self.quiet:
+                logger.warning(message)
+            else:
+                print(message)
+
+    def run_llm(self, file_id=None, llm_model='qwen-long', prompt=None,keywords=[],force_refresh=False,batch=False,schema=None):
         # 根据大模型从PDF文件中提取信息
         # Prompt中不支持动态变量，获得JSON数据以后再处理
         # pdf_file为URL时，先下载到本地临时文件夹，然后再上传
+        # 相同请求的结果从缓存读取（返回值中cache_hit为True），force_refresh=True时重新请求并更新缓存
+        # batch=True 且设置了 AITEP.batch_collector 时，请求与其他药物的请求合并为批处理任务提交（对延迟不敏感的提示词）
+        # schema为输出的JSON Schema：按AITEP.structured_output请求JSON模式，提取后在本地校验，不符合时发送一次修正请求
         """
         Extract sections from the uploaded PDF using OpenAI
         """
         self.init_llm()
         if file_id is None and self.file_id:
             file_id=self.file_id
-        data = []
-        result = ""
-        reasoning_content=""
-        res = None
-        usage = None
-        try:
-            # 替换敏感词
-            mapping={}
-            for keyword in keywords:
-                rstring=self.rand_string()
-                mapping[keyword]=rstring
-                prompt = re.sub(keyword, rstring, prompt, flags=re.IGNORECASE)
-            
-            messages = [
-                {'role': 'system', 'content': 'You are an expert at extracting structured information from PDE reports.'}
-            ]
-            if file_id:
-                messages.append({'role': 'system', 'content': f'fileid://{file_id}'})
-            messages.append({'role': 'user', 'content': prompt})
+        file_id=self._replaced_file_ids.get(file_id, file_id)
+        # 并发的相同请求只发送一次，其余调用方共享结果（返回值中coalesced为True）
+        cache_key = self._run_llm_cache_key(llm_model, prompt, file_id, keywords, schema)
+        response, shared = llm_flight.do((cache_key, force_refresh), self._request_llm,
+                                         cache_key, file_id, llm_model, prompt, keywords, force_refresh, batch, schema)
+        # 登记中复用的file_id被服务端拒绝时重新上传文件，用新的file_id再请求一次
+        new_file_id = self._refresh_file_id(file_id) if self._file_rejected(response, file_id) else None
+        if new_file_id:
+            return self.run_llm(new_file_id, llm_model, prompt, keywords, force_refresh, batch, schema)
+        return self._coalesced(response) if shared else response
 
-            # Use non-streaming version of chat completion to simplify handling
-            completion = self.client.chat.completions.create(
-                model=llm_model,
-                extra_body={"enable_search": True},  # 控制是否启用互联网搜索
-                messages=messages,
-                stream=True,
-                max_tokens=self.max_tokens,
-                stream_options={"include_usage": True}
-            )
-            request_id=None
-            for chunk in completion:
-                res = json.loads(chunk.model_dump_json())
-                
-                if request_id is None:
-                    request_id=res['id']
-                    print("request id: {}\n\n==================LLM model ({}) Output Start==================\n".format(request_id,llm_model))
-                choices = res['choices']
-                if len(choices) > 0:
-                    output=""
-                    # print(choices[0])
-                    if choices[0].get('delta').get('reasoning_content'):
-                        output=choices[0]['delta']['reasoning_content']
-                        if output:
-                            reasoning_content += output
-                    else:
-                        output=choices[0]['delta']['content']
-                        if output:
-                            result += output
-                    if output:
-                        print(output, end="")
-                else:
-                    usage = res['usage']
-            if self.debug:
-                print("\n\n==================LLM model ({}) Output End==================".format(llm_model))
-                print("\n==================Token Usage of ({})==================".format(llm_model))
-                print(usage)
-                print("")
-
-            # 替换回敏感词
-            for keyword in keywords:
-                rstring=mapping.get(keyword)
-                result=result.replace(rstring,keyword)
-                result=re.sub(rstring,keyword, result, flags=re.IGNORECASE)
-            data = self.extract_json_from_llm_output(result)
-        except Exception as e:
-            self.msg = f"Extract error: {str(e)}"
-            if self.debug:
-                print(self.msg)
-                print(result)
-                print(res)
-        
-        r={'data': data, 'usage': usage}
-        if reasoning_content:
-            r['reasoning_content']=reasoning_content
-        return r
+    def _request_llm(self, cache_key, file_id, llm_model, prompt, keywords, force_refresh, batch=False, schema=None):
+        # run_llm 的实际请求：先查缓存，未命中时请求大模型并写入缓存
+        cached = self._load_llm_cache(cache_key, force_refresh)
+        if cached is not None:
+            return cached
+        messages, mapping = self._build_llm_messages(prompt, file_id, keywords)
+        if batch and self.batch_collector is not None:
+            result = self.batch_collector.submit(self.client, self._batch_body(llm_model, messages, schema)).result()
+            response = self._batch_response(result, llm_model, mapping, keywords)
+            response = self._check_schema(response, schema, llm_model, messages, mapping, keywords)
+            self._save_llm_cache(cache_key, response)
+            return response
+        attempt, kind, error = 0, None, None
+        while True:
+            state = {'request_id': None, 'result': "", 'reasoning_content': "", 'usage': None}
+            try:
+                data = self._stream_llm(state, llm_model, messages, mapping, keywords, schema)
+                error = None
+                break
+            except Exception as e:
+                data, error = [], e
+                self._llm_failed(state, e)
+                kind, wait = self._retry_delay(llm_model, e, attempt)
+                if wait is None:
+                    break
+                time.sleep(wait)
+                attempt += 1
+
+        response = self._set_retry_info(self._llm_response(data, state), attempt, kind, error)
+        response = self._check_schema(response, schema, llm_model, messages, mapping, keywords)
+        self._save_llm_cache(cache_key, response)
+        return response
+
+    async def arun_llm(self, file_id=None, llm_model='qwen-long', prompt=None,keywords=[],force_refresh=False,batch=False,schema=None):
+        # run_llm 的异步版本，使用AsyncOpenAI客户端，可在同一个事件循环中并发大量请求
+        client = self.init_async_llm()
+        if file_id is None and self.file_id:
+            file_id=self.file_id
+        file_id=self._replaced_file_ids.get(file_id, file_id)
+        cache_key = self._run_llm_cache_key(llm_model, prompt, file_id, keywords, schema)
+        response, shared = await llm_flight.ado((cache_key, force_refresh), self._arequest_llm,
+                                                client, cache_key, file_id, llm_model, prompt, keywords, force_refresh, batch, schema)
+        new_file_id = await asyncio.to_thread(self._refresh_file_id, file_id) if self._file_rejected(response, file_id) else None
+        if new_file_id:
+            return await self.arun_llm(new_file_id, llm_model, prompt, keywords, force_refresh, batch, schema)
+        return self._coalesced(response) if shared else response
+
+    async def _arequest_llm(self, client, cache_key, file_id, llm_model, prompt, keywords, force_refresh, batch=False, schema=None):
+        # _request_llm 的异步版本
+        cached = self._load_llm_cache(cache_key, force_refresh)
+        if cached is not None:
+            return cached
+        messages, mapping = self._build_llm_messages(prompt, file_id, keywords)
+        if batch and self.batch_collector is not None:
+            # 批处理任务使用同步客户端，在后台线程中提交和轮询
+            self.init_llm()
+            result = await asyncio.wrap_future(self.batch_collector.submit(self.client, self._batch_body(llm_model, messages, schema)))
+            response = self._batch_response(result, llm_model, mapping, keywords)
+            response = await self._acheck_schema(client, response, schema, llm_model, messages, mapping, keywords)
+            self._save_llm_cache(cache_key, response)
+            return response
+        attempt, kind, error = 0, None, None
+        while True:
+            state = {'request_id': None, 'result': "", 'reasoning_content': "", 'usage': None}
+            try:
+                data = await self._astream_llm(client, state, llm_model, messages, mapping, keywords, schema)
+                error = None
+                break
+            except Exception as e:
+                data, error = [], e
+                self._llm_failed(state, e)
+                kind, wait = self._retry_delay(llm_model, e, attempt)
+                if wait is None:
+                    break
+                await asyncio.sleep(wait)
+                attempt += 1
+
+        response = self._set_retry_info(self._llm_response(data, state), attempt, kind, error)
+        response = await self._acheck_schema(client, response, schema, llm_model, messages, mapping, keywords)
+        self._save_llm_cache(cache_key, response)
+        return response
+
+    def run_llm_batch(self, requests, llm_model='qwen-long', force_refresh=False,
+                      completion_window="24h", poll_interval=30, timeout=None):
+        # 以一个批处理任务执行多个请求，适合夜间批量运行的F3/F4/F5/PoD/α等对延迟不敏感的提示词
+        # requests: {custom_id: {"prompt": ..., "llm_model": ..., "keywords": [...], "file_id": ..., "schema": ...}}，llm_model缺省时使用参数llm_model
+        # 返回 {custom_id: 与run_llm相同格式的结果}；命中缓存的请求不提交，内容相同的请求只提交一次
+        self.init_llm()
+        responses = {}
+        pending = {}
+        for custom_id, request in requests.items():
+            model = request.get('llm_model', llm_model)
+            keywords = request.get('keywords', [])
+            file_id = request.get('file_id') or self.file_id
+            schema = request.get('schema')
+            cache_key = self._run_llm_cache_key(model, request['prompt'], file_id, keywords, schema)
+            cached = self._load_llm_cache(cache_key, force_refresh)
+            if cached is not None:
+                responses[custom_id] = cached
+                continue
+            if cache_key not in pending:
+                messages, mapping = self._build_llm_messages(request['prompt'], file_id, keywords)
+                pending[cache_key] = {'body': self._batch_body(model, messages, schema), 'model': model,
+                                      'messages': messages, 'mapping': mapping, 'keywords': keywords,
+                                      'schema': schema, 'custom_ids': []}
+            pending[cache_key]['custom_ids'].append(custom_id)
+
+        if pending:
+            job = LLMBatchJob(self.client, completion_window, poll_interval, timeout)
+            for cache_key, entry in pending.items():
+                job.add(cache_key, entry['body'])
+            try:
+                results = job.run()
+            except Exception as e:
+                results = {cache_key: {"body": None, "error": str(e)} for cache_key in pending}
+            for cache_key, entry in pending.items():
+                response = self._batch_response(
+                    results[cache_key], entry['model'], entry['mapping'], entry['keywords'])
+                response = self._check_schema(response, entry['schema'], entry['model'],
+                                              entry['messages'], entry['mapping'], entry['keywords'])
+                self._save_llm_cache(cache_key, response)
+                first, *others = entry['custom_ids']
+                responses[first] = response
+                for custom_id in others:
+                    responses[custom_id] = self._coalesced(copy.deepcopy(response))
+        return responses
+
+    async def arun_llm_batch(self, requests, **kwargs):
+        # run_llm_batch 的异步版本，提交和轮询在线程中执行
+        return await asyncio.to_thread(self.run_llm_batch, requests, **kwargs)
 
     def upload_to_openai(self, file=None):
         """
         Upload a local file to OpenAI
+        设置了file_registry_path时，相同内容的文件上传过且未过期就直接返回登记的file_id，不再上传
         """
         if file is None and self.pdf_file:
             file=self.pdf_file
         try:
-            if self.debug:
-                print("Uploading to openai: {}".format(file))
+            self.init_llm()
             if not os.path.exists(file):
                 raise FileNotFoundError(f"File not found: {file}")
 
+            registry = self._file_registry()
+            if registry:
+                sha256 = registry.hash_file(file)
+                file_id = registry.get_upload(sha256, self._account(), self.file_id_ttl)
+                if file_id and self._file_id_valid(file_id):
+                    if self.debug:
+                        print(f"File already uploaded. File ID: {file_id}")
+                    self.file_id=file_id
+                    return self.file_id
+                if file_id:
+                    registry.remove_upload(file_id)
+
+            if self.debug:
+                print("Uploading to openai: {}".format(file))
             # Use OpenAI SDK to upload the file
             with open(file, "rb") as f:
                 file_object = self.client.files.create(
@@ -436,6 +1427,9 @@ class AITEP:
                 )
             if self.debug:
                 print(f"Successfully uploaded file. File ID: {file_object.id}")
+            if registry:
+                registry.set_upload(sha256, self._account(), file_object.id,
+                                    registry.local_file(sha256) or os.path.abspath(file))
             self.file_id=file_object.id
             return self.file_id
         except Exception as e:
@@ -444,6 +1438,62 @@ class AITEP:
                 print(self.msg)
             return None
 
+    def _file_registry(self):
+        # 进程内共享的文件登记，未设置file_registry_path或无法打开时返回None
+        if not self.file_registry_path:
+            return None
+        try:
+            return file_registry.get_registry(self.file_registry_path)
+        except Exception as e:
+            print(f"File registry error: {str(e)}")
+            return None
+
+    def _account(self):
+        # file_id只在上传它的账号和服务地址下有效，登记时按两者的摘要区分
+        return hashlib.sha256(f"{self.base_url}\n{self.api_key}".encode('utf-8')).hexdigest()[:16]
+
+    def _file_id_valid(self, file_id, verify=None):
+        # 向服务端确认file_id仍然存在；只有返回4xx时判定为失效，网络错误等情况仍按有效处理
+        if not (self.verify_file_id if verify is None else verify):
+            return True
+        try:
+            self.client.files.retrieve(file_id)
+            return True
+        except Exception as e:
+            return classify(e) != CLIENT_ERROR
+
+    def _refresh_file_id(self, file_id):
+        # 请求以4xx失败时，如果file_id来自登记且服务端已不再保存该文件，用登记的本地文件重新上传，返回新的file_id
+        # 不需要或无法重新上传时返回None
+        registry = self._file_registry()
+        if registry is None or not file_id:
+            return None
+        if file_id in self._replaced_file_ids:
+            return self._replaced_file_ids[file_id]
+        new_file_id, _ = upload_flight.do(file_id, self._reupload, registry, file_id)
+        if new_file_id:
+            self._replaced_file_ids[file_id] = new_file_id
+        return new_file_id
+
+    def _reupload(self, registry, file_id):
+        entry = registry.find_upload(file_id, self._account())
+        if entry is None:
+            return None
+        self.init_llm()
+        if self._file_id_valid(file_id, verify=True):
+            return None
+        registry.remove_upload(file_id)
+        path = registry.local_file(entry['sha256']) or entry['path']
+        if not path or not os.path.exists(path):
+            return None
+        print(f"File ID {file_id} was rejected, uploading {path} again")
+        return self.upload_to_openai(path)
+
+    @staticmethod
+    def _file_rejected(response, file_id):
+        # 带file_id的请求是否以4xx失败（可能是file_id已失效）
+        error = response.get('error') if response else None
+        return bool(file_id and error and error.get('type') == CLIENT_ERROR)
 
 if __name__ == "__main__":
     name="aspirin"
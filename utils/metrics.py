@@ -0,0 +1,74 @@
+import contextvars
+from contextlib import contextmanager
+
+# 当前步骤的计数器，Pipeline在每个步骤开始时设置
+# asyncio任务和asyncio.to_thread会复制上下文，步骤内部的并发调用都记录到同一个计数器
+_current_metrics = contextvars.ContextVar('aitep_metrics', default=None)
+
+
+def _new_metrics():
+    return {
+        "llm_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "search_calls": 0,
+        "cache_hits": 0,
+        "coalesced": 0,
+        "context_tokens_saved": 0,
+    }
+
+
+@contextmanager
+def collect():
+    """
+    在with块内收集LLM用量、搜索次数和缓存命中次数
+    用法:
+        with collect() as metrics:
+            ...
+        print(metrics["prompt_tokens"])
+    """
+    metrics = _new_metrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def record_llm(usage):
+    """记录一次LLM调用及其token用量，usage为接口返回的usage字典"""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return
+    metrics["llm_calls"] += 1
+    if usage:
+        metrics["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        metrics["completion_tokens"] += usage.get("completion_tokens") or 0
+
+
+def record_search():
+    """记录一次搜索调用（包括命中缓存的调用）"""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics["search_calls"] += 1
+
+
+def record_cache_hit():
+    """记录一次缓存命中"""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics["cache_hits"] += 1
+
+
+def record_coalesced():
+    """记录一次与其他调用方合并、未单独发起的请求"""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics["coalesced"] += 1
+
+
+def record_context_saved(tokens):
+    """记录上下文压缩从提示词中去掉的token数"""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics["context_tokens_saved"] += tokens
@@ -0,0 +1,116 @@
+import json
+import math
+import threading
+
+# 统计的计数字段，与 utils.metrics 中的字段一致
+COUNTERS = ("llm_calls", "prompt_tokens", "completion_tokens", "search_calls", "cache_hits", "coalesced",
+            "context_tokens_saved")
+
+
+def percentile(values, p):
+    """最近秩法计算百分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def _summary(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else None,
+        "total": sum(values),
+    }
+
+
+class PipelineProfiler:
+    """
+    订阅Pipeline的step_metrics/drug_metrics事件，记录每个步骤和每个药物的
+    耗时、LLM token用量、搜索次数和缓存命中次数，批处理结束后输出汇总报告
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.step_records = []
+        self.drug_records = []
+        # 正在处理的药物的累计计数（按Pipeline每次处理的run_id区分），药物处理完成时写入drug_records
+        self._drug_totals = {}
+
+    def attach(self, event_bus, **subscribe_kwargs):
+        """
+        注册到EventBus
+        subscribe_kwargs 传给EventBus.subscribe，例如 background=True 在后台线程中统计（生成报告前先调用event_bus.join()）
+        """
+        event_bus.subscribe("step_metrics", self.on_step_metrics, **subscribe_kwargs)
+        event_bus.subscribe("drug_metrics", self.on_drug_metrics, **subscribe_kwargs)
+        return self
+
+    @staticmethod
+    def _drug_key(record):
+        # 同一成分和途径的多行（不同APID）可能同时处理，按run_id区分；没有run_id的事件按APID、成分和途径区分
+        return record.get("run_id") or (record.get("APID"), record["drug_name"], record["route"])
+
+    def on_step_metrics(self, record):
+        with self._lock:
+            self.step_records.append(dict(record))
+            totals = self._drug_totals.setdefault(self._drug_key(record), {counter: 0 for counter in COUNTERS})
+            for counter in COUNTERS:
+                totals[counter] += record.get(counter, 0)
+
+    def on_drug_metrics(self, record):
+        with self._lock:
+            totals = self._drug_totals.pop(self._drug_key(record), {counter: 0 for counter in COUNTERS})
+            self.drug_records.append({**record, **totals})
+
+    def report(self):
+        """
+        生成汇总报告
+        返回:
+            dict: steps 为每个步骤各指标的 p50/p95/max/total，drugs 为单个药物整体的同类统计，per_drug 为每个药物的明细
+        """
+        with self._lock:
+            step_records = list(self.step_records)
+            drug_records = list(self.drug_records)
+
+        steps = {}
+        for record in step_records:
+            steps.setdefault(record["step"], []).append(record)
+
+        report = {"steps": {}, "drugs": {}, "per_drug": drug_records}
+        for step, records in steps.items():
+            report["steps"][step] = {
+                "count": len(records),
+                "failures": sum(1 for r in records if not r.get("success", True)),
+                "wall_time": _summary([r["wall_time"] for r in records]),
+                **{counter: _summary([r.get(counter, 0) for r in records]) for counter in COUNTERS},
+            }
+        if drug_records:
+            report["drugs"] = {
+                "count": len(drug_records),
+                "wall_time": _summary([r["wall_time"] for r in drug_records]),
+                **{counter: _summary([r.get(counter, 0) for r in drug_records]) for counter in COUNTERS},
+            }
+        return report
+
+    def format_report(self):
+        """以表格形式输出各步骤的耗时和用量"""
+        report = self.report()
+        lines = ["{:<28}{:>6}{:>10}{:>10}{:>10}{:>12}{:>12}{:>11}{:>9}{:>9}".format(
+            "step", "n", "p50(s)", "p95(s)", "max(s)", "prompt_tok", "compl_tok", "saved_tok", "search", "cached")]
+        rows = list(report["steps"].items())
+        if report["drugs"]:
+            rows.append(("[per drug]", report["drugs"]))
+        for name, stats in rows:
+            wall_time = stats["wall_time"]
+            lines.append("{:<28}{:>6}{:>10.2f}{:>10.2f}{:>10.2f}{:>12}{:>12}{:>11}{:>9}{:>9}".format(
+                name, stats["count"], wall_time["p50"], wall_time["p95"], wall_time["max"],
+                stats["prompt_tokens"]["total"], stats["completion_tokens"]["total"],
+                stats["context_tokens_saved"]["total"], stats["search_calls"]["total"], stats["cache_hits"]["total"]))
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        """把汇总报告写入JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,156 @@
+import re
+import time
+import random
+import asyncio
+import threading
+
+# 各模型每分钟的请求数(rpm)和token数(tpm)上限，按账号的实际配额修改；未列出的模型不限速
+DEFAULT_LIMITS = {
+    "qwen-plus": {"rpm": 600, "tpm": 1000000},
+    "qwen-long": {"rpm": 100, "tpm": 1000000},
+}
+
+_CJK = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+
+def estimate_tokens(messages):
+    """
+    请求前估算prompt的token数：中文字符按1个token，其他字符按4个字符1个token，每条消息另加4个token
+    """
+    tokens = 0
+    for message in messages:
+        content = str(message.get('content') or "")
+        cjk = len(_CJK.findall(content))
+        tokens += cjk + (len(content) - cjk + 3) // 4 + 4
+    return tokens
+
+
+def retry_after(error):
+    """从429错误的响应头中读取Retry-After(秒)，没有时返回None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    for name in ('retry-after-ms', 'retry-after'):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if name == 'retry-after-ms' else seconds
+    return None
+
+
+class TokenBucket:
+    """
+    令牌桶，容量为capacity，每秒补充rate个令牌
+    reserve 立即扣除令牌（允许欠账），返回需要等待的秒数，等待在锁外进行，同步和异步调用方都可以使用
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self._refill(now)
+        # 单次请求超过桶容量时按容量计算，避免永远等不到
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount, now):
+        """按实际用量修正，amount为正时补扣，为负时退还"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    按模型限制每分钟请求数和token数，并在收到429后让同一模型的所有请求一起退避
+    用法:
+        wait = limiter.acquire("qwen-plus", estimated_tokens)   # 同步，必要时sleep
+        await limiter.aacquire("qwen-plus", estimated_tokens)    # 异步
+        limiter.settle("qwen-plus", estimated_tokens, usage)     # 请求结束后按实际用量修正
+        limiter.backoff("qwen-plus", attempt, retry_after)       # 收到429时调用
+    """
+
+    def __init__(self, limits=None, backoff_base=1.0, backoff_cap=60.0):
+        """
+        :param limits: {模型: {"rpm": 每分钟请求数, "tpm": 每分钟token数}}，默认为DEFAULT_LIMITS
+        :param backoff_base: 指数退避的初始等待(秒)
+        :param backoff_cap: 指数退避的最长等待(秒)
+        """
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._blocked_until = {}
+
+    def _model_buckets(self, model):
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            limit = self.limits.get(model) or {}
+            buckets = {}
+            if limit.get("rpm"):
+                buckets["rpm"] = TokenBucket(limit["rpm"], limit["rpm"] / 60)
+            if limit.get("tpm"):
+                buckets["tpm"] = TokenBucket(limit["tpm"], limit["tpm"] / 60)
+            self._buckets[model] = buckets
+        return buckets
+
+    def reserve(self, model, tokens=0):
+        """预留一次请求和tokens个token，返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._model_buckets(model)
+            waits = [self._blocked_until.get(model, now) - now]
+            if "rpm" in buckets:
+                waits.append(buckets["rpm"].reserve(1, now))
+            if "tpm" in buckets:
+                waits.append(buckets["tpm"].reserve(tokens, now))
+        return max(0.0, *waits)
+
+    def acquire(self, model, tokens=0):
+        """同步等待直到可以发送请求，返回等待的秒数"""
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, model, tokens=0):
+        """acquire的异步版本"""
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def settle(self, model, estimated, usage):
+        """请求结束后用接口返回的usage修正预留的token数"""
+        if not usage:
+            return
+        used = usage.get("total_tokens") or (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        with self._lock:
+            bucket = self._model_buckets(model).get("tpm")
+            if bucket is not None:
+                bucket.adjust(used - estimated, time.monotonic())
+
+    def backoff(self, model, attempt, retry_after=None):
+        """
+        收到429后暂停该模型的所有请求，返回暂停的秒数
+        有Retry-After时按其等待，否则按 min(cap, base * 2^attempt) 的随机比例等待（full jitter）
+        """
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        with self._lock:
+            until = time.monotonic() + delay
+            self._blocked_until[model] = max(self._blocked_until.get(model, 0), until)
+        return delay
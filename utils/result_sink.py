@@ -0,0 +1,75 @@
+import os
+import json
+import threading
+
+
+class JsonlResultSink:
+    """逐条追加写入处理结果的JSONL文件，支持中断后续跑"""
+
+    def __init__(self, path):
+        """
+        初始化结果文件
+        :param path: JSONL文件路径，已存在时在末尾追加
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # 扫描已有文件，记录status为success的(APID, api_id)
+        self.completed = self._scan()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def row_key(APID, api_id):
+        """生成行的键值，APID/api_id 统一按字符串比较（Excel读出的id可能是数字）"""
+        return (str(APID), str(api_id))
+
+    def _scan(self):
+        """读取已有结果，返回已成功处理的行的键值集合"""
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程中断时可能留下写了一半的行，跳过
+                continue
+            if result.get('status') == 'success':
+                completed.add(self.row_key(result.get('APID'), result.get('api_id')))
+        # 最后一行不完整时先补换行，避免新记录接在半行后面
+        if content and not content.endswith('\n'):
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n')
+        return completed
+
+    def is_done(self, APID, api_id):
+        """判断该行是否已经成功处理过"""
+        return self.row_key(APID, api_id) in self.completed
+
+    def write(self, result):
+        """
+        追加一条结果并立即落盘
+        同一行重跑后会再次追加，读取时以最后一条记录为准
+        """
+        line = json.dumps(result, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if result.get('status') == 'success':
+                self.completed.add(self.row_key(result.get('APID'), result.get('api_id')))
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
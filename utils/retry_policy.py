@@ -0,0 +1,72 @@
+import random
+import asyncio
+
+# 错误类型
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER_ERROR = "server_error"
+RATE_LIMIT = "rate_limit"
+JSON_EXTRACTION = "json_extraction"
+CLIENT_ERROR = "client_error"
+UNKNOWN = "unknown"
+
+# 按异常类名识别各HTTP客户端(openai/httpx/requests)的错误，避免在这里导入这些库
+_TIMEOUT_NAMES = {"APITimeoutError", "TimeoutException", "ReadTimeout", "ConnectTimeout", "WriteTimeout", "PoolTimeout", "Timeout"}
+_CONNECTION_NAMES = {"APIConnectionError", "ConnectError", "ReadError", "WriteError", "RemoteProtocolError",
+                     "NetworkError", "TransportError", "ChunkedEncodingError"}
+
+
+class JSONExtractionError(Exception):
+    """LLM输出中没有可解析的JSON"""
+
+
+def classify(error):
+    """返回异常的错误类型"""
+    if isinstance(error, JSONExtractionError):
+        return JSON_EXTRACTION
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or names & _TIMEOUT_NAMES:
+        return TIMEOUT
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return RATE_LIMIT
+    if isinstance(status, int) and status >= 500:
+        return SERVER_ERROR
+    if isinstance(status, int) and status >= 400:
+        return CLIENT_ERROR
+    if isinstance(error, ConnectionError) or names & _CONNECTION_NAMES:
+        return CONNECTION
+    return UNKNOWN
+
+
+class RetryPolicy:
+    """
+    按错误类型决定是否重试，重试间隔为带抖动的指数退避 min(cap, base * 2^attempt)
+    默认重试超时、连接错误、5xx、429和JSON提取失败，4xx等其他错误直接返回
+    """
+
+    def __init__(self, max_retries=3, base=1.0, cap=30.0,
+                 retry_on=(TIMEOUT, CONNECTION, SERVER_ERROR, RATE_LIMIT, JSON_EXTRACTION), max_retries_by_type=None):
+        """
+        :param max_retries: 每次调用最多重试的次数
+        :param base: 第一次重试的等待(秒)
+        :param cap: 最长等待(秒)
+        :param retry_on: 需要重试的错误类型
+        :param max_retries_by_type: 按错误类型覆盖max_retries，例如 {"rate_limit": 5}
+        """
+        self.max_retries = max_retries
+        self.base = base
+        self.cap = cap
+        self.retry_on = set(retry_on)
+        self.max_retries_by_type = {RATE_LIMIT: 5} if max_retries_by_type is None else max_retries_by_type
+
+    def should_retry(self, kind, attempt):
+        """attempt为已经重试的次数"""
+        return kind in self.retry_on and attempt < self.max_retries_by_type.get(kind, self.max_retries)
+
+    def delay(self, attempt):
+        """第attempt次重试前的等待秒数，d = min(cap, base * 2^attempt)，在 [d/2, d] 的范围内随机"""
+        delay = min(self.cap, self.base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
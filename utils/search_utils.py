@@ -1,15 +1,61 @@
 import os
 import json
+import asyncio
 import hashlib
+import logging
+import weakref
+import threading
+import httpx
 import requests
 import configparser
+try:
+    from utils import metrics
+    from utils.singleflight import SingleFlight
+    from utils.json_extract import extract_json
+except ImportError:
+    # 在utils目录内直接运行脚本时
+    import metrics
+    from singleflight import SingleFlight
+    from json_extract import extract_json
 import re
 from googleapiclient.discovery import build
 from azure.ai.projects import AIProjectClient
 from azure.ai.projects.models import MessageRole, BingGroundingTool
 from azure.identity import ClientSecretCredential
+
+logger = logging.getLogger(__name__)
+
+# 异步搜索共用的httpx客户端：连接绑定事件循环，按事件循环和超时缓存，同一事件循环内的请求复用连接池和TLS连接
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+
+def get_async_client(timeout=None):
+    """返回当前事件循环共用的httpx.AsyncClient"""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(timeout)
+        if client is None:
+            client = httpx.AsyncClient(timeout=timeout)
+            clients[timeout] = client
+    return client
+
+
+async def aclose_async_clients():
+    """关闭当前事件循环中的httpx客户端，在事件循环结束前调用；之后的请求会重新创建客户端"""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        clients = _async_clients.pop(loop, {})
+    for client in clients.values():
+        await client.aclose()
 class BaseSearchWithCache:
     """搜索引擎的基类，提供缓存功能"""
+
+    # 网络超时(秒)，避免请求无限期挂起
+    request_timeout = 180
+    # 影响搜索结果的请求参数（模型、系统提示词、条数等），参与版本指纹
+    request_params = {}
     
     def __init__(self, cache_path):
         """
@@ -22,7 +68,8 @@ class BaseSearchWithCache:
         """加载缓存文件"""
         file = "{}/{}".format(self.cache_path, key)
         if os.path.exists(file):
-            print("Cache Found: {}".format(key))
+            logger.debug("Cache Found: %s", key)
+            metrics.record_cache_hit()
             with open(file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         return None
@@ -36,6 +83,15 @@ class BaseSearchWithCache:
         with open(file, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
+    @classmethod
+    def fingerprint(cls, *query_templates):
+        """
+        搜索步骤的版本指纹，由搜索引擎、请求参数(request_params)和查询模板决定
+        只修改注释或代码结构时指纹不变，已保存的步骤结果仍然有效
+        """
+        content = json.dumps([cls.__name__, cls.request_params, *query_templates], ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
     def _generate_cache_key(self, query):
         """生成缓存的键值"""
         return hashlib.md5(query.encode('utf-8')).hexdigest()
@@ -46,22 +102,74 @@ class BaseSearchWithCache:
         """
         raise NotImplementedError("子类必须实现search方法")
 
+    async def asearch(self, query, force_refresh=False):
+        """
+        search的异步版本，默认在线程中执行同步search，子类可用异步HTTP客户端覆盖
+        """
+        return await asyncio.to_thread(self.search, query, force_refresh)
+
+    def _load_cached_result(self, query, force_refresh=False):
+        """读取query对应的缓存，统一返回JSON字符串；无缓存或强制刷新时返回None"""
+        if force_refresh:
+            return None
+        cached_data = self._load_cache(self._generate_cache_key(query))
+        if cached_data is None:
+            return None
+        # 如果缓存已经是字符串形式，直接返回
+        if isinstance(cached_data, str):
+            return cached_data
+        # 如果缓存是对象形式，转换为JSON字符串
+        return json.dumps(cached_data, ensure_ascii=False)
+
 
 
 
 class BochaSearch(BaseSearchWithCache):
     """使用Bocha API进行搜索"""
-    
+
+    api_url = "https://api.bochaai.com/v1/web-search"
+    request_params = {"freshness": "oneYear", "summary": True, "count": 8}
+
     def __init__(self, cache_path='./cached'):
         """
         初始化Bocha搜索类
         :param cache_path: 缓存文件路径
         """
         super().__init__(cache_path)
-        # 读取配置文件
-        config = configparser.ConfigParser()
-        config.read('api.ini')
-        self.api_key = config['Bocha']['ACCESS_TOKEN']
+        # 环境变量可覆盖接口地址和密钥（例如离线压测时指向本地模拟服务）
+        self.api_url = os.environ.get("BOCHA_API_URL", self.api_url)
+        self.api_key = os.environ.get("BOCHA_API_KEY")
+        if not self.api_key:
+            # 读取配置文件
+            config = configparser.ConfigParser()
+            config.read('api.ini')
+            self.api_key = config['Bocha']['ACCESS_TOKEN']
+
+    def _build_request(self, query):
+        """构建Bocha请求的payload和headers"""
+        payload = json.dumps({"query": query, **self.request_params})
+        headers = {
+          'Authorization': f'Bearer {self.api_key}',
+          'Content-Type': 'application/json'
+        }
+        return payload, headers
+
+    def _parse_response(self, query, res):
+        """解析Bocha响应并保存到缓存"""
+        rows = res.get('data', {}).get('webPages', {}).get('value', [])
+        data = []
+        for row in rows:
+            data.append({
+                "url": row.get('url'),
+                "snippet": row.get('snippet'),
+                "summary": row.get('summary'),
+            })
+        
+        # 转换为JSON字符串
+        json_result = json.dumps(data, ensure_ascii=False)
+        # 保存到缓存
+        self._save_cache(self._generate_cache_key(query), json_result)
+        return json_result
 
     def search(self, query, force_refresh=False):
         """
@@ -70,53 +178,45 @@ class BochaSearch(BaseSearchWithCache):
         :param force_refresh: 是否强制刷新缓存
         :return: 搜索结果
         """
-        cache_key = self._generate_cache_key(query)
-
         # 如果缓存中存在结果且不强制刷新，直接返回缓存结果
-        if not force_refresh:
-            cached_data = self._load_cache(cache_key)
-            if cached_data is not None:
-                # 如果缓存已经是字符串形式，直接返回
-                if isinstance(cached_data, str):
-                    return cached_data
-                # 如果缓存是对象形式，转换为JSON字符串
-                else:
-                    return json.dumps(cached_data, ensure_ascii=False)
+        cached = self._load_cached_result(query, force_refresh)
+        if cached is not None:
+            return cached
 
         # 调用Bocha API
         print("调用Bocha API搜索...")
-        url = "https://api.bochaai.com/v1/web-search"
-        payload = json.dumps({
-          "query": query,
-          "freshness": "oneYear",
-          "summary": True,
-          "count": 8
-        })
-        headers = {
-          'Authorization': f'Bearer {self.api_key}',
-          'Content-Type': 'application/json'
-        }
+        payload, headers = self._build_request(query)
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = requests.request("POST", self.api_url, headers=headers, data=payload, timeout=self.request_timeout)
             response.raise_for_status()  # 抛出异常如果请求失败
             
             if response.status_code == 200:
-                res = response.json()
-                rows = res.get('data', {}).get('webPages', {}).get('value', [])
-                data = []
-                for row in rows:
-                    data.append({
-                        "url": row.get('url'),
-                        "snippet": row.get('snippet'),
-                        "summary": row.get('summary'),
-                    })
-                
-                # 转换为JSON字符串
-                json_result = json.dumps(data, ensure_ascii=False)
-                # 保存到缓存
-                self._save_cache(cache_key, json_result)
-                
-                return json_result
+                return self._parse_response(query, response.json())
+        except Exception as e:
+            error_result = {
+                "status": "error",
+                "message": str(e),
+                "query": query
+            }
+            return json.dumps(error_result, ensure_ascii=False)
+
+    async def asearch(self, query, force_refresh=False):
+        """
+        search的异步版本，使用当前事件循环共用的httpx.AsyncClient
+        """
+        cached = self._load_cached_result(query, force_refresh)
+        if cached is not None:
+            return cached
+
+        print("调用Bocha API搜索...")
+        payload, headers = self._build_request(query)
+        try:
+            client = get_async_client(self.request_timeout)
+            response = await client.post(self.api_url, headers=headers, content=payload)
+            response.raise_for_status()
+
+            if response.status_code == 200:
+                return self._parse_response(query, response.json())
         except Exception as e:
             error_result = {
                 "status": "error",
@@ -128,6 +228,11 @@ class BochaSearch(BaseSearchWithCache):
 
 class AzureSearch(BaseSearchWithCache):
     """使用Azure AI Projects API进行搜索"""
+    request_params = {
+        "model": "gpt-35-turbo",
+        "instructions": "You are a helpful assistant that provides accurate information",
+        "connection_name": "groundsearch",
+    }
     
     def __init__(self, cache_path='./azure_search_cached'):
         """
@@ -188,7 +293,7 @@ class AzureSearch(BaseSearchWithCache):
                 )
             
             # 获取Bing搜索连接
-            bing_connection = self.project_client.connections.get(connection_name="groundsearch")
+            bing_connection = self.project_client.connections.get(connection_name=self.request_params["connection_name"])
             conn_id = bing_connection.id
             
             # 初始化Bing工具
@@ -198,9 +303,9 @@ class AzureSearch(BaseSearchWithCache):
             with self.project_client:
                 # 创建代理
                 agent = self.project_client.agents.create_agent(
-                    model="gpt-35-turbo",
+                    model=self.request_params["model"],
                     name="search-assistant",
-                    instructions="You are a helpful assistant that provides accurate information",
+                    instructions=self.request_params["instructions"],
                     tools=bing.definitions,
                 )
                 
@@ -262,13 +367,36 @@ class AzureSearch(BaseSearchWithCache):
             return json.dumps(error_result, ensure_ascii=False)
 class PerplexitySearch(BaseSearchWithCache):
     """使用Perplexity API进行搜索"""
-    
+
+    api_url = "https://api.perplexity.ai/chat/completions"
+    request_params = {
+        "model": "sonar",
+        "system_prompt": "Be precise and concise.",
+        "max_tokens": 6000,
+        "temperature": 0.2,
+        "top_p": 0.9,
+        "search_domain_filter": None,
+        "return_images": False,
+        "return_related_questions": False,
+        "search_recency_filter": "year",  # Set to a valid value or remove this line if not needed
+        "top_k": 0,
+        "stream": False,
+        "presence_penalty": 0,
+        "frequency_penalty": 1,
+        "response_format": None
+    }
+
     def __init__(self, cache_path='./perplexity_cached'):
         """
         初始化Perplexity搜索类
         :param cache_path: 缓存文件路径
         """
         super().__init__(cache_path)
+        # 环境变量可覆盖接口地址和密钥（例如离线压测时指向本地模拟服务）
+        self.api_url = os.environ.get("PERPLEXITY_API_URL", self.api_url)
+        self.api_key = os.environ.get("PERPLEXITY_API_KEY")
+        if self.api_key:
+            return
         # 读取配置文件
         config = configparser.ConfigParser()
         # 获取当前文件所在目录的路径
@@ -283,70 +411,83 @@ class PerplexitySearch(BaseSearchWithCache):
             print(f"Available sections: {config.sections()}")
             raise
 
-    def search(self, query, force_refresh=False):
-        """
-        调用Perplexity API并缓存结果
-        :param query: 搜索关键词
-        :param force_refresh: 是否强制刷新缓存
-        :return: API响应结果
-        """
-        cache_key = self._generate_cache_key(query)
-
-        # 如果缓存中存在结果且不强制刷新，直接返回缓存结果
-        if not force_refresh:
-            cached_data = self._load_cache(cache_key)
-            if cached_data is not None:
-                # 如果缓存已经是字符串形式，直接返回
-                if isinstance(cached_data, str):
-                    return cached_data
-                # 如果缓存是对象形式，转换为JSON字符串
-                else:
-                    return json.dumps(cached_data, ensure_ascii=False)
-
-        # 调用Perplexity API
-        print("调用Perplexity API搜索...")
-        url = "https://api.perplexity.ai/chat/completions"
-        
+    def _build_request(self, query):
+        """构建Perplexity请求的payload和headers"""
+        params = dict(self.request_params)
         payload = {
-            "model": "sonar",
+            "model": params.pop("model"),
             "messages": [
                 {
                     "role": "system",
-                    "content": "Be precise and concise."
+                    "content": params.pop("system_prompt")
                 },
                 {
                     "role": "user",
                     "content": query
                 }
             ],
-            "max_tokens": 6000,
-            "temperature": 0.2,
-            "top_p": 0.9,
-            "search_domain_filter": None,
-            "return_images": False,
-            "return_related_questions": False,
-            "search_recency_filter": "year",  # Set to a valid value or remove this line if not needed
-            "top_k": 0,
-            "stream": False,
-            "presence_penalty": 0,
-            "frequency_penalty": 1,
-            "response_format": None
+            **params
         }
         
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        return payload, headers
+
+    def search(self, query, force_refresh=False):
+        """
+        调用Perplexity API并缓存结果
+        :param query: 搜索关键词
+        :param force_refresh: 是否强制刷新缓存
+        :return: API响应结果
+        """
+        # 如果缓存中存在结果且不强制刷新，直接返回缓存结果
+        cached = self._load_cached_result(query, force_refresh)
+        if cached is not None:
+            return cached
+
+        # 调用Perplexity API
+        print("调用Perplexity API搜索...")
+        payload, headers = self._build_request(query)
 
         try:
-            response = requests.request("POST", url, json=payload, headers=headers)
+            response = requests.request("POST", self.api_url, json=payload, headers=headers, timeout=self.request_timeout)
             response.raise_for_status()  # 抛出异常如果请求失败
             
             if response.status_code == 200:
                 # json string
                 result = response.text
                 # 保存到缓存
-                self._save_cache(cache_key, result)
+                self._save_cache(self._generate_cache_key(query), result)
+                return result
+        except Exception as e:
+            error_result = {
+                "status": "error",
+                "message": str(e),
+                "query": query
+            }
+            return json.dumps(error_result, ensure_ascii=False)
+
+    async def asearch(self, query, force_refresh=False):
+        """
+        search的异步版本，使用当前事件循环共用的httpx.AsyncClient
+        """
+        cached = self._load_cached_result(query, force_refresh)
+        if cached is not None:
+            return cached
+
+        print("调用Perplexity API搜索...")
+        payload, headers = self._build_request(query)
+
+        try:
+            client = get_async_client(self.request_timeout)
+            response = await client.post(self.api_url, json=payload, headers=headers)
+            response.raise_for_status()
+
+            if response.status_code == 200:
+                result = response.text
+                self._save_cache(self._generate_cache_key(query), result)
                 return result
         except Exception as e:
             error_result = {
@@ -394,18 +535,11 @@ class PerplexitySearch(BaseSearchWithCache):
         返回:
             dict: 解析后的JSON对象，如果解析失败返回None
         """
-        dict_pattern = r'```json\s*([\s\S]*?)\s*```'
-        match = re.search(dict_pattern, text)
-        if match:
-            try:
-                return json.loads(match.group(1))
-            except json.JSONDecodeError as e:
-                print("match",match)
-                print("JSON解析失败:", e)
-                return None
-        else:
-            print("未找到 ```json 和 ``` 标记中的 JSON 对象。")
-            return None
+        # 与AITEP.extract_json_from_llm_output使用同一个提取器：有多个代码块时取最后一个，并修复常见的格式问题
+        data = extract_json(text, prefer="last")
+        if data is None:
+            print("未找到可解析的 JSON 对象。")
+        return data
     @staticmethod
     # markdown table format
     def write_to_database(text):
@@ -426,11 +560,16 @@ class GoogleSearch(BaseSearchWithCache):
         :param cache_path: 缓存文件路径
         """
         super().__init__(cache_path)
-        # 读取配置文件
-        config = configparser.ConfigParser()
-        config.read('api.ini')
-        self.api_key = config['google']['API_KEY']
-        self.cse_id = config['google']['CSE_ID']
+        # 环境变量可覆盖接口地址和密钥（例如离线压测时指向本地模拟服务）
+        self.api_endpoint = os.environ.get("GOOGLE_API_ENDPOINT")
+        self.api_key = os.environ.get("GOOGLE_API_KEY")
+        self.cse_id = os.environ.get("GOOGLE_CSE_ID")
+        if not (self.api_key and self.cse_id):
+            # 读取配置文件
+            config = configparser.ConfigParser()
+            config.read('api.ini')
+            self.api_key = config['google']['API_KEY']
+            self.cse_id = config['google']['CSE_ID']
 
     def search(self, query, force_refresh=False, total_results=10, num=10, **kwargs):
         """
@@ -465,7 +604,8 @@ class GoogleSearch(BaseSearchWithCache):
             # 调用Google Custom Search API
             print(f"调用Google Custom Search API搜索，起始位置：{start}，条目数：{num}...")
             try:
-                service = build("customsearch", "v1", developerKey=self.api_key)
+                client_options = {"api_endpoint": self.api_endpoint} if self.api_endpoint else None
+                service = build("customsearch", "v1", developerKey=self.api_key, client_options=client_options)
                 res = service.cse().list(q=query, cx=self.cse_id, num=num, start=start, **kwargs).execute()
                 items = res.get('items', [])
                 
@@ -489,6 +629,10 @@ class GoogleSearch(BaseSearchWithCache):
 
 
 
+# 合并并发的相同搜索请求，同一查询同时只请求一次
+search_flight = SingleFlight()
+
+
 class SearchFactory:
     """搜索工厂类，用于创建不同的搜索实例"""
     
@@ -521,9 +665,13 @@ def perform_search(query, search_method="perplexity", force_refresh=False):
     :param force_refresh: 是否强制刷新缓存
     :return: 搜索结果
     """
+    metrics.record_search()
     try:
         searcher = SearchFactory.get_searcher(search_method)
-        result = searcher.search(query, force_refresh)
+        result, shared = search_flight.do((search_method.lower(), query, force_refresh),
+                                          searcher.search, query, force_refresh)
+        if shared:
+            metrics.record_coalesced()
         #直接返回json string 格式
         return result
     except Exception as e:
@@ -535,6 +683,27 @@ def perform_search(query, search_method="perplexity", force_refresh=False):
         return error_result
 
 
+async def perform_search_async(query, search_method="perplexity", force_refresh=False):
+    """
+    perform_search的异步版本，参数和返回值相同
+    """
+    metrics.record_search()
+    try:
+        searcher = SearchFactory.get_searcher(search_method)
+        result, shared = await search_flight.ado((search_method.lower(), query, force_refresh),
+                                                 searcher.asearch, query, force_refresh)
+        if shared:
+            metrics.record_coalesced()
+        return result
+    except Exception as e:
+        error_result = {
+            "status": "error",
+            "message": f"搜索错误: {str(e)}",
+            "query": query
+        }
+        return error_result
+
+
 if __name__ == '__main__':
     # 测试Bocha搜索
     # print("测试Bocha搜索:")
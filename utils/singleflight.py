@@ -0,0 +1,90 @@
+import copy
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _Abandoned(Exception):
+    """发起请求的调用方被取消，等待者需要自己重新发起请求"""
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一个key同时只执行一次，其余调用方等待并共享结果
+    同步调用(do)和异步调用(ado)共用同一张表，线程池中的同步步骤和事件循环中的异步步骤可以互相等待
+    等待者拿到的是结果的深拷贝，修改返回值不会影响其他调用方
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key):
+        # 返回(future, 是否由当前调用方执行)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = Future()
+            call.owner = threading.get_ident()
+            self._calls[key] = call
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            call.set_exception(error)
+        else:
+            call.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行fn(*args, **kwargs)，相同key的并发调用只执行一次
+        返回:
+            (result, shared): shared为True表示结果来自其他调用方的请求
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    self._finish(key, call, error=e if isinstance(e, Exception) else _Abandoned())
+                    raise
+                self._finish(key, call, result)
+                return result, False
+            if call.owner == threading.get_ident():
+                # 当前线程的事件循环正在执行同一请求，阻塞等待会死锁，直接执行
+                return fn(*args, **kwargs), False
+            try:
+                return copy.deepcopy(call.result()), True
+            except _Abandoned:
+                continue
+
+    async def ado(self, key, coro_fn, *args, **kwargs):
+        """
+        do的异步版本，coro_fn为协程函数
+        发起请求的任务被取消时，等待中的调用方会重新发起请求
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                try:
+                    result = await coro_fn(*args, **kwargs)
+                except BaseException as e:
+                    self._finish(key, call, error=e if isinstance(e, Exception) else _Abandoned())
+                    raise
+                self._finish(key, call, result)
+                return result, False
+            try:
+                # shield：等待者被取消时不影响正在执行的请求
+                result = await asyncio.shield(asyncio.wrap_future(call))
+                return copy.deepcopy(result), True
+            except _Abandoned:
+                continue
+
+    def in_flight(self):
+        """正在执行的请求数"""
+        with self._lock:
+            return len(self._calls)